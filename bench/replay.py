@@ -0,0 +1,141 @@
+#
+# Replay a trace recorded with jove_trace against the sublime stand-in in this directory, and report
+# how long each type of command took. Usage:
+#
+#   python3 bench/replay.py [--repeat N] TRACE...
+#
+# The buffer text isn't in the trace, so each view is filled with generated code of the size it had
+# when it first appeared, and its cursor is put where the first command in it found it. Commands are
+# then run in order through view.run_command, so they go through JOVE's event listeners just as they
+# did in the editor, and the timers they set are run before the next one. Both the time taken here
+# and in the recording (for JOVE's commands) are reported, so a change can be checked against a
+# session it was meant to help.
+#
+import argparse, importlib, json, os, sys, time, types
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+PACKAGE_DIR = os.path.dirname(BENCH_DIR)
+PACKAGE = "jove_package"
+
+sys.path.insert(0, BENCH_DIR)
+import sublime, sublime_plugin
+
+#
+# Load the plugin as a package (it uses relative imports) and register its commands and listeners.
+#
+def load_plugin():
+    if PACKAGE not in sys.modules:
+        package = types.ModuleType(PACKAGE)
+        package.__path__ = [PACKAGE_DIR]
+        sys.modules[PACKAGE] = package
+    module = importlib.import_module(PACKAGE + ".jove")
+    sublime_plugin.load_module(module)
+    return module
+
+#
+# Returns size characters of python-looking code, so the commands have lines, indentation, words and
+# brackets to work on.
+#
+def generate_text(size):
+    pieces = []
+    total = 0
+    n = 0
+    while total < size:
+        piece = ("class Thing%d(object):\n"
+                 "    def method_%d(self, value, other=None):\n"
+                 "        # combine the value with (other or the default)\n"
+                 "        result = [value * %d, other or self.default]\n"
+                 "        return sum(x for x in result if x)\n"
+                 "\n") % (n, n, n)
+        pieces.append(piece)
+        total += len(piece)
+        n += 1
+    return "".join(pieces)[:size]
+
+def read_trace(path):
+    with open(path, encoding="utf-8") as f:
+        header = json.loads(f.readline())
+        if header.get("trace") != 1:
+            raise ValueError("%s: not a version 1 trace" % (path,))
+        return header, [json.loads(line) for line in f if line.strip()]
+
+#
+# Replay entries in a new window. Returns {command: [replayed seconds]}, {command: [recorded ms]}
+# and {command: failures} for the commands the stand-in couldn't run.
+#
+def replay(entries):
+    window = sublime.Window()
+    views = dict()
+    replayed = dict()
+    recorded = dict()
+    failed = dict()
+    for started, index, cmd, args, cursors, size, point, taken in entries:
+        view = views.get(index)
+        if view is None:
+            view = views[index] = window.new_file()
+            view.text = generate_text(size)
+            view.sel().clear()
+            view.sel().add(sublime.Region(max(0, min(point, size))))
+        if window.active_view() is not view:
+            window.focus_view(view)
+        start = time.time()
+        try:
+            view.run_command(cmd, args)
+            sublime.flush_timers()
+        except Exception:
+            failed[cmd] = failed.get(cmd, 0) + 1
+            continue
+        replayed.setdefault(cmd, []).append(time.time() - start)
+        if taken is not None:
+            recorded.setdefault(cmd, []).append(taken)
+    for view in views.values():
+        window.close_view(view)
+    return replayed, recorded, failed
+
+def format_report(replayed, recorded, repeat):
+    width = max([len(cmd) for cmd in replayed] + [7])
+    lines = ["%-*s %7s %10s %9s %9s %13s" % (width, "Command", "Count", "Total ms", "Mean ms", "Max ms",
+                                             "Recorded ms")]
+    rows = sorted(replayed.items(), key=lambda item: -sum(item[1]))
+    for cmd, times in rows:
+        count = len(times) // repeat
+        total = sum(times) * 1000 / repeat
+        mean = sum(times) * 1000 / len(times)
+        taken = recorded.get(cmd)
+        lines.append("%-*s %7d %10.1f %9.3f %9.3f %13s" % (
+            width, cmd, count, total, mean, max(times) * 1000,
+            "%.3f" % (sum(taken) / len(taken),) if taken else "-"))
+    lines.append("%-*s %7d %10.1f" % (width, "Total", sum(len(t) for t in replayed.values()) // repeat,
+                                      sum(sum(t) for t in replayed.values()) * 1000 / repeat))
+    return "\n".join(lines)
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Replay JOVE traces and report the time per command.")
+    parser.add_argument("--repeat", type=int, default=1, help="replay each trace this many times")
+    parser.add_argument("traces", nargs="+")
+    options = parser.parse_args(argv)
+
+    load_plugin()
+    replayed = dict()
+    recorded = dict()
+    failed = dict()
+    for path in options.traces:
+        header, entries = read_trace(path)
+        print("%s: %d commands recorded %s on %s" % (path, len(entries), header.get("started"),
+                                                     header.get("platform")))
+        for i in range(options.repeat):
+            times, taken, failures = replay(entries)
+            for cmd, values in times.items():
+                replayed.setdefault(cmd, []).extend(values)
+            if i == 0:
+                for cmd, values in taken.items():
+                    recorded.setdefault(cmd, []).extend(values)
+                for cmd, count in failures.items():
+                    failed[cmd] = failed.get(cmd, 0) + count
+    print(format_report(replayed, recorded, options.repeat))
+    if failed:
+        print("Not replayed (the stand-in can't run them): %s" % (
+            ", ".join("%s x%d" % item for item in sorted(failed.items())),))
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,997 @@
+#
+# A small, pure python stand-in for the parts of the Sublime Text 3 API used by JOVE. It is good
+# enough to run the commands headless, e.g. to replay a trace (see replay.py). It also counts the
+# calls that would cross into the host API and the characters they copy, so we can measure them.
+#
+import bisect, re, tempfile
+
+LITERAL = 1
+IGNORECASE = 2
+
+CLASS_WORD_START = 1
+CLASS_WORD_END = 2
+CLASS_PUNCTUATION_START = 4
+CLASS_PUNCTUATION_END = 8
+CLASS_SUB_WORD_START = 16
+CLASS_SUB_WORD_END = 32
+CLASS_LINE_START = 64
+CLASS_LINE_END = 128
+CLASS_EMPTY_LINE = 256
+
+DRAW_EMPTY = 1
+HIDE_ON_MINIMAP = 2
+DRAW_EMPTY_AS_OVERWRITE = 4
+DRAW_NO_FILL = 32
+DRAW_NO_OUTLINE = 256
+DRAW_SOLID_UNDERLINE = 512
+PERSISTENT = 16
+HIDDEN = 128
+
+ENCODED_POSITION = 1
+TRANSIENT = 4
+FORCE_GROUP = 8
+
+MONOSPACE_FONT = 1
+KEEP_OPEN_ON_FOCUS_LOST = 2
+
+LINE_HEIGHT = 20
+CHAR_WIDTH = 8
+
+# api crossing counters
+stats = {"calls": 0, "chars": 0}
+
+def _count(chars=0):
+    stats["calls"] += 1
+    stats["chars"] += chars
+
+
+class Region:
+    __slots__ = ("a", "b", "xpos")
+
+    def __init__(self, a, b=None, xpos=-1):
+        if b is None:
+            b = a
+        self.a = a
+        self.b = b
+        self.xpos = xpos
+
+    def begin(self):
+        return min(self.a, self.b)
+
+    def end(self):
+        return max(self.a, self.b)
+
+    def size(self):
+        return abs(self.b - self.a)
+
+    def __len__(self):
+        return self.size()
+
+    def empty(self):
+        return self.a == self.b
+
+    def contains(self, x):
+        if isinstance(x, Region):
+            return self.begin() <= x.begin() and x.end() <= self.end()
+        return self.begin() <= x <= self.end()
+
+    def intersects(self, r):
+        return self.begin() < r.end() and r.begin() < self.end()
+
+    def cover(self, r):
+        return Region(min(self.begin(), r.begin()), max(self.end(), r.end()))
+
+    def __eq__(self, other):
+        return isinstance(other, Region) and self.a == other.a and self.b == other.b
+
+    def __lt__(self, other):
+        return self.begin() < other.begin()
+
+    def __hash__(self):
+        return hash((self.a, self.b))
+
+    def __repr__(self):
+        return "(%d, %d)" % (self.a, self.b)
+
+
+class Selection:
+    def __init__(self, view):
+        self.view = view
+        self.regions = []
+
+    def __len__(self):
+        return len(self.regions)
+
+    def __getitem__(self, i):
+        return Region(self.regions[i].a, self.regions[i].b)
+
+    def __iter__(self):
+        return iter([Region(r.a, r.b) for r in self.regions])
+
+    def clear(self):
+        self.regions = []
+
+    def add(self, region):
+        if isinstance(region, int):
+            region = Region(region, region)
+        self.regions.append(Region(region.a, region.b))
+        self._merge()
+
+    def add_all(self, regions):
+        for r in regions:
+            self.regions.append(Region(r.a, r.b))
+        self._merge()
+
+    def subtract(self, region):
+        self.regions = [r for r in self.regions if r != region]
+
+    def _merge(self):
+        regions = sorted(self.regions, key=lambda r: (r.begin(), r.end()))
+        merged = []
+        for r in regions:
+            if merged:
+                last = merged[-1]
+                if r.begin() < last.end() or r.begin() == last.begin():
+                    if r.end() > last.end():
+                        if last.a <= last.b:
+                            last.b = r.end()
+                        else:
+                            last.a = r.end()
+                    continue
+            merged.append(r)
+        self.regions = merged
+
+
+class Settings:
+    def __init__(self, values=None, parent=None):
+        self.values = dict(values or {})
+        self.parent = parent
+
+    def get(self, key, default=None):
+        if key in self.values:
+            return self.values[key]
+        if self.parent is not None:
+            return self.parent.get(key, default)
+        return default
+
+    def set(self, key, value):
+        self.values[key] = value
+
+    def has(self, key):
+        return key in self.values
+
+    def erase(self, key):
+        self.values.pop(key, None)
+
+    def add_on_change(self, key, fn):
+        pass
+
+    def clear_on_change(self, key):
+        pass
+
+
+_global_settings = Settings({"tab_size": 4, "translate_tabs_to_spaces": True})
+_loaded_settings = {}
+
+def load_settings(name):
+    if name not in _loaded_settings:
+        _loaded_settings[name] = Settings()
+    return _loaded_settings[name]
+
+def save_settings(name):
+    pass
+
+
+class Edit:
+    def __init__(self, view):
+        self.view = view
+
+
+_PYTHON_META = {
+    "increaseIndentPattern": r"^\s*(class|def|elif|else|except|finally|for|if|try|with|while)\b.*:\s*(#.*)?$",
+    "decreaseIndentPattern": r"^\s*(elif|else|except|finally)\b.*:",
+    "shellVariables": [{"name": "TM_COMMENT_START", "value": "# "}],
+}
+
+
+class View:
+    _next_id = 1
+
+    def __init__(self, window=None, text="", name="", file_name=None, is_widget=False):
+        self._id = View._next_id
+        View._next_id += 1
+        self._buffer_id = self._id
+        self._window = window
+        self.text = text
+        self._name = name
+        self._file_name = file_name
+        self._sel = Selection(self)
+        self._regions = {}
+        self._status = {}
+        self._settings = Settings({"is_widget": is_widget}, _global_settings)
+        self._change_count = 0
+        self._top_row = 0
+        self._folds = []
+        self._scratch = False
+        self._read_only = False
+        self._valid = True
+        self.visible_rows = 40
+        self.meta = dict(_PYTHON_META)
+        self.undo_groups = 0
+        self._line_starts = None
+        self._sel.add(Region(0, 0))
+
+    # identity
+    def id(self):
+        return self._id
+
+    def buffer_id(self):
+        return self._buffer_id
+
+    def is_valid(self):
+        return self._valid
+
+    def window(self):
+        return self._window
+
+    def file_name(self):
+        return self._file_name
+
+    def name(self):
+        return self._name
+
+    def set_name(self, name):
+        self._name = name
+
+    def set_scratch(self, value):
+        self._scratch = value
+
+    def set_read_only(self, value):
+        self._read_only = value
+
+    def is_read_only(self):
+        return self._read_only
+
+    def is_dirty(self):
+        return self._change_count > 0 and self._file_name is not None
+
+    def is_loading(self):
+        return False
+
+    def settings(self):
+        return self._settings
+
+    def set_syntax_file(self, name):
+        self._settings.set("syntax", name)
+
+    def change_count(self):
+        return self._change_count
+
+    def encoding(self):
+        return "UTF-8"
+
+    def line_endings(self):
+        return "Unix"
+
+    # status
+    def set_status(self, key, value):
+        self._status[key] = value
+
+    def get_status(self, key):
+        return self._status.get(key, "")
+
+    def erase_status(self, key):
+        self._status.pop(key, None)
+
+    # text access
+    def size(self):
+        _count()
+        return len(self.text)
+
+    def substr(self, x):
+        if isinstance(x, Region):
+            data = self.text[x.begin():x.end()]
+            _count(len(data))
+            return data
+        _count(1)
+        if 0 <= x < len(self.text):
+            return self.text[x]
+        return "\x00"
+
+    def _starts(self):
+        if self._line_starts is None:
+            starts = [0]
+            text = self.text
+            pos = text.find("\n")
+            while pos >= 0:
+                starts.append(pos + 1)
+                pos = text.find("\n", pos + 1)
+            self._line_starts = starts
+        return self._line_starts
+
+    def line(self, x):
+        if isinstance(x, Region):
+            a = self.line(x.begin()).begin()
+            b = self.line(x.end()).end()
+            return Region(a, b)
+        _count()
+        text = self.text
+        x = max(0, min(x, len(text)))
+        a = text.rfind("\n", 0, x) + 1
+        b = text.find("\n", x)
+        if b < 0:
+            b = len(text)
+        return Region(a, b)
+
+    def full_line(self, x):
+        r = self.line(x)
+        b = r.end() + 1 if r.end() < len(self.text) else r.end()
+        return Region(r.begin(), b)
+
+    def lines(self, region):
+        result = []
+        pos = region.begin()
+        while True:
+            line = self.line(pos)
+            result.append(line)
+            if line.end() >= region.end() or line.end() >= len(self.text):
+                break
+            pos = line.end() + 1
+        return result
+
+    def split_by_newlines(self, region):
+        return self.lines(region)
+
+    def rowcol(self, pt):
+        _count()
+        starts = self._starts()
+        row = bisect.bisect_right(starts, pt) - 1
+        return (row, pt - starts[row])
+
+    def text_point(self, row, col):
+        _count()
+        starts = self._starts()
+        if row < 0:
+            return 0
+        if row >= len(starts):
+            return len(self.text)
+        return min(starts[row] + col, len(self.text))
+
+    def word(self, pt):
+        return Region(pt, pt)
+
+    def classify(self, pt):
+        return 0
+
+    def find(self, pattern, start, flags=0):
+        _count()
+        regex = self._regex(pattern, flags)
+        m = regex.search(self.text, start)
+        if m:
+            return Region(m.start(), m.end())
+        return Region(-1, -1)
+
+    def find_all(self, pattern, flags=0, fmt=None, extractions=None):
+        _count()
+        regex = self._regex(pattern, flags)
+        result = []
+        for m in regex.finditer(self.text):
+            if m.start() == m.end():
+                continue
+            result.append(Region(m.start(), m.end()))
+            if fmt is not None and extractions is not None:
+                extractions.append(m.expand(re.sub(r"\$(\d)", r"\\\1", fmt)))
+        return result
+
+    def _regex(self, pattern, flags):
+        if flags & LITERAL:
+            pattern = re.escape(pattern)
+        return re.compile(pattern, re.IGNORECASE if flags & IGNORECASE else 0)
+
+    def _is_word(self, pt, separators):
+        if pt < 0 or pt >= len(self.text):
+            return False
+        ch = self.text[pt]
+        return not (ch in " \t\r\n" or ch in separators)
+
+    def find_by_class(self, pt, forward, classes, separators=""):
+        _count()
+        limit = len(self.text)
+        def matches(p):
+            if classes & CLASS_WORD_START:
+                if self._is_word(p, separators) and not self._is_word(p - 1, separators):
+                    return True
+            if classes & CLASS_WORD_END:
+                if self._is_word(p - 1, separators) and not self._is_word(p, separators):
+                    return True
+            if classes & CLASS_LINE_START and (p == 0 or self.text[p - 1] == "\n"):
+                return True
+            if classes & CLASS_LINE_END and (p == limit or self.text[p] == "\n"):
+                return True
+            return False
+        if forward:
+            p = pt + 1
+            while p < limit and not matches(p):
+                p += 1
+            return min(p, limit)
+        else:
+            p = pt - 1
+            while p > 0 and not matches(p):
+                p -= 1
+            return max(p, 0)
+
+    # scopes (very rough - comments and strings on a single line only)
+    def scope_name(self, pt):
+        _count()
+        base = "source.python "
+        line = self.line(pt)
+        prefix = self.text[line.begin():pt + 1]
+        if re.search(r"(^|\s)(#|//)", prefix):
+            return base + "comment.line "
+        if prefix.count('"') % 2 == 1 or prefix.count("'") % 2 == 1:
+            return base + "string.quoted "
+        return base
+
+    def match_selector(self, pt, selector):
+        scope = self.scope_name(pt)
+        return any(s.strip() and (scope.startswith(s.strip()) or " " + s.strip() in scope)
+                   for s in selector.split(","))
+
+    def score_selector(self, pt, selector):
+        return 1 if self.match_selector(pt, selector) else 0
+
+    def extract_scope(self, pt):
+        return Region(pt, pt)
+
+    def find_by_selector(self, selector):
+        _count()
+        if "entity.name.function" in selector:
+            pattern = r"^[ \t]*(?:async[ \t]+)?def[ \t]+(\w+)"
+        elif "entity.name.class" in selector:
+            pattern = r"^[ \t]*class[ \t]+(\w+)"
+        else:
+            return []
+        return [Region(m.start(1), m.end(1)) for m in re.finditer(pattern, self.text, re.M)]
+
+    def meta_info(self, key, pt):
+        return self.meta.get(key)
+
+    # selection and regions
+    def sel(self):
+        return self._sel
+
+    def add_regions(self, key, regions, scope="", icon="", flags=0):
+        _count()
+        self._regions[key] = [Region(r.a, r.b) for r in regions]
+
+    def get_regions(self, key):
+        _count()
+        return [Region(r.a, r.b) for r in self._regions.get(key, [])]
+
+    def erase_regions(self, key):
+        self._regions.pop(key, None)
+
+    # editing
+    def _adjust(self, pos, removed, inserted):
+        def fix(p):
+            if p >= pos + removed:
+                return p - removed + inserted
+            if p > pos:
+                return pos + (inserted if removed == 0 else 0)
+            return p
+        for regions in list(self._regions.values()) + [self._sel.regions]:
+            for r in regions:
+                r.a = fix(r.a)
+                r.b = fix(r.b)
+        self._folds = [Region(fix(r.a), fix(r.b)) for r in self._folds]
+        self._line_starts = None
+        self._change_count += 1
+
+    def _check_edit(self, edit):
+        if not isinstance(edit, Edit):
+            raise ValueError("edit objects may not be used after the TextCommand's run method has returned")
+
+    def insert(self, edit, pt, text):
+        self._check_edit(edit)
+        _count(len(text))
+        self.text = self.text[:pt] + text + self.text[pt:]
+        # a point exactly at the insertion point moves along with the inserted text
+        def fix(p):
+            return p + len(text) if p >= pt else p
+        for regions in list(self._regions.values()) + [self._sel.regions]:
+            for r in regions:
+                r.a = fix(r.a)
+                r.b = fix(r.b)
+        self._line_starts = None
+        self._change_count += 1
+        return len(text)
+
+    def erase(self, edit, region):
+        self._check_edit(edit)
+        _count()
+        a, b = region.begin(), region.end()
+        if a == b:
+            return
+        self.text = self.text[:a] + self.text[b:]
+        self._adjust(a, b - a, 0)
+
+    def replace(self, edit, region, text):
+        self._check_edit(edit)
+        _count(len(text))
+        a, b = region.begin(), region.end()
+        self.text = self.text[:a] + text + self.text[b:]
+        self._adjust(a, b - a, len(text))
+
+    # folding
+    def fold(self, regions):
+        if isinstance(regions, Region):
+            regions = [regions]
+        self._folds.extend(regions)
+        return True
+
+    def unfold(self, regions):
+        if isinstance(regions, Region):
+            regions = [regions]
+        self._folds = [f for f in self._folds if not any(f.intersects(r) or f == r for r in regions)]
+        return regions
+
+    def folded_regions(self):
+        return list(self._folds)
+
+    # layout and viewport
+    def line_height(self):
+        return LINE_HEIGHT
+
+    def em_width(self):
+        return CHAR_WIDTH
+
+    def visible_region(self):
+        _count()
+        top = self.text_point(self._top_row, 0)
+        bottom = self.line(self.text_point(self._top_row + self.visible_rows - 1, 0)).end()
+        return Region(top, bottom)
+
+    def show_at_center(self, pt):
+        _count()
+        if isinstance(pt, Region):
+            pt = pt.b
+        row = self.rowcol(pt)[0]
+        self._top_row = max(0, row - self.visible_rows // 2)
+
+    def show(self, pt, show_surrounds=True):
+        _count()
+        if isinstance(pt, Region):
+            pt = pt.b
+        row = self.rowcol(pt)[0]
+        if row < self._top_row:
+            self._top_row = row
+        elif row >= self._top_row + self.visible_rows:
+            self._top_row = row - self.visible_rows + 1
+
+    def viewport_position(self):
+        return (0.0, float(self._top_row * LINE_HEIGHT))
+
+    def set_viewport_position(self, xy, animate=True):
+        self._top_row = max(0, int(xy[1] // LINE_HEIGHT))
+
+    def viewport_extent(self):
+        return (800.0, float(self.visible_rows * LINE_HEIGHT))
+
+    def layout_extent(self):
+        return (800.0, float(len(self._starts()) * LINE_HEIGHT))
+
+    def text_to_layout(self, pt):
+        row, col = self.rowcol(pt)
+        return (float(col * CHAR_WIDTH), float(row * LINE_HEIGHT))
+
+    def layout_to_text(self, xy):
+        row = int(xy[1] // LINE_HEIGHT)
+        starts = self._starts()
+        if row < 0:
+            return 0
+        if row >= len(starts):
+            return len(self.text)
+        line = self.line(starts[row])
+        col = int(round(xy[0] / CHAR_WIDTH))
+        return min(line.begin() + col, line.end())
+
+    # commands
+    def run_command(self, cmd, args=None):
+        return _dispatch_text_command(self, cmd, args)
+
+    def close(self):
+        if self._window:
+            self._window.close_view(self)
+
+
+class Window:
+    _next_id = 1
+
+    def __init__(self, folders=None):
+        self._id = Window._next_id
+        Window._next_id += 1
+        self._views = []
+        self._active = None
+        self._folders = list(folders or [])
+        self._panels = {}
+        self._input = None
+        self._quick_panel = None
+        self._layout = {"cells": [[0, 0, 1, 1]], "cols": [0.0, 1.0], "rows": [0.0, 1.0]}
+        self._active_group = 0
+        self._settings = Settings()
+        _windows.append(self)
+
+    def id(self):
+        return self._id
+
+    def settings(self):
+        return self._settings
+
+    def folders(self):
+        return list(self._folders)
+
+    def project_data(self):
+        return {"folders": [{"path": f} for f in self._folders]}
+
+    def extract_variables(self):
+        return {}
+
+    def views(self):
+        return list(self._views)
+
+    def new_file(self):
+        view = View(self)
+        self._views.append(view)
+        self.focus_view(view)
+        return view
+
+    def open_file(self, path, flags=0, group=-1):
+        row = col = None
+        if flags & ENCODED_POSITION:
+            m = re.match(r"(.*?):(\d+)(?::(\d+))?$", path)
+            if m:
+                path, row, col = m.group(1), int(m.group(2)), int(m.group(3) or 1)
+        view = self.find_open_file(path)
+        if view is None:
+            with open(path, encoding="utf-8", errors="replace") as f:
+                text = f.read()
+            view = View(self, text, file_name=path)
+            self._views.append(view)
+        self.focus_view(view)
+        if row is not None:
+            pt = view.text_point(row - 1, col - 1)
+            view.sel().clear()
+            view.sel().add(Region(pt, pt))
+        return view
+
+    def find_open_file(self, path):
+        for v in self._views:
+            if v.file_name() == path:
+                return v
+        return None
+
+    def close_view(self, view):
+        if view in self._views:
+            self._views.remove(view)
+            view._valid = False
+            for listener in _listeners:
+                if hasattr(listener, "on_close"):
+                    listener.on_close(view)
+            if self._active is view:
+                self._active = self._views[-1] if self._views else None
+
+    def active_view(self):
+        return self._active
+
+    def focus_view(self, view):
+        if self._active is not None and self._active is not view:
+            for listener in _listeners:
+                if hasattr(listener, "on_deactivated"):
+                    listener.on_deactivated(self._active)
+        self._active = view
+        for listener in _listeners:
+            for name in ("on_activated", "on_activated_async"):
+                if hasattr(listener, name):
+                    getattr(listener, name)(view)
+
+    def num_groups(self):
+        return len(self._layout["rows"]) - 1
+
+    def active_group(self):
+        return self._active_group
+
+    def focus_group(self, group):
+        self._active_group = group
+
+    def active_view_in_group(self, group):
+        return self._active
+
+    def views_in_group(self, group):
+        return list(self._views)
+
+    def get_view_index(self, view):
+        return (0, self._views.index(view))
+
+    def set_view_index(self, view, group, index):
+        pass
+
+    def layout(self):
+        return dict(self._layout)
+
+    def set_layout(self, layout):
+        self._layout = layout
+
+    def create_output_panel(self, name, unlisted=False):
+        panel = self._panels.get(name)
+        if panel is None:
+            panel = View(self, name="output." + name, is_widget=True)
+            self._panels[name] = panel
+        return panel
+
+    def find_output_panel(self, name):
+        return self._panels.get(name)
+
+    def get_output_panel(self, name):
+        return self.create_output_panel(name)
+
+    def show_input_panel(self, caption, initial_text, on_done, on_change, on_cancel):
+        view = View(self, initial_text, is_widget=True)
+        self._input = (view, on_done, on_change, on_cancel)
+        return view
+
+    def show_quick_panel(self, items, on_select, flags=0, selected_index=-1, on_highlight=None):
+        self._quick_panel = (items, on_select)
+
+    def status_message(self, msg):
+        pass
+
+    def run_command(self, cmd, args=None):
+        if cmd == "hide_panel" and self._input is not None:
+            view, on_done, on_change, on_cancel = self._input
+            self._input = None
+            if on_cancel:
+                on_cancel()
+            return
+        for listener in _listeners:
+            if hasattr(listener, "on_window_command"):
+                listener.on_window_command(self, cmd, args)
+        cls = _window_commands.get(cmd)
+        try:
+            if cls is not None:
+                cls(self).run(**(args or {}))
+        finally:
+            for listener in _listeners:
+                if hasattr(listener, "on_post_window_command"):
+                    listener.on_post_window_command(self, cmd, args)
+
+
+_windows = []
+
+def windows():
+    return list(_windows)
+
+def active_window():
+    return _windows[-1] if _windows else Window()
+
+
+#
+# Timers. Nothing runs until run_timers() is called (or flush_timers for everything), on a clock
+# which only moves when advance_clock() or flush_timers() moves it.
+#
+_timers = []
+_clock = [0.0]
+
+def set_timeout(fn, delay=0):
+    _timers.append((_clock[0] + delay, len(_timers), fn))
+
+def set_timeout_async(fn, delay=0):
+    set_timeout(fn, delay)
+
+def advance_clock(ms):
+    _clock[0] += ms
+    run_timers()
+
+def run_timers():
+    while True:
+        due = sorted([t for t in _timers if t[0] <= _clock[0]], key=lambda t: (t[0], t[1]))
+        if not due:
+            return
+        for t in due:
+            _timers.remove(t)
+            t[2]()
+
+def flush_timers(limit=1000):
+    for i in range(limit):
+        if not _timers:
+            return
+        _clock[0] = max(_clock[0], min(t[0] for t in _timers))
+        run_timers()
+
+
+_clipboard = [""]
+
+def get_clipboard(size_limit=16777216):
+    return _clipboard[0]
+
+def set_clipboard(text):
+    _clipboard[0] = text
+
+def status_message(msg):
+    pass
+
+def error_message(msg):
+    print("error:", msg)
+
+def message_dialog(msg):
+    print(msg)
+
+def ok_cancel_dialog(msg, ok_title=""):
+    return True
+
+def version():
+    return "3211"
+
+def platform():
+    return "linux"
+
+def arch():
+    return "x64"
+
+_cache_dir = [None]
+
+def cache_path():
+    if _cache_dir[0] is None:
+        _cache_dir[0] = tempfile.mkdtemp(prefix="jove-cache-")
+    return _cache_dir[0]
+
+def score_selector(scope, selector):
+    return 1 if selector in scope else 0
+
+
+#
+# Command dispatch. The sublime_plugin stand-in registers listeners and commands here.
+#
+_listeners = []
+_text_commands = {}
+_window_commands = {}
+_depth = [0]
+
+def _dispatch_text_command(view, cmd, args):
+    args = dict(args) if args else {}
+    for listener in _listeners:
+        if hasattr(listener, "on_text_command"):
+            result = listener.on_text_command(view, cmd, args)
+            if result:
+                cmd, args = result[0], (dict(result[1]) if result[1] else {})
+                break
+    before = view._change_count
+    _depth[0] += 1
+    try:
+        cls = _text_commands.get(cmd)
+        if cls is not None:
+            cls(view).run_(args)
+        else:
+            _builtin(view, cmd, args)
+    finally:
+        _depth[0] -= 1
+    for listener in _listeners:
+        if hasattr(listener, "on_post_text_command"):
+            listener.on_post_text_command(view, cmd, args)
+    if view._change_count != before:
+        if _depth[0] == 0:
+            view.undo_groups += 1
+        for listener in _listeners:
+            if hasattr(listener, "on_modified"):
+                listener.on_modified(view)
+    if _depth[0] == 0:
+        for listener in _listeners:
+            if hasattr(listener, "on_selection_modified"):
+                listener.on_selection_modified(view)
+
+
+def _builtin(view, cmd, args):
+    sel = view.sel()
+    text = view.text
+    edit = Edit(view)
+    extend = args.get("extend", False)
+
+    def place(region, pt):
+        return Region(region.a if extend else pt, pt)
+
+    if cmd == "move":
+        by = args.get("by")
+        forward = args.get("forward", True)
+        regions = list(sel)
+        sel.clear()
+        for r in regions:
+            pt = r.b
+            if by == "characters":
+                pt = min(len(text), pt + 1) if forward else max(0, pt - 1)
+            elif by in ("lines", "pages"):
+                amount = 1 if by == "lines" else view.visible_rows
+                row, col = view.rowcol(pt)
+                row = row + amount if forward else row - amount
+                line = view.line(view.text_point(max(row, 0), 0))
+                pt = min(line.begin() + col, line.end())
+                if row < 0:
+                    pt = 0
+            elif by in ("words", "word_ends"):
+                pt = view.find_by_class(pt, forward, CLASS_WORD_START | CLASS_WORD_END, "")
+            sel.add(place(r, pt))
+    elif cmd == "move_to":
+        to = args.get("to")
+        regions = list(sel)
+        sel.clear()
+        for r in regions:
+            pt = r.b
+            line = view.line(pt)
+            if to in ("bol", "hardbol"):
+                pt = line.begin()
+            elif to in ("eol", "hardeol"):
+                pt = line.end()
+            elif to == "bof":
+                pt = 0
+            elif to == "eof":
+                pt = len(text)
+            elif to == "brackets":
+                pt = _match_bracket(text, pt)
+            sel.add(place(r, pt))
+    elif cmd == "insert":
+        chars = args.get("characters", "")
+        for r in reversed(list(sel)):
+            view.replace(edit, Region(r.begin(), r.end()), chars)
+    elif cmd in ("left_delete", "right_delete"):
+        for r in reversed(list(sel)):
+            if r.empty():
+                r = Region(r.a - 1, r.a) if cmd == "left_delete" else Region(r.a, r.a + 1)
+            if r.begin() >= 0 and r.end() <= len(view.text):
+                view.erase(edit, r)
+    elif cmd == "append":
+        view.insert(edit, len(view.text), args.get("characters", ""))
+    elif cmd == "select_all":
+        sel.clear()
+        sel.add(Region(0, len(text)))
+    elif cmd == "expand_selection":
+        regions = list(sel)
+        sel.clear()
+        for r in regions:
+            line = view.line(r.b)
+            a = r.b
+            while a > line.begin() and text[a - 1] not in "\"'":
+                a -= 1
+            b = r.b
+            while b < line.end() and text[b] not in "\"'":
+                b += 1
+            sel.add(Region(max(a - 1, line.begin()), min(b + 1, line.end())))
+    elif cmd in ("indent", "reindent", "unindent", "toggle_comment", "wrap_lines", "hide_panel",
+                 "clear_fields", "hide_overlay", "hide_auto_complete"):
+        pass
+    else:
+        raise KeyError("no such command: %s" % cmd)
+
+
+def _match_bracket(text, pt):
+    pairs = {"(": ")", "[": "]", "{": "}"}
+    if pt < len(text) and text[pt] in pairs:
+        opener, closer = text[pt], pairs[text[pt]]
+        depth = 0
+        for i in range(pt, len(text)):
+            if text[i] == opener:
+                depth += 1
+            elif text[i] == closer:
+                depth -= 1
+                if depth == 0:
+                    return i + 1
+        return pt
+    closers = {")": "(", "]": "[", "}": "{"}
+    if pt > 0 and text[pt - 1] in closers:
+        closer, opener = text[pt - 1], closers[text[pt - 1]]
+        depth = 0
+        for i in range(pt - 1, -1, -1):
+            if text[i] == closer:
+                depth += 1
+            elif text[i] == opener:
+                depth -= 1
+                if depth == 0:
+                    return i
+    return pt
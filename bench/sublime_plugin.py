@@ -0,0 +1,61 @@
+#
+# Stand-in for sublime_plugin: command base classes plus a loader which registers the commands and
+# event listeners defined in a plugin module with the sublime stand-in.
+#
+import re
+import sublime
+
+
+class Command:
+    def is_enabled(self, **kwargs):
+        return True
+
+    def is_visible(self, **kwargs):
+        return True
+
+    def description(self, **kwargs):
+        return None
+
+
+class TextCommand(Command):
+    def __init__(self, view):
+        self.view = view
+
+    def run_(self, args):
+        return self.run(sublime.Edit(self.view), **args)
+
+
+class WindowCommand(Command):
+    def __init__(self, window):
+        self.window = window
+
+
+class ApplicationCommand(Command):
+    pass
+
+
+class EventListener:
+    pass
+
+
+class ViewEventListener:
+    def __init__(self, view):
+        self.view = view
+
+
+def command_name(cls):
+    name = re.sub('(?!^)([A-Z]+)', r'_\1', cls.__name__).lower()
+    return name[:-len("_command")] if name.endswith("_command") else name
+
+
+def load_module(module):
+    for name in dir(module):
+        obj = getattr(module, name)
+        if not isinstance(obj, type) or obj.__module__ != module.__name__:
+            continue
+        if issubclass(obj, TextCommand):
+            sublime._text_commands[command_name(obj)] = obj
+        elif issubclass(obj, WindowCommand):
+            sublime._window_commands[command_name(obj)] = obj
+        elif issubclass(obj, EventListener):
+            sublime._listeners.append(obj())
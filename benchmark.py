@@ -0,0 +1,59 @@
+import time
+import sublime
+
+#
+# Timing the line oriented commands on lines of increasing length, to check that what they cost
+# doesn't depend on how long the line is (e.g., in a minified single line javascript bundle).
+#
+# Each case is (name, command, args, prefix, filler, offset): the test line is prefix followed by
+# filler repeated to the length being measured, and the cursor goes offset characters from the start
+# of the line, or from the end if offset is negative (offset can also be a tuple, for a cursor at
+# each). The line is the second line of the buffer, after one which opens a block, so reindenting has
+# some context. Indent uses two cursors: with one, jove_indent hands the line to sublime's reindent,
+# and it's our reindent_regions we want to time.
+#
+LINE_CASES = [
+    ("kill-line", "jove_move_then_delete", {"move_cmd": "jove_move_for_kill_line"}, "    ", "abc ", -10),
+    ("delete-white-space", "jove_delete_white_space", {}, "    ", "abc    ", 4 + 7 * 100 + 5),
+    ("just-one-space", "jove_just_one_space", {}, "    ", "abc    ", 4 + 7 * 100 + 5),
+    ("indent", "jove_indent", {}, "", "abc ", (1000, -10)),
+]
+LINE_LENGTHS = [1000, 100000, 10000000]
+
+#
+# Run each of the cases at each of the lengths in view, which should be an empty scratch view, and
+# return the report. Each case is run repeat times on a fresh copy of the text and the best time is
+# reported. The text is checked before each run, since a setup command which didn't take effect
+# (e.g., one merged with the next by the key repeat coalescing) would make the times meaningless;
+# such cases are reported as "bad setup".
+#
+def run_line_benchmark(view, lengths=LINE_LENGTHS, repeat=3):
+    names = [case[0] for case in LINE_CASES]
+    width = max(len(name) for name in names)
+    lines = ["%-*s %s" % (width, "Command", " ".join("%12s" % ("%d chars" % (n,)) for n in lengths))]
+    results = dict((name, []) for name in names)
+    for length in lengths:
+        for name, cmd, args, prefix, filler, offset in LINE_CASES:
+            line = prefix + filler * max(1, (length - len(prefix)) // len(filler))
+            text = "if x:\n" + line + "\n"
+            offsets = offset if isinstance(offset, tuple) else (offset,)
+            points = [6 + (o if o >= 0 else len(line) + o) for o in offsets]
+            best = None
+            for i in range(repeat):
+                view.run_command("select_all")
+                view.run_command("left_delete")
+                view.run_command("append", {"characters": text})
+                view.sel().clear()
+                view.sel().add_all([sublime.Region(point, point) for point in points])
+                if view.size() != len(text):
+                    best = None
+                    break
+                start = time.time()
+                view.run_command(cmd, args)
+                elapsed = time.time() - start
+                best = elapsed if best is None else min(best, elapsed)
+            results[name].append(best)
+    for name in names:
+        times = ["%12s" % ("bad setup",) if t is None else "%9.2f ms" % (t * 1000,) for t in results[name]]
+        lines.append("%-*s %s" % (width, name, " ".join(times)))
+    return lines
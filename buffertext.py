@@ -0,0 +1,125 @@
+import re
+import sublime
+
+BLANK_RE = re.compile(r'[ \t]*')
+
+#
+# Cached read access to the text of a view. The buffer is read in fixed size chunks the first time
+# something in a chunk is asked for, and character and line queries are then answered from the
+# chunks without going back to the view. A BufferText is only good for the change_count it was
+# created with: use get() to obtain one, which starts again when the buffer has changed.
+#
+class BufferText:
+    CHUNK_SIZE = 4096
+
+    def __init__(self, view):
+        self.view = view
+        self.change_count = view.change_count()
+        self.size = view.size()
+        self.chunks = dict()
+
+    #
+    # Returns the text for view, reusing the one cached in state if the buffer hasn't changed.
+    #
+    @staticmethod
+    def get(view, state):
+        text = state.buffer_text
+        if text is None or text.change_count != view.change_count():
+            text = state.buffer_text = BufferText(view)
+        return text
+
+    def chunk(self, index):
+        data = self.chunks.get(index)
+        if data is None:
+            start = index * self.CHUNK_SIZE
+            end = min(start + self.CHUNK_SIZE, self.size)
+            data = self.chunks[index] = self.view.substr(sublime.Region(start, end))
+        return data
+
+    #
+    # Returns the character at pos, or "\x00" if pos is outside the buffer (just like view.substr).
+    #
+    def char(self, pos):
+        if pos < 0 or pos >= self.size:
+            return "\x00"
+        index, offset = divmod(pos, self.CHUNK_SIZE)
+        return self.chunk(index)[offset]
+
+    def substr(self, a, b):
+        a = max(0, min(a, b))
+        b = min(self.size, max(a, b))
+        if a >= b:
+            return ""
+        first = a // self.CHUNK_SIZE
+        last = (b - 1) // self.CHUNK_SIZE
+        data = "".join(self.chunk(i) for i in range(first, last + 1))
+        start = a - first * self.CHUNK_SIZE
+        return data[start:start + b - a]
+
+    #
+    # Returns the position of the first newline at or after pos, or the buffer size if there isn't
+    # one.
+    #
+    def find_newline(self, pos):
+        size = self.size
+        while pos < size:
+            index, offset = divmod(pos, self.CHUNK_SIZE)
+            found = self.chunk(index).find("\n", offset)
+            if found >= 0:
+                return index * self.CHUNK_SIZE + found
+            pos = (index + 1) * self.CHUNK_SIZE
+        return size
+
+    #
+    # Returns the position of the last newline before pos, or -1 if there isn't one.
+    #
+    def rfind_newline(self, pos):
+        pos = min(pos, self.size)
+        while pos > 0:
+            index, offset = divmod(pos - 1, self.CHUNK_SIZE)
+            found = self.chunk(index).rfind("\n", 0, offset + 1)
+            if found >= 0:
+                return index * self.CHUNK_SIZE + found
+            pos = index * self.CHUNK_SIZE
+        return -1
+
+    #
+    # Returns the region of the line containing pos, not including the newline. If the line doesn't
+    # fit in the chunk containing pos we ask the view instead, so a very long line is never read.
+    #
+    def line(self, pos):
+        pos = max(0, min(pos, self.size))
+        index, offset = divmod(pos, self.CHUNK_SIZE)
+        base = index * self.CHUNK_SIZE
+        data = self.chunk(index) if pos < self.size or offset > 0 else ""
+        start = data.rfind("\n", 0, offset)
+        if start < 0 and base > 0:
+            return self.view.line(pos)
+        end = data.find("\n", offset)
+        if end < 0 and base + len(data) < self.size:
+            return self.view.line(pos)
+        return sublime.Region(base + start + 1, base + end if end >= 0 else self.size)
+
+    #
+    # Returns the position of the first character between start and limit which is not a space or
+    # a tab, or limit if there isn't one.
+    #
+    def indent_end(self, start, limit):
+        pos = max(0, start)
+        limit = min(limit, self.size)
+        while pos < limit:
+            index, offset = divmod(pos, self.CHUNK_SIZE)
+            data = self.chunk(index)
+            end = BLANK_RE.match(data, offset).end()
+            pos = index * self.CHUNK_SIZE + end
+            if end < len(data):
+                break
+        return min(pos, limit)
+
+    #
+    # Returns true if all the text between a and b is spaces and tabs. Reading stops at the first
+    # character which isn't.
+    #
+    def is_blank(self, a, b):
+        a, b = min(a, b), max(a, b)
+        return self.indent_end(a, b) >= min(b, self.size)
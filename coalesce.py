@@ -0,0 +1,108 @@
+import time
+import sublime
+
+#
+# Key repeat coalescing for a view. When a repeatable command (e.g., move or left_delete) arrives
+# sooner after an identical one finished than that one took to run, the editor has fallen behind
+# (e.g., in a huge buffer) and the key repeats are queueing up. Then the command is not run straight
+# away. Instead it is counted, and a timer runs all the commands counted so far as one jove_do_times.
+# Timers run once the input which is already queued has been handled, so the backlog is merged into
+# a single counted operation rather than being worked through one event at a time after the key has
+# been released. While the editor keeps up each repeat runs on its own, as usual, and a command
+# which took less than KEY_REPEAT (about the fastest key repeat there is) can't have left a backlog.
+#
+# Commands run while another one is running (by a plugin, or a macro) are never counted, since
+# whatever ran them expects them to have happened when run_command returns. Any other command
+# flushes the count first, so the order of commands is never changed.
+#
+class Coalescer:
+    KEY_REPEAT = 0.015
+
+    # the number of commands (in any view or window) which have started and not finished
+    running = 0
+
+    def __init__(self, view):
+        self.view = view
+        # [cmd, args, count] waiting to be run
+        self.pending = None
+        # the last repeatable command we saw
+        self.last = None
+        # when the last top level command in the view finished, and how long it took
+        self.finished_time = 0
+        self.duration = 0
+        self.started_time = 0
+        self.flushing = False
+
+    @classmethod
+    def command_started(cls):
+        cls.running += 1
+
+    @classmethod
+    def command_finished(cls):
+        cls.running = max(0, cls.running - 1)
+
+    #
+    # Called before and after each text command in the view, to time the top level ones.
+    #
+    def started(self):
+        if Coalescer.running == 0:
+            self.started_time = time.time()
+        Coalescer.command_started()
+
+    def finished(self):
+        Coalescer.command_finished()
+        if Coalescer.running == 0:
+            self.finished_time = time.time()
+            self.duration = self.finished_time - self.started_time
+
+    #
+    # Returns True if the command has been absorbed, in which case the caller should not run it.
+    #
+    def add(self, cmd, args):
+        if self.flushing:
+            return False
+        if Coalescer.running > 1:
+            # run by another command
+            self.interrupt()
+            return False
+        pending = self.pending
+        if pending is not None and pending[0] == cmd and pending[1] == args:
+            pending[2] += 1
+            return True
+        self.flush()
+        repeat = (self.last == (cmd, args) and self.duration > self.KEY_REPEAT and
+                  time.time() - self.finished_time < self.duration)
+        self.last = (cmd, dict(args))
+        if not repeat:
+            return False
+        self.pending = [cmd, dict(args), 1]
+        sublime.set_timeout(self.flush, 0)
+        return True
+
+    #
+    # Run the counted commands, and forget the last repeatable command: a command which isn't one
+    # has come in between.
+    #
+    def interrupt(self):
+        self.flush()
+        self.last = None
+
+    #
+    # Run the counted commands, if there are any.
+    #
+    def flush(self):
+        pending = self.pending
+        if pending is None:
+            return
+        self.pending = None
+        cmd, args, count = pending
+        self.flushing = True
+        try:
+            if count == 1:
+                self.view.run_command(cmd, args)
+            else:
+                args = dict(args)
+                args.update({"cmd": cmd, "_times": count})
+                self.view.run_command("jove_do_times", args)
+        finally:
+            self.flushing = False
@@ -0,0 +1,118 @@
+#
+# Commenting blocks of lines. A Commenter has the start (and, for languages without line comments,
+# end) marker of a comment. Commenting puts the start marker on every non-blank line at the
+# smallest indent of the lines, so the markers line up and the code keeps its shape, and
+# uncommenting takes it away again. Columns are display columns, so lines indented with tabs and
+# lines indented with spaces are treated alike.
+#
+# Each operation takes the list of lines and returns the new list, so the caller can read the whole
+# block once and replace it with a single edit.
+#
+class Commenter:
+    def __init__(self, start, end="", tab_size=4):
+        self.start = start if start.endswith(" ") else start + " "
+        self.end = (end if end.startswith(" ") else " " + end) if end.strip() else ""
+        self.start_marker = start.strip()
+        self.end_marker = end.strip()
+        self.tab_size = tab_size
+
+    #
+    # Returns the number of characters and display columns of the indentation of line.
+    #
+    def indent(self, line):
+        col = 0
+        for index, ch in enumerate(line):
+            if ch == " ":
+                col += 1
+            elif ch == "\t":
+                col += self.tab_size - col % self.tab_size
+            else:
+                return index, col
+        return len(line), col
+
+    #
+    # Returns True if every non-blank line in lines is commented (and there is at least one).
+    #
+    def is_commented(self, lines):
+        found = False
+        for line in lines:
+            body = line.strip()
+            if not body:
+                continue
+            if not body.startswith(self.start_marker) or not body.endswith(self.end_marker):
+                return False
+            found = True
+        return found
+
+    def comment(self, lines):
+        column = None
+        for line in lines:
+            if line.strip():
+                col = self.indent(line)[1]
+                column = col if column is None else min(column, col)
+        if column is None:
+            return list(lines)
+
+        result = []
+        for line in lines:
+            if not line.strip():
+                result.append(line)
+                continue
+            # the index of column in the indentation, turning a tab which straddles it into spaces
+            index = 0
+            col = 0
+            while col < column:
+                if line[index] == "\t":
+                    width = self.tab_size - col % self.tab_size
+                    if col + width > column:
+                        line = line[:index] + " " * width + line[index + 1:]
+                        continue
+                    col += width
+                else:
+                    col += 1
+                index += 1
+            result.append(line[:index] + self.start + line[index:] + self.end)
+        return result
+
+    def uncomment(self, lines):
+        result = []
+        start_marker = self.start_marker
+        end_marker = self.end_marker
+        for line in lines:
+            index = self.indent(line)[0]
+            if not line.startswith(start_marker, index):
+                result.append(line)
+                continue
+            rest = line[index + len(start_marker):]
+            if rest.startswith(" "):
+                rest = rest[1:]
+            if end_marker:
+                stripped = rest.rstrip()
+                if stripped.endswith(end_marker):
+                    rest = stripped[:-len(end_marker)]
+                    if rest.endswith(" "):
+                        rest = rest[:-1]
+            result.append(line[:index] + rest)
+        return result
+
+    #
+    # Uncomment the lines if they are all commented, otherwise comment them.
+    #
+    def toggle(self, lines):
+        if self.is_commented(lines):
+            return self.uncomment(lines)
+        return self.comment(lines)
+
+#
+# Returns where col in old_line ends up in new_line, when new_line is old_line with some text
+# inserted or removed (at most one place at each end). A column in removed text moves to where it
+# was.
+#
+def shift_column(old_line, new_line, col):
+    common = 0
+    limit = min(len(old_line), len(new_line))
+    while common < limit and old_line[common] == new_line[common]:
+        common += 1
+    if col <= common:
+        return col
+    return max(common, col + len(new_line) - len(old_line))
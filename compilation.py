@@ -0,0 +1,180 @@
+import os, re, subprocess, threading, time
+import sublime
+
+#
+# Runs a build command in a subprocess. Output is read on a background thread and appended to an
+# output panel in batches (at most every FLUSH_DELAY ms) so that a chatty build never ties up the
+# UI thread with one append per line. Error locations (file:line:col, or python's File "x", line N)
+# are parsed on the background thread as the output arrives, so the index next_error uses is
+# always up to date. Once another compilation of the same kind has started (and taken over the
+# panel) the output of this one is dropped, so a killed build which is still being read can't get
+# into the new one.
+#
+class Compilation:
+    PANEL = "jove_compile"
+    FLUSH_DELAY = 100
+
+    # (a "path" which is only digits, dots, dashes and brackets is a timestamp like 12:34:56)
+    ERROR_RE = re.compile(r'^\s*(?:File ")?(?![\[\d.T-]+[:(])([^\s:"(]+?)"?(?::|, line |\()(\d+)(?:[:,](\d+))?')
+
+    # the most recent compilation (subclasses which use their own panel have their own), the most
+    # recent of any kind (which next_error visits) and the last command
+    current = None
+    latest = None
+    last_command = None
+
+    def __init__(self, window, command, directory, panel=PANEL):
+        self.window = window
+        self.command = command
+        self.directory = directory
+        self.panel_name = panel
+        self.errors = []
+        self.error_index = -1
+        self.lock = threading.Lock()
+        self.pending = []
+        self.flush_scheduled = False
+        self.size = 0
+        self.process = None
+        self.killed = False
+
+    #
+    # Create (or clear) the output panel and show it.
+    #
+    def open_panel(self):
+        panel = self.window.create_output_panel(self.panel_name)
+        settings = panel.settings()
+        settings.set("word_wrap", False)
+        settings.set("line_numbers", False)
+        settings.set("scroll_past_end", False)
+        panel.set_read_only(True)
+        self.panel = panel
+        self.window.run_command("show_panel", {"panel": "output." + self.panel_name})
+        return panel
+
+    def start(self):
+        self.make_current()
+        self.open_panel()
+        self.output("cd %s\n%s\n\n" % (self.directory, self.command))
+        try:
+            self.process = subprocess.Popen(self.command, shell=True, cwd=self.directory,
+                                            stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                                            stderr=subprocess.STDOUT)
+        except OSError as e:
+            self.output("Could not run command: %s\n" % (e,))
+            return
+        self.started = time.time()
+        threading.Thread(target=self.reader).start()
+
+    def kill(self):
+        if self.process and self.process.poll() is None:
+            self.killed = True
+            self.process.kill()
+
+    def is_running(self):
+        return self.process is not None and self.process.poll() is None
+
+    def make_current(self):
+        type(self).current = self
+        Compilation.latest = self
+
+    def is_current(self):
+        return type(self).current is self
+
+    #
+    # Background thread: read the output a line at a time, index the errors and queue the text.
+    #
+    def reader(self):
+        for line in iter(self.process.stdout.readline, b''):
+            self.output(line.decode("utf-8", "replace").replace("\r\n", "\n"))
+        self.process.stdout.close()
+        code = self.process.wait()
+        if self.killed:
+            status = "killed"
+        elif code == 0:
+            status = "finished"
+        else:
+            status = "exited abnormally with code %d" % (code,)
+        self.output("\nCompilation %s at %s (%.1fs, %d errors)\n" % (status, time.strftime("%X"),
+                                                                    time.time() - self.started,
+                                                                    len(self.errors)))
+
+    #
+    # Queue some text for the panel, recording the position of any error it contains. Safe to call
+    # from any thread.
+    #
+    def output(self, text):
+        m = self.ERROR_RE.match(text)
+        error = None
+        if m:
+            path = m.group(1)
+            if not os.path.isabs(path):
+                path = os.path.join(self.directory, path)
+            error = (path, int(m.group(2)), int(m.group(3) or 1))
+        self.output_lines([(text, error)])
+
+    #
+    # Queue (text, error) pairs, where error is None or the (path, line, col) the text refers to.
+    # Safe to call from any thread.
+    #
+    def output_lines(self, lines):
+        if not self.is_current():
+            return
+        with self.lock:
+            for text, error in lines:
+                if error:
+                    self.errors.append(error + (self.size,))
+                self.size += len(text)
+                self.pending.append(text)
+            if self.flush_scheduled:
+                return
+            self.flush_scheduled = True
+        sublime.set_timeout(self.flush, self.FLUSH_DELAY)
+
+    def flush(self):
+        with self.lock:
+            text = "".join(self.pending)
+            self.pending = []
+            self.flush_scheduled = False
+        if text and self.is_current():
+            self.panel.set_read_only(False)
+            self.panel.run_command("append", {"characters": text, "force": True, "scroll_to_end": True})
+            self.panel.set_read_only(True)
+
+    #
+    # Move count errors forward (or backward if count is negative) and visit that error. Returns
+    # False if there are no more errors in that direction.
+    #
+    def next_error(self, count):
+        with self.lock:
+            errors = len(self.errors)
+        index = self.error_index + count
+        if index < 0 or index >= errors:
+            return False
+        self.error_index = index
+        path, line, col, offset = self.errors[index]
+
+        # highlight the error in the panel
+        panel = self.panel
+        region = panel.line(offset) if offset < panel.size() else sublime.Region(offset, offset)
+        panel.add_regions("jove_error", [region], "string", "", sublime.DRAW_NO_FILL)
+        panel.show(region)
+
+        self.window.open_file("%s:%d:%d" % (path, line, col), sublime.ENCODED_POSITION)
+        return True
+
+#
+# Returns the directory to run a command in for view: the window folder containing the file, the
+# file's own directory, or the first window folder.
+#
+def get_directory(view):
+    window = view.window()
+    folders = window.folders() if window else []
+    file_name = view.file_name()
+    if file_name:
+        for folder in folders:
+            if file_name.startswith(os.path.join(folder, "")):
+                return folder
+        return os.path.dirname(file_name)
+    if folders:
+        return folders[0]
+    return os.path.expanduser("~")
@@ -0,0 +1,281 @@
+import re
+import sublime
+from bisect import bisect_left, bisect_right
+
+#
+# Index of the words in a buffer for dynamic abbreviation expansion. We keep the words of each line
+# and a count of each distinct word. The lines are indexed in chunks of CHUNK_LINES, and each chunk
+# is also a (hidden) region in the view, which sublime moves and resizes as the buffer is edited.
+# When the buffer changes only the chunks whose region changed size or moved, and the lines the
+# cursors were on when it was modified (for edits which don't change the length), are read and
+# re-indexed. That happens lazily, the next time the index is used.
+#
+class WordIndex:
+    CHUNK_LINES = 100
+    # above this many modified lines we just index the whole buffer again
+    MAX_DIRTY = 100
+    REGIONS = "jove_dabbrev"
+    DIRTY = "jove_dabbrev_dirty"
+
+    # buffer_id -> WordIndex
+    indexes = dict()
+
+    def __init__(self, separators):
+        self.separators = separators
+        self.word_re = re.compile(r'[^\s%s]+' % (re.escape(separators),))
+        self.change_count = -1
+        # the view whose regions track our chunks
+        self.view_id = None
+        self.overflow = False
+        self.before = []
+        # the chunk regions as they were when they were indexed and the number of lines in each
+        self.chunks = []
+        self.line_counts = []
+        self.rows = []
+        self.counts = dict()
+        self.keys = None
+
+    @classmethod
+    def get(cls, view, separators):
+        index = cls.indexes.get(view.buffer_id())
+        if index is None or index.separators != separators:
+            index = cls.indexes[view.buffer_id()] = WordIndex(separators)
+        index.refresh(view)
+        return index
+
+    @classmethod
+    def on_view_closed(cls, view):
+        cls.indexes.pop(view.buffer_id(), None)
+
+    #
+    # Remember where the selections start before a command, so on_modified knows which lines it
+    # replaced.
+    #
+    @classmethod
+    def on_text_command(cls, view):
+        index = cls.indexes.get(view.buffer_id())
+        if index is not None and index.view_id == view.id():
+            index.before = [r.begin() for r in view.sel()]
+
+    #
+    # Remember the lines from where each selection started to where its cursor is now, in case the
+    # change didn't alter the size of a chunk.
+    #
+    @classmethod
+    def on_modified(cls, view):
+        index = cls.indexes.get(view.buffer_id())
+        if index is None or index.view_id != view.id() or index.overflow:
+            return
+        dirty = view.get_regions(cls.DIRTY)
+        selection = view.sel()
+        before = index.before if len(index.before) == len(selection) else [r.begin() for r in selection]
+        added = False
+        for cursor, start in zip(selection, before):
+            line = view.line(sublime.Region(min(start, cursor.begin()), cursor.end()))
+            if any(d.contains(line) for d in dirty):
+                continue
+            # merge it with the regions it touches
+            others = []
+            for d in dirty:
+                if d.begin() <= line.end() and line.begin() <= d.end():
+                    line = line.cover(d)
+                else:
+                    others.append(d)
+            dirty = others + [line]
+            added = True
+        if len(dirty) > cls.MAX_DIRTY:
+            index.overflow = True
+            view.erase_regions(cls.DIRTY)
+        elif added:
+            view.add_regions(cls.DIRTY, dirty, "", "", sublime.HIDDEN)
+
+    #
+    # Bring the index up to date with the view.
+    #
+    def refresh(self, view):
+        if view.change_count() == self.change_count and view.id() == self.view_id:
+            return
+        self.change_count = view.change_count()
+        chunks = view.get_regions(self.REGIONS)
+        if view.id() != self.view_id or self.overflow or len(chunks) != len(self.chunks):
+            # start again
+            self.view_id = view.id()
+            self.overflow = False
+            self.chunks = chunks = []
+            self.line_counts = []
+            self.rows = []
+            self.counts = dict()
+            self.keys = None
+            runs = [(0, -1)]
+        else:
+            runs = self.find_changed(view, chunks)
+        view.erase_regions(self.DIRTY)
+        if not runs:
+            return
+
+        row_starts = [0]
+        for count in self.line_counts:
+            row_starts.append(row_starts[-1] + count)
+        size = view.size()
+        # from the end, so the chunk and row numbers of the runs before are unchanged
+        for first, last in reversed(runs):
+            start = chunks[first - 1].end() if first > 0 else 0
+            end = chunks[last + 1].begin() if last + 1 < len(chunks) else size
+            new_chunks, line_counts, rows = self.read(view, start, end, last + 1 == len(chunks))
+            self.update_counts(self.rows[row_starts[first]:row_starts[last + 1]], -1)
+            self.update_counts(rows, 1)
+            self.rows[row_starts[first]:row_starts[last + 1]] = rows
+            chunks[first:last + 1] = new_chunks
+            self.line_counts[first:last + 1] = line_counts
+        self.chunks = chunks
+        view.add_regions(self.REGIONS, chunks, "", "", sublime.HIDDEN)
+
+    #
+    # Returns the runs of chunks (first, last) which have to be read again: the ones which no longer
+    # follow on from the chunk before or changed size, and the ones with modified lines in them.
+    #
+    def find_changed(self, view, chunks):
+        changed = [False] * len(chunks)
+        expected = 0
+        for i, r in enumerate(chunks):
+            if r.begin() != expected or r.size() != self.chunks[i].size():
+                changed[i] = True
+            expected = r.end()
+        if chunks and expected != view.size():
+            changed[-1] = True
+        starts = [r.begin() for r in chunks]
+        for d in view.get_regions(self.DIRTY):
+            first = max(0, bisect_right(starts, d.begin()) - 1)
+            last = max(first, bisect_right(starts, d.end()) - 1)
+            for i in range(first, last + 1):
+                changed[i] = True
+
+        # a run has to start and end at the start of a line
+        def line_start(pos):
+            return pos == 0 or view.substr(pos - 1) == "\n"
+        for i in range(len(chunks) - 1):
+            if changed[i] and not changed[i + 1] and not line_start(chunks[i + 1].begin()):
+                changed[i + 1] = True
+        for i in range(len(chunks) - 1, 0, -1):
+            if changed[i] and not changed[i - 1] and not line_start(chunks[i - 1].end()):
+                changed[i - 1] = True
+
+        runs = []
+        for i, c in enumerate(changed):
+            if not c:
+                continue
+            if runs and runs[-1][1] == i - 1:
+                runs[-1] = (runs[-1][0], i)
+            else:
+                runs.append((i, i))
+        return runs
+
+    #
+    # Index the lines from start to end, which is either the start of a line or (if at_end) the end
+    # of the buffer. Returns the new chunk regions, the number of lines in each and the words of each
+    # line.
+    #
+    def read(self, view, start, end, at_end):
+        lines = view.substr(sublime.Region(start, end)).split("\n")
+        if not at_end:
+            # the empty string after the last newline is the start of the next chunk
+            lines.pop()
+        find = self.word_re.findall
+        chunks = []
+        line_counts = []
+        for i in range(0, len(lines), self.CHUNK_LINES):
+            group = lines[i:i + self.CHUNK_LINES]
+            length = sum(len(line) + 1 for line in group)
+            if at_end and i + self.CHUNK_LINES >= len(lines):
+                length -= 1
+            chunks.append(sublime.Region(start, start + length))
+            line_counts.append(len(group))
+            start += length
+        return chunks, line_counts, [find(line) for line in lines]
+
+    def update_counts(self, rows, delta):
+        counts = self.counts
+        for words in rows:
+            for word in words:
+                count = counts.get(word, 0) + delta
+                if count <= 0:
+                    del(counts[word])
+                    self.keys = None
+                else:
+                    if count == delta:
+                        self.keys = None
+                    counts[word] = count
+
+    #
+    # Returns the distinct words which start with prefix (but are longer than it).
+    #
+    def complete(self, prefix):
+        if self.keys is None:
+            self.keys = sorted(self.counts)
+        keys = self.keys
+        result = []
+        index = bisect_left(keys, prefix)
+        while index < len(keys) and keys[index].startswith(prefix):
+            if keys[index] != prefix:
+                result.append(keys[index])
+            index += 1
+        return result
+
+    #
+    # Returns the words which start with prefix ordered by their distance from row: the words on
+    # row come first, then the rows above and below it alternately. We stop as soon as we have
+    # seen every candidate.
+    #
+    def nearest(self, prefix, row, exclude=()):
+        wanted = set(self.complete(prefix)) - set(exclude)
+        result = []
+        rows = self.rows
+        above = row
+        below = row + 1
+        while wanted and (above >= 0 or below < len(rows)):
+            for r in (above, below):
+                if 0 <= r < len(rows):
+                    for word in rows[r]:
+                        if word in wanted:
+                            wanted.discard(word)
+                            result.append(word)
+            above -= 1
+            below += 1
+        return result
+
+    #
+    # Returns the words which start with prefix, most common first.
+    #
+    def most_common(self, prefix, exclude=()):
+        words = [w for w in self.complete(prefix) if w not in exclude]
+        words.sort(key=lambda w: -self.counts[w])
+        return words
+
+#
+# An expansion in progress. The candidates from the current buffer are computed up front. The
+# other buffers are only consulted (one at a time) when we run out, and each new candidate is
+# appended to the list, so cycling through candidates is constant time.
+#
+class Expansion:
+    def __init__(self, start, prefix, candidates, others):
+        self.start = start
+        self.end = start + len(prefix)
+        self.prefix = prefix
+        self.candidates = candidates
+        self.others = others
+        self.seen = set(candidates)
+        self.index = -1
+
+    #
+    # Returns the next candidate or None if there are no more.
+    #
+    def next(self):
+        self.index += 1
+        while self.index >= len(self.candidates) and self.others:
+            for word in self.others.pop(0)():
+                if word not in self.seen:
+                    self.seen.add(word)
+                    self.candidates.append(word)
+        if self.index < len(self.candidates):
+            return self.candidates[self.index]
+        return None
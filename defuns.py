@@ -0,0 +1,119 @@
+import sublime
+from bisect import bisect_left, bisect_right
+
+#
+# Index of the start and end positions of definitions (functions or classes) in a buffer. The names
+# of definitions come from the syntax (e.g., entity.name.function), so a definition starts at the
+# beginning of the line containing its name. A definition ends at the last line indented more than
+# its first line, or at the closing bracket (or "end") at the same indent if there is one.
+#
+# Indexes are built lazily the first time they are needed and thrown away when the buffer changes,
+# so repeated motion commands only have to bisect the positions. An index can cover just part of the
+# buffer (when it's narrowed), in which case only that part is read.
+#
+class DefunIndex:
+    SELECTORS = {
+        "function": "entity.name.function",
+        "class": "entity.name.class, entity.name.type.class",
+    }
+
+    # (buffer_id, what) -> DefunIndex
+    indexes = dict()
+
+    def __init__(self, view, what, span=None):
+        self.change_count = view.change_count()
+        self.span = span
+        self.starts = []
+        self.ends = []
+        self.build(view, self.SELECTORS[what], span or sublime.Region(0, view.size()))
+
+    #
+    # Returns the index for the definitions in span (None for the whole buffer).
+    #
+    @classmethod
+    def get(cls, view, what, span=None):
+        key = (view.buffer_id(), what)
+        index = cls.indexes.get(key)
+        if index is None or index.change_count != view.change_count() or index.span != span:
+            index = cls.indexes[key] = DefunIndex(view, what, span)
+        return index
+
+    @classmethod
+    def on_view_closed(cls, view):
+        for what in cls.SELECTORS:
+            cls.indexes.pop((view.buffer_id(), what), None)
+
+    def build(self, view, selector, span):
+        names = [name for name in view.find_by_selector(selector) if span.contains(name)]
+        if not names:
+            return
+        lines = view.substr(span).split("\n")
+
+        line_starts = [span.a]
+        for line in lines:
+            line_starts.append(line_starts[-1] + len(line) + 1)
+
+        def indent_of(row):
+            line = lines[row]
+            return len(line) - len(line.lstrip(" \t")), line.strip()
+
+        starts = []
+        ends = []
+        for name in names:
+            row = bisect_right(line_starts, name.begin()) - 1
+            if starts and starts[-1] == line_starts[row]:
+                continue
+            indent, text = indent_of(row)
+            end_row = row
+            for r in range(row + 1, len(lines)):
+                i, text = indent_of(r)
+                if not text:
+                    continue
+                if i <= indent:
+                    if text[0] in ")]}" or text == "end" or text.startswith("end "):
+                        end_row = r
+                    elif text[0] in "{":
+                        continue
+                    break
+                end_row = r
+            starts.append(line_starts[row])
+            ends.append(line_starts[end_row] + len(lines[end_row]))
+        self.starts = starts
+        self.ends = sorted(ends)
+
+    #
+    # Returns the start of the count'th definition before pos (or after pos if count is negative).
+    # If there are fewer than that we stop at the first (or last) one. Returns None if there are no
+    # definitions in that direction.
+    #
+    def backward(self, pos, count=1):
+        starts = self.starts
+        if count > 0:
+            index = bisect_left(starts, pos) - count
+            index = max(index, 0)
+            if index < len(starts) and starts[index] < pos:
+                return starts[index]
+        elif count < 0:
+            index = bisect_right(starts, pos) - count - 1
+            index = min(index, len(starts) - 1)
+            if index >= 0 and starts[index] > pos:
+                return starts[index]
+        return None
+
+    #
+    # Returns the end of the count'th definition after pos (or before pos if count is negative),
+    # with the same rules as backward.
+    #
+    def forward(self, pos, count=1):
+        ends = self.ends
+        if count > 0:
+            index = bisect_right(ends, pos) + count - 1
+            index = min(index, len(ends) - 1)
+            if index >= 0 and ends[index] > pos:
+                return ends[index]
+        elif count < 0:
+            index = bisect_left(ends, pos) + count
+            index = max(index, 0)
+            if index < len(ends) and ends[index] < pos:
+                return ends[index]
+        return None
@@ -0,0 +1,163 @@
+import re
+
+#
+# Paragraph filling. Lines are split into a prefix (indentation, plus a comment marker when filling
+# a comment) and a body. A paragraph is a run of lines with the same prefix and non-blank bodies. A
+# bulleted line (one whose body starts with "-", "*", "+" or "1." etc.) always starts a new
+# paragraph and the lines after it continue that paragraph if they are indented under the text of
+# the bullet.
+#
+class Filler:
+    BULLET_RE = re.compile(r'([-*+]|\d+[.)])[ \t]+(?=\S)')
+
+    # lines with nothing worth filling (e.g., """ or */ or ---), headings and code fences
+    SEPARATOR_RE = re.compile(r'[^\w]*$|#+[ \t]|```')
+
+    def __init__(self, width, markers=(), tab_size=4):
+        self.width = width
+        self.tab_size = tab_size
+        # longest markers first so that "//" wins over "/"
+        markers = sorted(set(m.strip() for m in markers if m.strip()), key=len, reverse=True)
+        if markers:
+            self.prefix_re = re.compile(r'([ \t]*(?:%s)*)([ \t]*)' % "|".join(re.escape(m) for m in markers))
+        else:
+            self.prefix_re = re.compile(r'()([ \t]*)')
+
+    #
+    # Returns (base, pad, body) where base is the indentation and comment markers, pad is the white
+    # space after that and body is the rest of the line.
+    #
+    def split(self, line):
+        m = self.prefix_re.match(line)
+        return m.group(1), m.group(2), line[m.end():]
+
+    def columns(self, text):
+        return len(text.expandtabs(self.tab_size))
+
+    def is_separator(self, body):
+        return not body.strip() or self.SEPARATOR_RE.match(body) is not None
+
+    #
+    # Returns a list of (start, end, first_prefix, prefix) for each paragraph in lines, where
+    # lines[start:end] are the lines of the paragraph.
+    #
+    def paragraphs(self, lines):
+        result = []
+        n = len(lines)
+        i = 0
+        while i < n:
+            base, pad, body = self.split(lines[i])
+            if self.is_separator(body):
+                i += 1
+                continue
+            bullet = self.BULLET_RE.match(body)
+            first_prefix = base + pad
+            if bullet:
+                first_prefix += bullet.group(0)
+                prefix = base + pad + " " * len(bullet.group(0))
+            else:
+                prefix = first_prefix
+            j = i + 1
+            while j < n:
+                b, p, body = self.split(lines[j])
+                if b != base or self.is_separator(body) or self.BULLET_RE.match(body):
+                    break
+                if bullet:
+                    if self.columns(b + p) <= self.columns(base + pad):
+                        break
+                elif p != pad:
+                    break
+                j += 1
+            result.append((i, j, first_prefix, prefix))
+            i = j
+        return result
+
+    #
+    # Fill the paragraph made of lines, returning the new lines.
+    #
+    def fill_paragraph(self, lines, first_prefix, prefix):
+        words = []
+        for index, line in enumerate(lines):
+            body = line[len(first_prefix):] if index == 0 else self.split(line)[2]
+            words.extend(body.split())
+        first_width = self.width - self.columns(first_prefix)
+        width = self.width - self.columns(prefix)
+        result = []
+        for index, (start, end) in enumerate(break_lines(words, width, first_width)):
+            result.append((first_prefix if index == 0 else prefix) + " ".join(words[start:end]))
+        return result
+
+    #
+    # Fill all the paragraphs in lines, returning the new lines. Lines which are not part of any
+    # paragraph are left alone, as are the paragraphs for which keep(index of the first line, first
+    # prefix) is false (e.g., code rather than comments).
+    #
+    def fill(self, lines, keep=None):
+        result = []
+        pos = 0
+        for start, end, first_prefix, prefix in self.paragraphs(lines):
+            if keep is not None and not keep(start, first_prefix):
+                continue
+            result.extend(lines[pos:start])
+            result.extend(self.fill_paragraph(lines[start:end], first_prefix, prefix))
+            pos = end
+        result.extend(lines[pos:])
+        return result
+
+#
+# Minimum raggedness line breaking: choose the breaks which minimize the sum of the squares of the
+# space left at the end of each line except the last. This is the classic dynamic program except
+# that we only look back as far as a line can reach, so it runs in time proportional to the number
+# of words times the number of words on a line. A word longer than the width gets a line of its
+# own.
+#
+# Returns a list of (start, end) word index ranges, one per line.
+#
+def break_lines(words, width, first_width=None):
+    if first_width is None:
+        first_width = width
+    n = len(words)
+    if n == 0:
+        return []
+    lengths = [len(w) for w in words]
+    reach = max(width, first_width)
+    best = [0] + [None] * n
+    prev = [0] * (n + 1)
+    for j in range(1, n + 1):
+        length = -1
+        i = j
+        while i > 0:
+            length += lengths[i - 1] + 1
+            if length > reach and i < j:
+                break
+            limit = first_width if i == 1 else width
+            if length <= limit or i == j:
+                slack = limit - length
+                cost = 0 if j == n or slack < 0 else slack * slack
+                total = best[i - 1] + cost
+                if best[j] is None or total < best[j]:
+                    best[j] = total
+                    prev[j] = i - 1
+            i -= 1
+    lines = []
+    j = n
+    while j > 0:
+        lines.append((prev[j], j))
+        j = prev[j]
+    lines.reverse()
+    return lines
+
+#
+# Returns the offset in new_text which corresponds to offset in old_text, assuming the two differ
+# only in white space and the characters in ignore (e.g., comment markers).
+#
+def same_position(old_text, offset, new_text, ignore=""):
+    ignore = " \t\n" + ignore
+    count = len([ch for ch in old_text[:offset] if ch not in ignore])
+    pos = 0
+    limit = len(new_text)
+    while pos < limit and count > 0:
+        if new_text[pos] not in ignore:
+            count -= 1
+        pos += 1
+    return pos
@@ -0,0 +1,156 @@
+import fnmatch, mmap, os, re, threading, time
+from collections import deque
+
+from .compilation import Compilation
+from .tags import SKIP_DIRS
+from .workers import get_thread_pool, cpu_count
+
+#
+# Returns [(line, col, text)] for the lines in the file at path which match the bytes regex, or
+# None if the file looks binary. The file is memory-mapped rather than read.
+#
+def grep_file(path, regex, max_matches=1000, max_length=300):
+    try:
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return []
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, IOError, ValueError):
+        return []
+    try:
+        if data.find(b"\0", 0, 8192) >= 0:
+            return None
+        result = []
+        line = 1
+        counted = 0
+        last_start = -1
+        for m in regex.finditer(data):
+            start = m.start()
+            line_start = data.rfind(b"\n", 0, start) + 1
+            if line_start == last_start:
+                continue
+            last_start = line_start
+            line += data[counted:line_start].count(b"\n")
+            counted = line_start
+            line_end = data.find(b"\n", start)
+            if line_end < 0:
+                line_end = len(data)
+            text = data[line_start:min(line_end, line_start + max_length)]
+            col = len(text[:start - line_start].decode("utf-8", "replace")) + 1
+            result.append((line, col, text.decode("utf-8", "replace").rstrip("\r")))
+            if len(result) >= max_matches:
+                break
+        return result
+    finally:
+        data.close()
+
+def grep_files(paths, pattern, flags):
+    regex = re.compile(pattern, flags)
+    return [grep_file(path, regex) for path in paths]
+
+#
+# Search the files under some folders for a regex. A background thread walks the folders and hands
+# out batches of files to the thread pool, and the results of each batch are added to the
+# compilation panel as soon as it and all the batches before it are done, so the output is in a
+# stable order. The matches are indexed as errors, so jove_next_error visits them. The matching
+# is python's regexps, which hold the GIL, so the pool keeps it off the UI thread (and overlaps it
+# with reading the files) rather than running it on every core.
+#
+class Grep(Compilation):
+    PANEL = "jove_grep"
+    BATCH_SIZE = 64
+
+    # the most recent search, which has the panel (a build can run at the same time)
+    current = None
+
+    def __init__(self, window, pattern, folders, settings):
+        Compilation.__init__(self, window, "grep " + pattern, folders[0], panel=self.PANEL)
+        flags = re.MULTILINE
+        if not re.search(r'[A-Z]', pattern):
+            flags |= re.IGNORECASE
+        self.pattern = pattern.encode("utf-8")
+        self.flags = flags
+        self.folders = folders
+        self.exclude_dirs = settings.get("folder_exclude_patterns", [])
+        self.exclude_files = settings.get("file_exclude_patterns", []) + settings.get("binary_file_patterns", [])
+        self.running = False
+
+    def start(self):
+        re.compile(self.pattern, self.flags)
+        self.make_current()
+        self.open_panel()
+        self.output("Searching for %s in %s\n\n" % (self.pattern.decode("utf-8"), ", ".join(self.folders)))
+        self.started = time.time()
+        self.running = True
+        threading.Thread(target=self.search).start()
+
+    def kill(self):
+        self.killed = True
+
+    def is_running(self):
+        return self.running
+
+    def search(self):
+        pool = get_thread_pool()
+        in_flight = deque()
+        stats = [0, 0, 0]
+        batch = []
+        try:
+            for path in self.walk():
+                if self.killed:
+                    break
+                batch.append(path)
+                if len(batch) == self.BATCH_SIZE:
+                    in_flight.append((batch, pool.submit(grep_files, batch, self.pattern, self.flags)))
+                    batch = []
+                    # report the batches which are done, and don't get too far ahead of the workers
+                    while in_flight and (in_flight[0][1].done() or len(in_flight) > 4 * cpu_count()):
+                        self.report(*in_flight.popleft(), stats=stats)
+            if batch:
+                in_flight.append((batch, pool.submit(grep_files, batch, self.pattern, self.flags)))
+            while in_flight and not self.killed:
+                self.report(*in_flight.popleft(), stats=stats)
+        finally:
+            self.running = False
+            files, matched, matches = stats
+            status = "killed" if self.killed else "finished"
+            self.output("\nGrep %s at %s (%.1fs, %d matches in %d of %d files)\n" % (
+                status, time.strftime("%X"), time.time() - self.started, matches, matched, files))
+
+    #
+    # Output the results of a batch, in the order of the files in it.
+    #
+    def report(self, batch, future, stats):
+        results = future.result()
+        lines = []
+        for path, matches in zip(batch, results):
+            if matches is None:
+                continue
+            stats[0] += 1
+            if not matches:
+                continue
+            stats[1] += 1
+            stats[2] += len(matches)
+            name = os.path.relpath(path, self.directory) if path.startswith(self.directory) else path
+            for line, col, text in matches:
+                lines.append(("%s:%d:%d: %s\n" % (name, line, col, text), (path, line, col)))
+        if lines:
+            self.output_lines(lines)
+
+    #
+    # Yields the paths of the files in our folders, skipping version control and excluded
+    # directories and excluded or binary files (by name).
+    #
+    def walk(self):
+        def excluded(name, patterns):
+            for pattern in patterns:
+                if fnmatch.fnmatch(name, pattern):
+                    return True
+            return False
+
+        for folder in self.folders:
+            for root, dirs, names in os.walk(folder):
+                dirs[:] = sorted(d for d in dirs if d not in SKIP_DIRS and not excluded(d, self.exclude_dirs))
+                for name in sorted(names):
+                    if not excluded(name, self.exclude_files):
+                        yield os.path.join(root, name)
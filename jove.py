@@ -1,39 +1,72 @@
 # IMPLEMENT
 # - C-x C-o
 #
-# - implement a build command which lets me specify the make command I want to run
-# - implement forward/backward "defun" via scope selectors
-# - implement forward/backward class definition via scope selectors
-# - make fill paragraph smart about bulleted (i.e., ones that start with "-" or "*")
 # - add support for "set mark automatically" commands
 #   - move_to brackets but not necessarily other move_to's
 #   - maybe get rid of your own move to eof and bof if you can get this working
 #   - goto symbol stuff will be harder...
 # - add an up-arrow (or meta-P meta-N) history mechanism for incremental search
 
-# FIX
-#
-# fix comments so you can comment in the right column if no region is selected
-
-import re, sys
+import os, re, sys, time
 import functools as fu
 import sublime, sublime_plugin
+from bisect import bisect_right
 from copy import copy
 
-from .kill_ring import KillRing
+from .kill_ring import KillRing, as_text
 from .mark_ring import MarkRing
+from .reindent import Reindenter
+from .fill import Filler, same_position
+from .comment import Commenter, shift_column
+from .defuns import DefunIndex
+from .compilation import Compilation, get_directory
+from .occur import Occur
+from .dabbrev import WordIndex, Expansion
+from .buffertext import BufferText
+from .rectangle import Rectangle, display_column
+from .macro import Macro
+from .memory import MemoryReport, format_size, traced_allocations, tracemalloc
+from .tags import TagIndex, DEFAULT_EXTENSIONS
+from .grep import Grep
+from .coalesce import Coalescer
+from .benchmark import run_line_benchmark, LINE_LENGTHS
+from .switcher import BufferSwitcher
+from .lines import sort_lines, delete_duplicate_lines
+from .workers import get_thread_pool
+from .trace import Trace
+from .whitespace import (trailing_whitespace_edits, horizontal_space_edits, tabify_edits,
+                         untabify_edits)
 
 JOVE_STATUS = "jove"
+JOVE_MACRO_STATUS = "jove_macro"
+JOVE_LARGE_FILE_STATUS = "jove_large_file"
+JOVE_NARROW_STATUS = "jove_narrow"
+JOVE_NARROW_REGION = "jove_narrow"
+JOVE_SWITCH_STATUS = "jove_switch"
+
+# how long status updates are deferred in large file mode (ms)
+STATUS_DELAY = 100
+
+# how much of a line past its indentation reindenting reads, at the end of the span and for context
+MAX_LINE_READ = 4096
+
+# how long scrolling to show point is deferred, so there's at most one scroll per frame (ms)
+VIEWPORT_DELAY = 16
 
 ISEARCH_ESCAPE_CMDS = ('move_to', 'jove_center_view', 'move', 'jove_universal_argument',
                        'jove_move_word', 'jove_move_to', 'scroll_lines')
 
 default_jove_sexpr_separators = "./\\()\"'-:,.;<>~!@#$%^&*|+=[]{}`~?";
 default_jove_word_separators = "./\\()\"'-_:,.;<>~!@#$%^&*|+=[]{}`~?";
+default_jove_large_file_size = 5 * 1024 * 1024
 
 # kill ring shared across all buffers
 kill_ring = KillRing()
 
+# where we were before each jump to a tag: (file name, view id, row, col)
+tag_stack = []
+TAG_STACK_SIZE = 16
+
 # ensure_visible commands
 ensure_visible_cmds = set(['move', 'move_to'])
 
@@ -43,6 +76,9 @@ kill_cmds = set()
 # repeatable commands
 repeatable_cmds = set(['move', 'left_delete', 'right_delete'])
 
+# commands whose key repeats are merged when we fall behind (see Coalescer)
+coalesced_cmds = repeatable_cmds | set(['jove_move_line'])
+
 #
 # We store state about each view.
 #
@@ -56,18 +92,68 @@ class ViewState():
     # current in-progress i-search instance
     isearch_info = None
 
+    # current in-progress query replace instance
+    query_replace_info = None
+
     def __init__(self, view):
         self.view = view
         self.active_mark = False
 
+        # the dynamic abbreviation expansion in progress
+        self.dabbrev = None
+
+        # cached text of the buffer, see CmdHelper.get_text()
+        self.buffer_text = None
+
+        # large file mode: whether it's on, and whether it was forced on or off by command (None
+        # means it depends on the size of the buffer)
+        self.large_file = False
+        self.large_file_override = None
+
+        # status text waiting to be displayed (in large file mode)
+        self.pending_status = None
+
+        # (point, center) waiting to be scrolled into view
+        self.pending_visible = None
+
+        # merges key repeats of repeatable commands
+        self.coalescer = Coalescer(view)
+
+        # if the buffer is narrowed, how many characters at the start of the JOVE_NARROW_REGION
+        # region are outside it: it starts one early (unless it's at the beginning of the buffer) so
+        # that text inserted at the start of the narrowed region stays inside it
+        self.narrowed = None
+
+        # the goal column (an x layout position) for vertical motion, and the point and change
+        # count it was left at: it's used again only if nothing has changed since
+        self.goal_column = None
+        self.goal_point = None
+        self.goal_change_count = None
+
         # a mark ring per view (should be per buffer)
         self.mark_ring = MarkRing(view)
         self.reset()
+        self.update_large_file()
 
     @classmethod
     def on_view_closed(cls, view):
         if view.id() in cls.view_state_dict:
             del(cls.view_state_dict[view.id()])
+        if ViewState.current is not None and ViewState.current.view.id() == view.id():
+            ViewState.current = None
+
+    #
+    # Remove the state of views which no longer exist (e.g., input panels, which we don't get
+    # on_close for). Returns the number removed.
+    #
+    @classmethod
+    def remove_stale(cls):
+        stale = [vid for vid, state in cls.view_state_dict.items() if not state.view.is_valid()]
+        for vid in stale:
+            del(cls.view_state_dict[vid])
+        if ViewState.current is not None and not ViewState.current.view.is_valid():
+            ViewState.current = None
+        return len(stale)
 
     @classmethod
     def get(cls, view):
@@ -112,6 +198,24 @@ class ViewState():
     def last_was_kill_cmd(self):
         return self.last_cmd in kill_cmds
 
+    #
+    # Work out whether large file mode should be on for this view, either because it was forced by
+    # jove_large_file_mode or the buffer is bigger than jove_large_file_size. In large file mode we
+    # skip or cut back on things which get expensive on huge buffers. The result is cached in
+    # large_file, so it's cheap to check.
+    #
+    def update_large_file(self):
+        view = self.view
+        large = self.large_file_override
+        if large is None:
+            large = view.size() > view.settings().get("jove_large_file_size", default_jove_large_file_size)
+        if large != self.large_file:
+            self.large_file = large
+            if large:
+                view.set_status(JOVE_LARGE_FILE_STATUS, "Large file")
+            else:
+                view.erase_status(JOVE_LARGE_FILE_STATUS)
+
 class ViewWatcher(sublime_plugin.EventListener):
     def __init__(self, *args, **kwargs):
         super(ViewWatcher, self).__init__(*args, **kwargs)
@@ -119,9 +223,19 @@ class ViewWatcher(sublime_plugin.EventListener):
 
     def on_close(self, view):
         ViewState.on_view_closed(view)
+        DefunIndex.on_view_closed(view)
+        Occur.on_view_closed(view)
+        WordIndex.on_view_closed(view)
+        BufferSwitcher.on_view_closed(view)
 
     def on_modified(self, view):
         CmdHelper(view).toggle_active_mark_mode(False)
+        Occur.on_modified(view)
+        WordIndex.on_modified(view)
+        ViewState.get(view).update_large_file()
+
+    def on_load(self, view):
+        ViewState.get(view).update_large_file()
 
     def on_deactivated(self, view):
         info = ViewState.isearch_info
@@ -130,6 +244,10 @@ class ViewWatcher(sublime_plugin.EventListener):
             # we cannot dismiss the input panel because an overlay (if present) will lose focus
             info.deactivate()
 
+    def on_activated(self, view):
+        if not view.settings().get("is_widget"):
+            BufferSwitcher.on_activated(view)
+
     def on_activated_async(self, view):
         info = ViewState.isearch_info
         if info and not view.settings().get("is_widget"):
@@ -139,6 +257,9 @@ class ViewWatcher(sublime_plugin.EventListener):
     def on_query_context(self, view, key, operator, operand, match_all):
         if key == "i_search_active":
             return ViewState.isearch_info and ViewState.isearch_info.is_active
+        if key == "query_replace_active":
+            info = ViewState.query_replace_info
+            return info is not None and info.view == view
 
     def on_post_save(self, view):
         # Schedule a dedup, but do not do it NOW because it seems to cause a crash if, say, we're
@@ -155,9 +276,30 @@ class CmdWatcher(sublime_plugin.EventListener):
         view.erase_status(JOVE_STATUS)
 
     #
-    # Override some commands to execute them N times if the numberic argument is supplied.
+    # Record top-level commands if we're defining a macro or tracing. Commands run while a macro is
+    # playing have already been processed, so they skip all of this. Commands rewritten as jove
+    # commands are recorded when they run.
     #
     def on_text_command(self, view, cmd, args):
+        ViewState.get(view).coalescer.started()
+        if Macro.playing:
+            return
+        trace = Trace.current
+        snapshot = Trace.snapshot(view) if trace else None
+        result = self.process_command(view, cmd, args)
+        WordIndex.on_text_command(view)
+        Occur.on_text_command(view)
+        if ((Macro.recording or trace) and not cmd.startswith("jove_") and ViewState.get(view).entered == 0 and
+                not view.settings().get('is_widget') and not (result and result[0].startswith("jove_"))):
+            Macro.record(*(result or (cmd, args)))
+            if trace:
+                trace.record(view, *(result or (cmd, args)), snapshot=snapshot)
+        return result
+
+    #
+    # Override some commands to execute them N times if the numberic argument is supplied.
+    #
+    def process_command(self, view, cmd, args):
         if view.settings().get('is_widget') and ViewState.isearch_info:
             if cmd in ISEARCH_ESCAPE_CMDS:
                 return ('jove_inc_search_escape', {'next_cmd': cmd, 'next_args': args})
@@ -169,6 +311,21 @@ class CmdWatcher(sublime_plugin.EventListener):
         if args is None:
             args = {}
 
+        # held down repeatable commands which we haven't kept up with are merged into one (only the
+        # ones which come from keys, not the ones jove commands run)
+        if vs.entered == 0:
+            if (cmd in coalesced_cmds and not vs.argument_supplied and not vs.active_mark and
+                    not Macro.recording and not Macro.playing and ViewState.isearch_info is None):
+                if vs.coalescer.add(cmd, args):
+                    return ("jove_coalesced", {})
+            elif cmd != "jove_coalesced":
+                vs.coalescer.interrupt()
+
+        # any other command ends a query replace
+        info = ViewState.query_replace_info
+        if info and cmd != 'jove_query_replace':
+            info.finish()
+
         # first keep track of this_cmd and last_cmd (if command starts with "jove_" it's handled
         # elsewhere)
         if not cmd.startswith("jove_"):
@@ -213,6 +370,9 @@ class CmdWatcher(sublime_plugin.EventListener):
     # Post command processing: deal with active mark and resetting the numeric argument.
     #
     def on_post_text_command(self, view, cmd, args):
+        ViewState.get(view).coalescer.finished()
+        if Macro.playing:
+            return
         vs = ViewState.get(view)
         cm = CmdHelper(view)
         if vs.active_mark and vs.this_cmd != 'drag_select' and vs.last_cmd == 'drag_select':
@@ -226,16 +386,34 @@ class CmdWatcher(sublime_plugin.EventListener):
             vs.last_cmd = cmd
 
         if vs.active_mark:
-            if len(view.sel()) > 1:
+            selection = view.sel()
+            if len(selection) > 1:
                 # allow the awesomeness of multiple cursors to be used: the selection will disappear
                 # after the next command
                 vs.active_mark = False
             else:
-                cm.set_selection(cm.get_mark(), cm.get_point())
+                mark = cm.get_mark()
+                if not vs.large_file or selection[0].a != mark:
+                    cm.set_selection(mark, cm.get_point())
+
+        # sublime's own motion commands don't know about narrowing
+        if vs.narrowed is not None:
+            cm.clamp_cursors()
 
-        if cmd in ensure_visible_cmds and cm.just_one_point():
+        # in large file mode we leave it to sublime to show the cursor after its own motion commands
+        if cmd in ensure_visible_cmds and cm.just_one_point() and not (vs.large_file and not cmd.startswith("jove_")):
             cm.ensure_visible(cm.get_point())
 
+    #
+    # Window commands (e.g., playing a sublime macro) can run text commands, which mustn't be
+    # coalesced.
+    #
+    def on_window_command(self, window, cmd, args):
+        Coalescer.command_started()
+
+    def on_post_window_command(self, window, cmd, args):
+        Coalescer.command_finished()
+
     #
     # Process the selection if it was created from a drag_select (mouse dragging) command.
     #
@@ -274,12 +452,37 @@ class CmdHelper:
             state = ViewState.get(self.view)
         self.state = state
         self.edit = edit
+        self.text = None
+
+    #
+    # Returns the cached text of the buffer (a BufferText). The snapshot is taken the first time a
+    # command needs it and is shared with later commands until the buffer changes, so character and
+    # line queries don't have to go back to the view. A command which edits the buffer and then
+    # reads it again must pass refresh=True.
+    #
+    def get_text(self, refresh=False):
+        if refresh or self.text is None:
+            self.text = BufferText.get(self.view, self.state)
+        return self.text
 
     #
     # Sets the status text on the bottom of the window.
     #
     def set_status(self, msg):
-        self.view.set_status(JOVE_STATUS, msg)
+        state = self.state
+        if not state.large_file:
+            self.view.set_status(JOVE_STATUS, msg)
+            return
+
+        # in large file mode only the last status set in a burst of commands is displayed
+        scheduled = state.pending_status is not None
+        state.pending_status = msg
+        if not scheduled:
+            def show():
+                if state.pending_status is not None:
+                    self.view.set_status(JOVE_STATUS, state.pending_status)
+                    state.pending_status = None
+            sublime.set_timeout(show, STATUS_DELAY)
 
     #
     # Returns point. Point is where the cursor is in the possibly extended region. If there are multiple cursors it
@@ -292,13 +495,13 @@ class CmdHelper:
         return -1
 
     #
-    # This no-op ensures the next/prev line target column is reset to the new locations.
+    # Forget the goal column, so the next jove_move_line starts a new one from where point is now.
+    # This only clears our own state: vertical motion goes through jove_move_line, so there's no
+    # need to dispatch sublime moves to reset its goal column.
     #
     def reset_target_column(self):
-        selection = self.view.sel()
-        if len(selection) == 1 and selection[0].empty() and selection[0].b < self.view.size():
-            self.run_command("move", {"by": "characters", "forward": True})
-            self.run_command("move", {"by": "characters", "forward": False})
+        self.state.goal_column = None
+        self.state.goal_point = None
 
     #
     # Returns the mark position.
@@ -326,6 +529,32 @@ class CmdHelper:
             point = self.get_point()
             return sublime.Region(mark, self.get_point())
 
+    #
+    # Returns the whole lines the region covers, not counting the line it ends at the start of, or
+    # None if there isn't a region.
+    #
+    def get_region_lines(self):
+        region = self.get_region()
+        if region is None:
+            return None
+        begin, end = region.begin(), region.end()
+        if end > begin and self.view.line(end).a == end:
+            end -= 1
+        return self.clip_region(self.view.line(sublime.Region(begin, end)))
+
+    #
+    # Replace the lines in span with new_lines as a single edit, leaving point and the mark at either
+    # end of them the same way round as before.
+    #
+    def replace_lines(self, span, new_lines):
+        mark = self.get_mark()
+        at_end = mark is None or self.get_point() >= mark
+        text = "\n".join(new_lines)
+        self.view.replace(self.edit, span, text)
+        end = span.a + len(text)
+        self.state.mark_ring.set(span.a if at_end else end, True)
+        self.set_selection(end if at_end else span.a)
+
     #
     # Save a copy of the current region in the named mark. This mark will be robust in the face of
     # changes to the buffer.
@@ -364,16 +593,15 @@ class CmdHelper:
     # Returns true if all the text between a and b is blank.
     #
     def is_blank(self, a, b):
-        text = self.view.substr(sublime.Region(a, b))
-        return re.match(r'[ \t]*$', text) is not None
+        return self.get_text().is_blank(a, b)
 
     #
     # Returns the current indent of the line containing the specified POS and the column of POS.
     #
     def get_line_indent(self, pos):
-        data,col,region = self.get_line_info(pos)
-        m = re.match(r'[ \t]*', data)
-        return (len(m.group(0)), col)
+        text = self.get_text()
+        region = text.line(pos)
+        return (text.indent_end(region.a, region.b) - region.a, pos - region.a)
 
     #
     # Sets the buffers mark to the specified pos (or the current position in the view).
@@ -425,12 +653,396 @@ class CmdHelper:
         selection.clear()
         selection.add(sublime.Region(a, b))
 
-    def get_line_info(self, point):
+    #
+    # Returns a Reindenter which uses the indentation rules of the syntax at pos.
+    #
+    def get_reindenter(self, pos):
         view = self.view
-        region = view.line(point)
-        data = view.substr(region)
-        row,col = view.rowcol(point)
-        return (data, col, region)
+        settings = view.settings()
+        keep_dedents = settings.get("jove_indent_keep_dedents", None)
+        if keep_dedents is None:
+            keep_dedents = view.score_selector(pos, "source.python") > 0
+        return Reindenter(tab_size=settings.get("tab_size", 4),
+                          use_spaces=settings.get("translate_tabs_to_spaces", False),
+                          increase=view.meta_info("increaseIndentPattern", pos),
+                          decrease=view.meta_info("decreaseIndentPattern", pos),
+                          indent_next=view.meta_info("bracketIndentNextLinePattern", pos),
+                          unindented=view.meta_info("unIndentedLinePattern", pos),
+                          keep_dedents=keep_dedents)
+
+    #
+    # Returns the offsets from span.a of the start of each of lines (the text of span split at
+    # newlines) and of the end of the last one, and the set of the indexes of the lines touched by
+    # the regions, not counting the line a non-empty region ends at column 0 of.
+    #
+    @staticmethod
+    def get_target_lines(regions, span, lines):
+        starts = [0]
+        for line in lines:
+            starts.append(starts[-1] + len(line) + 1)
+
+        targets = set()
+        for r in regions:
+            first = bisect_right(starts, r.begin() - span.a) - 1
+            last = bisect_right(starts, r.end() - span.a) - 1
+            if last > first and starts[last] == r.end() - span.a:
+                last -= 1
+            targets.update(range(first, last + 1))
+        return starts, targets
+
+    #
+    # Reindent every line touched by the specified regions. The text from the first line to the
+    # last is read once, along with the closest non-blank line before it for context. All the
+    # changes are made in one pass from the end backwards so they are a single undo step. Cursors
+    # within the indent of a line are moved to the start of its text, as emacs does. Only the start
+    # and end of a very long last or context line are read (up to MAX_LINE_READ characters each),
+    # which is all the indentation rules look at in practice.
+    #
+    # Returns the number of lines that were changed.
+    #
+    def reindent_regions(self, regions):
+        view = self.view
+        begin = min(r.begin() for r in regions)
+        end = max(r.end() for r in regions)
+        span = view.line(sublime.Region(begin, end))
+        text = self.get_text()
+        last_line = text.line(span.b)
+        span = sublime.Region(span.a, min(span.b, text.indent_end(last_line.a, span.b) + MAX_LINE_READ))
+        lines = view.substr(span).split("\n")
+        starts, targets = self.get_target_lines(regions, span, lines)
+
+        # the closest non-blank line before the span provides the context
+        context = None
+        pos = span.a
+        while pos > 0 and context is None:
+            line = text.line(pos - 1)
+            if line.size() > 2 * MAX_LINE_READ:
+                data = text.substr(line.a, line.a + MAX_LINE_READ) + text.substr(line.b - MAX_LINE_READ, line.b)
+            else:
+                data = text.substr(line.a, line.b)
+            if data.strip():
+                context = data
+            pos = line.a
+
+        reindenter = self.get_reindenter(span.a)
+        changes = reindenter.reindent(lines, context, targets)
+        selection = view.sel()
+        cursors = [r for r in selection]
+        for index, old_length, indent in reversed(changes):
+            start = span.a + starts[index]
+            view.replace(self.edit, sublime.Region(start, start + old_length), indent)
+
+        # now put the cursors where they belong in the new text
+        changed = dict((index, (old_length, len(indent))) for index, old_length, indent in changes)
+        shift = [0]
+        for index in range(len(lines)):
+            old_length, new_length = changed.get(index, (0, 0))
+            shift.append(shift[-1] + new_length - old_length)
+
+        def move(pos):
+            if pos > span.b:
+                return pos + shift[-1]
+            index = bisect_right(starts, pos - span.a) - 1
+            col = pos - span.a - starts[index]
+            if index in targets:
+                if index in changed:
+                    old_length, new_length = changed[index]
+                else:
+                    old_length = new_length = reindenter.measure(lines[index])[1]
+                col = new_length + max(0, col - old_length)
+            return span.a + starts[index] + shift[index] + col
+
+        cursors = [sublime.Region(move(r.a), move(r.b)) for r in cursors]
+        selection.clear()
+        selection.add_all(cursors)
+        return len(changes)
+
+    #
+    # Returns a Filler for the paragraphs around pos. The comment markers of the syntax at pos are
+    # part of each line's prefix, as is the "*" which continues a block comment if pos is in one.
+    # The fill column is the numeric argument if supplied.
+    #
+    def get_filler(self, pos):
+        view = self.view
+        settings = view.settings()
+        if self.has_prefix_arg():
+            width = self.get_count()
+        else:
+            width = settings.get("jove_fill_column", 100)
+
+        markers = []
+        for var in view.meta_info("shellVariables", pos) or []:
+            if var.get("name", "").startswith("TM_COMMENT_START"):
+                markers.append(var["value"])
+        text = self.get_text()
+        region = text.line(pos)
+        start = text.indent_end(region.a, region.b)
+        if "comment.block" in view.scope_name(start):
+            markers.append("*")
+        return Filler(width, markers, settings.get("tab_size", 4))
+
+    #
+    # Returns true if the text at pos is something we fill: a comment, a string or plain text, as
+    # opposed to code.
+    #
+    def is_fillable(self, pos):
+        return self.view.match_selector(pos, "comment, string, text")
+
+    #
+    # Returns a Commenter for the syntax at pos, preferring line comments to block comments, or None
+    # if the syntax has no comments.
+    #
+    def get_commenter(self, pos):
+        view = self.view
+        variables = dict((var.get("name"), var.get("value"))
+                         for var in view.meta_info("shellVariables", pos) or [])
+        block = None
+        for suffix in ("", "_2", "_3"):
+            start = variables.get("TM_COMMENT_START" + suffix)
+            if not start or not start.strip():
+                continue
+            end = variables.get("TM_COMMENT_END" + suffix) or ""
+            if not end.strip():
+                return Commenter(start, "", view.settings().get("tab_size", 4))
+            if block is None:
+                block = (start, end)
+        if block:
+            return Commenter(block[0], block[1], view.settings().get("tab_size", 4))
+
+    #
+    # Comment, uncomment or toggle (action is the Commenter method) the lines touched by the regions,
+    # not counting the line a non-empty region ends at column 0 of. Each run of adjacent lines is
+    # treated as one block, so its comment markers line up. The lines are read once and replaced in
+    # a single edit, and the cursors and the mark stay with the text they were on.
+    #
+    # Returns the number of lines that were changed, or None if the syntax has no comments.
+    #
+    def comment_regions(self, regions, action):
+        view = self.view
+        regions = [self.clip_region(r) for r in regions]
+        begin = min(r.begin() for r in regions)
+        end = max(r.end() for r in regions)
+        commenter = self.get_commenter(begin)
+        if commenter is None:
+            return None
+        span = self.clip_region(view.line(sublime.Region(begin, end)))
+        lines = view.substr(span).split("\n")
+        starts, targets = self.get_target_lines(regions, span, lines)
+
+        new_lines = list(lines)
+        method = getattr(commenter, action)
+        index = 0
+        while index < len(lines):
+            if index not in targets:
+                index += 1
+                continue
+            block_end = index
+            while block_end in targets:
+                block_end += 1
+            new_lines[index:block_end] = method(lines[index:block_end])
+            index = block_end
+        changed = len([i for i in targets if lines[i] != new_lines[i]])
+        if not changed:
+            return 0
+
+        new_starts = [0]
+        for line in new_lines:
+            new_starts.append(new_starts[-1] + len(line) + 1)
+
+        def move(pos):
+            if pos < span.a:
+                return pos
+            if pos > span.b:
+                return pos + new_starts[-1] - starts[-1]
+            index = bisect_right(starts, pos - span.a) - 1
+            col = shift_column(lines[index], new_lines[index], pos - span.a - starts[index])
+            return span.a + new_starts[index] + col
+
+        selection = view.sel()
+        cursors = [sublime.Region(move(r.a), move(r.b)) for r in selection]
+        mark = self.get_mark()
+        view.replace(self.edit, span, "\n".join(new_lines))
+        selection.clear()
+        selection.add_all(cursors)
+        if mark is not None:
+            self.state.mark_ring.set(move(mark), True)
+        return changed
+
+    #
+    # Returns the region the buffer is narrowed to, or None.
+    #
+    def get_narrowed(self):
+        skip = self.state.narrowed
+        if skip is not None:
+            r = self.view.get_regions(JOVE_NARROW_REGION)
+            if r:
+                r = r[0]
+                return sublime.Region(min(r.a + skip, r.b) if skip else 0, r.b)
+
+    #
+    # Returns (start, end) of the accessible part of the buffer: the narrowed region or all of it.
+    #
+    def get_limits(self):
+        narrowed = self.get_narrowed()
+        if narrowed is not None:
+            return narrowed.a, narrowed.b
+        return 0, self.view.size()
+
+    #
+    # Returns region cut down to the part of it inside the narrowed region, if the buffer is narrowed.
+    #
+    def clip_region(self, region):
+        lo, hi = self.get_limits()
+        return sublime.Region(min(max(region.a, lo), hi), min(max(region.b, lo), hi))
+
+    def narrow(self, region):
+        self.widen()
+        view = self.view
+        skip = 1 if region.begin() > 0 else 0
+        view.add_regions(JOVE_NARROW_REGION, [sublime.Region(region.begin() - skip, region.end())],
+                         "", "", sublime.HIDDEN)
+        self.state.narrowed = skip
+        outside = [r for r in (sublime.Region(0, region.begin()), sublime.Region(region.end(), view.size()))
+                   if not r.empty()]
+        if outside:
+            view.fold(outside)
+        view.set_status(JOVE_NARROW_STATUS, "Narrow")
+        self.clamp_cursors()
+
+    def widen(self):
+        narrowed = self.get_narrowed()
+        if narrowed is None:
+            return
+        self.state.narrowed = None
+        view = self.view
+        view.erase_regions(JOVE_NARROW_REGION)
+        view.erase_status(JOVE_NARROW_STATUS)
+        outside = [r for r in (sublime.Region(0, narrowed.a), sublime.Region(narrowed.b, view.size()))
+                   if not r.empty()]
+        if outside:
+            view.unfold(outside)
+
+    #
+    # Move any cursors outside the narrowed region to its nearest edge.
+    #
+    def clamp_cursors(self):
+        narrowed = self.get_narrowed()
+        if narrowed is None:
+            return
+        selection = self.view.sel()
+        cursors = [r for r in selection]
+        clamped = [self.clip_region(r) for r in cursors]
+        if clamped != cursors:
+            selection.clear()
+            selection.add_all(clamped)
+
+    #
+    # Replace each of the regions (which must be sorted and not overlap) with the corresponding text.
+    # We work backwards so that the regions we haven't got to yet stay put. Returns the regions of
+    # the new text.
+    #
+    def replace_regions(self, regions, texts):
+        view = self.view
+        for region, text in zip(reversed(regions), reversed(texts)):
+            view.replace(self.edit, region, text)
+        result = []
+        delta = 0
+        for region, text in zip(regions, texts):
+            start = region.begin() + delta
+            result.append(sublime.Region(start, start + len(text)))
+            delta += len(text) - region.size()
+        return result
+
+    #
+    # Make the edits, a sorted list of non-overlapping (start, end, text) replacements, as one undo
+    # step. They are made one at a time from the end backwards, so the earlier offsets stay good and
+    # the text between them (and any regions added to the view there) is left alone. The cursors and
+    # the mark are moved through the edits here. Returns the number of edits.
+    #
+    def apply_edits(self, edits):
+        view = self.view
+        starts = []
+        shifts = [0]
+        for start, end, text in edits:
+            starts.append(start)
+            shifts.append(shifts[-1] + len(text) - (end - start))
+
+        def move(pos):
+            index = bisect_right(starts, pos) - 1
+            if index < 0:
+                return pos
+            start, end, text = edits[index]
+            if pos >= end:
+                return pos + shifts[index + 1]
+            # inside the edit
+            return start + shifts[index] + min(pos - start, len(text))
+
+        selection = view.sel()
+        cursors = [sublime.Region(move(r.a), move(r.b)) for r in selection]
+        mark = self.get_mark()
+        for start, end, text in reversed(edits):
+            view.replace(self.edit, sublime.Region(start, end), text)
+        selection.clear()
+        selection.add_all(cursors)
+        if mark is not None:
+            self.state.mark_ring.set(move(mark), True)
+        return len(edits)
+
+    #
+    # Returns the regions (whole lines) a cleanup command works on: the emacs region if the mark is
+    # active, the lines of each selection if there are several, otherwise the whole buffer. They are
+    # cut down to the narrowed region, if there is one.
+    #
+    def get_cleanup_regions(self):
+        view = self.view
+        selection = view.sel()
+        if len(selection) == 1 and self.state.active_mark:
+            region = self.get_region()
+            if region:
+                return [self.clip_region(view.line(region))]
+        regions = [self.clip_region(view.line(r)) for r in selection if not r.empty()]
+        regions = [r for r in regions if not r.empty()]
+        return regions or [sublime.Region(*self.get_limits())]
+
+    #
+    # Calls compute(text) for each of the regions, which returns edits with offsets into text, and
+    # makes all the edits at once. The text of all the regions is read in one go.
+    #
+    def cleanup_regions(self, regions, compute):
+        view = self.view
+        span = sublime.Region(regions[0].begin(), regions[-1].end())
+        text = view.substr(span)
+        edits = []
+        last = span.a
+        for region in regions:
+            begin = max(region.begin(), last)
+            end = region.end()
+            if begin >= end:
+                continue
+            edits.extend((begin + a, begin + b, new)
+                         for a, b, new in compute(text[begin - span.a:end - span.a]))
+            last = end
+        return self.apply_edits(edits)
+
+    #
+    # Add the text of the regions to the kill ring (a list of strings when there are several of them)
+    # and erase them, leaving a cursor where each one was. Overlapping regions are merged first.
+    #
+    def kill_regions(self, regions, forward, join, erase=True):
+        merged = []
+        for region in sorted(regions, key=lambda r: r.begin()):
+            if merged and region.begin() <= merged[-1].end():
+                merged[-1] = merged[-1].cover(region)
+            else:
+                merged.append(region)
+        text = self.get_text()
+        killed = [text.substr(r.begin(), r.end()) for r in merged]
+        kill_ring.add(killed[0] if len(killed) == 1 else killed, forward=forward, join=join)
+        if erase:
+            cursors = self.replace_regions(merged, [""] * len(merged))
+            selection = self.view.sel()
+            selection.clear()
+            selection.add_all(cursors)
 
     def run_window_command(self, cmd, args):
         self.view.window().run_command(cmd, args)
@@ -468,7 +1080,9 @@ class CmdHelper:
         cursors = [c for c in selection]
         view.add_regions(key, cursors, "tmp", "", sublime.HIDDEN)
 
-        # run the command passing in each cursor and collecting the returned cursor
+        # run the command passing in each cursor and collecting the returned cursor (kept within the
+        # narrowed region, if there is one)
+        narrowed = self.get_narrowed()
         for i in range(len(cursors)):
             selection.clear()
             regions = view.get_regions(key)
@@ -479,6 +1093,8 @@ class CmdHelper:
             selection.add(cursor)
             cursor = function(cursor, *args, **kwargs)
             if cursor is not None:
+                if narrowed is not None:
+                    cursor = self.clip_region(cursor)
                 # update the cursor in its slot
                 regions[i] = cursor
                 view.add_regions(key, regions, "tmp", "", sublime.HIDDEN)
@@ -499,24 +1115,92 @@ class CmdHelper:
             self.set_mark()
         self.view.sel().clear()
         self.view.sel().add(sublime.Region(pos, pos))
-        self.ensure_visible(pos)
+        self.ensure_visible(pos, True)
 
     def is_visible(self, pos):
         visible = self.view.visible_region()
         return visible.contains(pos)
 
-    def ensure_visible(self, point, force=False):
-        if force or not self.is_visible(point):
-            self.view.show_at_center(point)
+    #
+    # Make sure point (or the end of a region) is visible. Scrolling is deferred for VIEWPORT_DELAY ms and only the last point
+    # asked for in that time is shown, so a burst of motion commands (e.g., holding down ctrl+n)
+    # scrolls at most once per frame. How we scroll depends on jove_recenter_policy:
+    #
+    #   "center"   if point is off the screen, center it (the default)
+    #   "minimal"  scroll just far enough to show point
+    #   "margin"   scroll just far enough to keep jove_scroll_margin lines between point and the top
+    #              and bottom of the window
+    #
+    # If center is True (e.g., after a jump) an off screen point is centered whatever the policy.
+    #
+    def ensure_visible(self, point, center=False):
+        state = self.state
+        pending = state.pending_visible
+        state.pending_visible = (point, center or (pending is not None and pending[1]))
+        if pending is None:
+            view = self.view
+            sublime.set_timeout(lambda: CmdHelper(view, state).update_viewport(), VIEWPORT_DELAY)
+
+    def update_viewport(self):
+        state = self.state
+        if state.pending_visible is None:
+            return
+        point, center = state.pending_visible
+        state.pending_visible = None
+        view = self.view
+        if isinstance(point, sublime.Region):
+            point = point.b
+        point = min(point, view.size())
+        settings = view.settings()
+        policy = settings.get("jove_recenter_policy", "center")
+        if center or policy not in ("minimal", "margin"):
+            if not self.is_visible(point):
+                view.show_at_center(point)
+            return
+
+        margin = settings.get("jove_scroll_margin", 0) if policy == "margin" else 0
+        visible = view.visible_region()
+        if margin <= 0:
+            if not visible.contains(point):
+                view.show(point, False)
+            return
+        row = view.rowcol(point)[0]
+        top = view.rowcol(visible.a)[0]
+        bottom = view.rowcol(visible.b)[0]
+        last = view.rowcol(view.size())[0]
+        if (row >= top + margin or top == 0) and (row <= bottom - margin or bottom >= last):
+            return
+        view.show(sublime.Region(view.text_point(max(0, row - margin), 0), view.text_point(row + margin, 0)), False)
+
+    #
+    # Forget any pending scroll, for commands which put the viewport exactly where they want it.
+    #
+    def cancel_viewport_update(self):
+        self.state.pending_visible = None
 
     def is_word_char(self, pos, forward, separators):
         if not forward:
             if pos == 0:
                 return False
             pos -= 1
-        char = self.view.substr(pos)
+        text = self.get_text()
+        if pos >= text.size:
+            return False
+        char = text.char(pos)
         return not (char in " \t\r\n" or char in separators)
 
+    #
+    # Returns the symbol around point (the characters on either side of it which aren't white space
+    # or separators), or "" if there isn't one.
+    #
+    def get_symbol(self, point, separators):
+        start = end = point
+        while self.is_word_char(start, False, separators):
+            start -= 1
+        while self.is_word_char(end, True, separators):
+            end += 1
+        return self.get_text().substr(start, end)
+
     #
     # Goes to the other end of the scope at the specified position. The specified position should be
     # around brackets or quotes.
@@ -526,17 +1210,19 @@ class CmdHelper:
         kets = ")]}"
 
         view = self.view
+        text = self.get_text()
+        if self.state.large_file:
+            return self.scan_to_other_end(point, direction)
         scope_name = view.scope_name(point)
         if scope_name.find("comment") >= 0:
             return None
 
-        ch = view.substr(point)
-        if direction > 0 and view.substr(point) in brac:
+        if direction > 0 and text.char(point) in brac:
             return self.run_command("move_to", {"to": "brackets"}, point=point)
-        elif direction < 0 and view.substr(point - 1) in kets:
+        elif direction < 0 and text.char(point - 1) in kets:
             # this can be tricky due to inconsistencies with sublime bracket matching
             # we need to handle "))" and "()[0]" when between the ) and [
-            if point < view.size() and view.substr(point) in brac:
+            if point < text.size and text.char(point) in brac:
                 # go inside the bracket (point - 1), then to the inside of the match, then back one more
                 return self.run_command("move_to", {"to": "brackets"}, point=point - 1) - 1
             else:
@@ -548,6 +1234,35 @@ class CmdHelper:
         r = view.sel()[0]
         return r.end() if direction > 0 else r.begin()
 
+    #
+    # Like to_other_end but by scanning the characters instead of asking sublime, which looks at the
+    # syntax scopes. Brackets are matched by counting, ignoring other kinds of brackets, and strings
+    # end at the next unescaped matching quote. Returns None if there's no match.
+    #
+    def scan_to_other_end(self, point, direction):
+        pairs = {"(": ")", "[": "]", "{": "}", ")": "(", "]": "[", "}": "{"}
+        text = self.get_text()
+        ch = text.char(point if direction > 0 else point - 1)
+        other = pairs.get(ch, ch)
+        depth = 0
+        pos = point if direction > 0 else point - 1
+        lo, hi = self.get_limits()
+        while lo <= pos < hi:
+            c = text.char(pos)
+            if ch in pairs:
+                if c == ch:
+                    depth += 1
+                elif c == other:
+                    depth -= 1
+                    if depth == 0:
+                        return pos + 1 if direction > 0 else pos
+            elif c == ch and (pos == point or pos == point - 1 or text.char(pos - 1) != "\\"):
+                depth += 1
+                if depth == 2:
+                    return pos + 1 if direction > 0 else pos
+            pos += direction
+        return None
+
     #
     # Run the specified command and args in the current view. If point is specified set point in the
     # view before running the command. Returns the resulting point.
@@ -569,6 +1284,7 @@ class JoveTextCommand(sublime_plugin.TextCommand):
     is_kill_cmd = False
     is_ensure_visible_cmd = False
     unregistered = False
+    is_macro_cmd = False
 
     def run(self, edit, **kwargs):
         # get our view state
@@ -577,22 +1293,186 @@ class JoveTextCommand(sublime_plugin.TextCommand):
         # first keep track of this_cmd and last_cmd but only if we're not called recursively
         cmd = self.jove_cmd_name
 
+        if vs.entered == 0 and not (self.unregistered or self.is_macro_cmd):
+            Macro.record(cmd, kwargs)
         if vs.entered == 0 and (cmd != 'jove_universal_argument' or self.unregistered):
             vs.this_cmd = cmd
+        trace = Trace.current if vs.entered == 0 and not self.unregistered else None
+        if trace:
+            args = dict(kwargs)
+            snapshot = Trace.snapshot(self.view)
         vs.entered += 1
         jove = CmdHelper(self.view, state=vs, edit=edit)
         try:
             self.run_cmd(jove, **kwargs)
+
+            # the next vertical move starts a new goal column
+            if vs.entered == 1 and self.should_reset_target_column:
+                jove.reset_target_column()
         finally:
             vs.entered -= 1
+        if trace and trace is Trace.current:
+            trace.record(self.view, cmd, args, snapshot, time.time() - snapshot[0])
         if vs.entered == 0 and (cmd != 'jove_universal_argument' or self.unregistered):
             vs.last_cmd = vs.this_cmd
             vs.argument_value = 0
             vs.argument_supplied = False
 
-            # this no-op ensures the next/prev line target column is reset to the new locations
-            if self.should_reset_target_column:
-                jove.reset_target_column()
+#
+# Show how much memory our global and per-view state is using in an output panel: the view states,
+# the caches, the kill ring and i-search, plus the largest kill ring entries and allocations
+# traced by tracemalloc (if it's available and trace was used to start it). With trim, the caches
+# (which are rebuilt on demand) and the state of views which no longer exist are thrown away first.
+#
+class JoveMemoryReportCommand(JoveTextCommand):
+    PANEL = "jove_memory"
+
+    def run_cmd(self, jove, trim=False, trace=None):
+        window = self.view.window()
+        notes = []
+        if trace is not None:
+            if tracemalloc is None:
+                notes.append("tracemalloc is not available in this version of python")
+            elif trace:
+                tracemalloc.start()
+            else:
+                tracemalloc.stop()
+        if trim:
+            notes.append(self.trim())
+
+        states = ViewState.view_state_dict
+        open_buffers = set(v.buffer_id() for w in sublime.windows() for v in w.views())
+        report = MemoryReport()
+
+        # the caches first, so they aren't counted as part of the structures that refer to them
+        report.add("Buffer text caches", [s.buffer_text for s in states.values() if s.buffer_text])
+        report.add("Word indexes", WordIndex.indexes)
+        report.add("Defun indexes", DefunIndex.indexes)
+        report.add("Occur results", Occur.instances)
+        report.add("Buffer switcher", BufferSwitcher.candidates)
+        report.add("Compilation errors", [c.errors for c in (Compilation.current, Grep.current) if c])
+        report.add("Keyboard macros", [m for m in (Macro.last, Macro.recording) if m])
+        entries = [(i, b) for i, b in enumerate(kill_ring.buffers) if b is not None]
+        report.add("Kill ring", kill_ring.buffers, len(entries))
+        info = ViewState.isearch_info
+        stack = []
+        item = info.current if info else None
+        while item is not None:
+            stack.append(item)
+            item = item.prev
+        report.add("I-search stack", [info, ISearchInfo.last_search], len(stack))
+        report.add("View states", states)
+
+        largest = sorted(entries, key=lambda e: -len(as_text(e[1])))[:5]
+        report.add_section("Largest kill ring entries:", [
+            "#%d: %s%s %r" % (i, format_size(len(as_text(b))),
+                              " (%d cursors)" % (len(b),) if isinstance(b, list) else "",
+                              as_text(b)[:40])
+            for i, b in largest])
+        if stack:
+            report.add_section("I-search stack (%d states):" % (len(stack),), [
+                "%r: %d matches, %d kept" % (item.search, len(item.regions), len(item.selected))
+                for item in stack[:5]])
+        stale = [
+            "%d view states for closed views" % (len([s for s in states.values() if not s.view.is_valid()]),),
+            "%d word indexes for closed buffers" % (len([b for b in WordIndex.indexes if b not in open_buffers]),),
+            "%d defun indexes for closed buffers" % (len([k for k in DefunIndex.indexes if k[0] not in open_buffers]),),
+            "%d occur results for closed views" % (len([o for o in Occur.instances.values() if not o.results.is_valid()]),),
+        ]
+        report.add_section("Stale entries:", stale)
+        traced = traced_allocations(os.path.dirname(__file__))
+        if traced is not None:
+            report.add_section("Top allocations (tracemalloc):", traced)
+
+        panel = window.create_output_panel(self.PANEL)
+        panel.run_command("append", {"characters": "\n".join(notes + [report.format()]), "force": True})
+        window.run_command("show_panel", {"panel": "output." + self.PANEL})
+
+    #
+    # Throw away the caches and the state of views which no longer exist. Returns a description of
+    # what was done.
+    #
+    def trim(self):
+        stale = ViewState.remove_stale()
+        for state in ViewState.view_state_dict.values():
+            state.buffer_text = None
+            state.dabbrev = None
+        indexes = len(WordIndex.indexes) + len(DefunIndex.indexes)
+        WordIndex.indexes.clear()
+        DefunIndex.indexes.clear()
+        for vid, occur in list(Occur.instances.items()):
+            if not occur.results.is_valid():
+                del(Occur.instances[vid])
+        return "Trimmed: %d stale view states, %d indexes and all buffer text caches\n" % (stale, indexes)
+
+#
+# Time kill-line, delete-white-space, just-one-space and indent on lines of increasing length (the
+# number of characters in each is in lengths) in a scratch buffer, and show the results in an output
+# panel. The kill ring and the clipboard are put back afterwards.
+#
+class JoveBenchmarkCommand(JoveTextCommand):
+    PANEL = "jove_benchmark"
+
+    def run_cmd(self, jove, lengths=LINE_LENGTHS):
+        window = self.view.window()
+        saved = (list(kill_ring.buffers), kill_ring.index, sublime.get_clipboard())
+        scratch = window.new_file()
+        scratch.set_scratch(True)
+        scratch.set_name("*benchmark*")
+        try:
+            lines = run_line_benchmark(scratch, lengths)
+        finally:
+            kill_ring.buffers[:], kill_ring.index, clipboard = saved
+            sublime.set_clipboard(clipboard)
+            window.focus_view(scratch)
+            window.run_command("close_file")
+            window.focus_view(self.view)
+        panel = window.create_output_panel(self.PANEL)
+        panel.run_command("append", {"characters": "\n".join(lines) + "\n", "force": True})
+        window.run_command("show_panel", {"panel": "output." + self.PANEL})
+
+#
+# Start or stop recording the commands run to a trace file (see trace.py), which bench/replay.py can
+# replay to measure them. With no arguments tracing is toggled. Traces go in the cache directory
+# unless a path is given.
+#
+class JoveTraceCommand(JoveTextCommand):
+    def run_cmd(self, jove, enable=None, path=None):
+        if enable is None:
+            enable = Trace.current is None
+        if not enable:
+            trace = Trace.stop()
+            if trace is None:
+                jove.set_status("Not tracing")
+            else:
+                jove.set_status("Traced %d commands to %s" % (trace.count, trace.path))
+            return
+        try:
+            if path is None:
+                directory = os.path.join(sublime.cache_path(), "Jove", "traces")
+                os.makedirs(directory, exist_ok=True)
+                path = os.path.join(directory, time.strftime("trace-%Y%m%d-%H%M%S.jsonl"))
+            Trace.start(path)
+        except (OSError, IOError) as e:
+            jove.set_status("Could not start tracing: %s" % (e,))
+            return
+        jove.set_status("Tracing to %s" % (path,))
+
+#
+# Turn large file mode on or off for this view (or back to depending on the size of the buffer if
+# enable is "auto"). With no argument it toggles.
+#
+class JoveLargeFileModeCommand(JoveTextCommand):
+    def run_cmd(self, jove, enable=None):
+        state = jove.state
+        if enable == "auto":
+            state.large_file_override = None
+        elif enable is None:
+            state.large_file_override = not state.large_file
+        else:
+            state.large_file_override = bool(enable)
+        state.update_large_file()
+        jove.set_status("Large file mode is %s" % ("on" if state.large_file else "off",))
 
 #
 # Calls run command a specified number of times.
@@ -600,12 +1480,55 @@ class JoveTextCommand(sublime_plugin.TextCommand):
 class JoveDoTimesCommand(JoveTextCommand):
     def run_cmd(self, jove, cmd, _times, **args):
         view = self.view
-        visible = view.visible_region()
         for i in range(_times):
             view.run_command(cmd, args)
-        point = jove.get_point()
-        if not visible.contains(point):
-            jove.ensure_visible(point, True)
+        jove.ensure_visible(jove.get_point())
+
+#
+# Move to the next (or previous) line, with a numeric argument to move that many lines. Moves are
+# by screen lines (so wrapped lines count as several) at the goal column, which is the horizontal
+# position where a run of vertical moves started, so it survives short lines and tabs. Any other
+# command which moves point or changes the buffer starts a new goal. With multiple cursors this is
+# sublime's move by lines. The sample keymap binds it to the up and down keys in the same contexts
+# as tab, so auto complete, overlays and panels still get sublime's own move.
+#
+class JoveMoveLineCommand(JoveTextCommand):
+    is_ensure_visible_cmd = True
+
+    def run_cmd(self, jove, forward=True, extend=False, **args):
+        view = self.view
+        state = jove.state
+        count = jove.get_count()
+        extend = extend or state.active_mark
+        if len(view.sel()) != 1:
+            # sublime keeps a goal column for each cursor
+            for i in range(count):
+                jove.run_command("move", {"by": "lines", "forward": forward, "extend": extend})
+            return
+        if not forward:
+            count = -count
+        region = view.sel()[0]
+        point = region.b
+        x,y = view.text_to_layout(point)
+        change_count = view.change_count()
+        if state.goal_point != point or state.goal_change_count != change_count:
+            state.goal_column = x
+        pos = view.layout_to_text((state.goal_column, y + count * view.line_height()))
+        if count and view.text_to_layout(pos)[1] == y:
+            # there's no line to move to: go to the start or end of the buffer
+            pos = view.size() if count > 0 else 0
+        state.goal_point = pos
+        state.goal_change_count = change_count
+        view.sel().clear()
+        view.sel().add(sublime.Region(region.a if extend else pos, pos))
+
+#
+# Stands in for a command which has been absorbed by the view's Coalescer. It does nothing and
+# leaves this_cmd and last_cmd alone.
+#
+class JoveCoalescedCommand(JoveTextCommand):
+    def run(self, edit):
+        pass
 
 class JoveShowScopeCommand(JoveTextCommand):
     def run_cmd(self, jove, direction=1):
@@ -742,15 +1665,16 @@ class JoveMoveSexprCommand(JoveTextCommand):
         count = abs(count)
 
         def advance(cursor, first=False, **kwargs):
+            text = jove.get_text()
             point = cursor.b
+            lo, hi = jove.get_limits()
             if forward:
-                limit = view.size()
-                while point < limit:
+                while point < hi:
                     if jove.is_word_char(point, True, separators):
                         point = view.find_by_class(point, True, sublime.CLASS_WORD_END, separators)
                         break
                     else:
-                        ch = view.substr(point)
+                        ch = text.char(point)
                         if ch in "({['\"":
                             next_point = jove.to_other_end(point, direction)
                             if next_point is not None:
@@ -758,12 +1682,12 @@ class JoveMoveSexprCommand(JoveTextCommand):
                                 break
                         point += 1
             else:
-                while point > 0:
+                while point > lo:
                     if jove.is_word_char(point, False, separators):
                         point = view.find_by_class(point, False, sublime.CLASS_WORD_START, separators)
                         break
                     else:
-                        ch = view.substr(point - 1)
+                        ch = text.char(point - 1)
                         if ch in ")}]'\"":
                             next_point = jove.to_other_end(point, direction)
                             if next_point is not None:
@@ -781,7 +1705,8 @@ class JoveMoveSexprCommand(JoveTextCommand):
 # This command remembers all the current cursor positions, executes a command on all the cursors,
 # and then deletes all the data between the two.
 #
-# If there's only one selection, the deleted data is added to the kill ring appropriately.
+# The deleted data is added to the kill ring, as a single entry with one string per cursor if there
+# are multiple cursors. All the regions are erased in one backwards pass.
 #
 class JoveMoveThenDeleteCommand(JoveTextCommand):
     is_ensure_visible_cmd = True
@@ -800,23 +1725,112 @@ class JoveMoveThenDeleteCommand(JoveTextCommand):
         orig_cursors = [s for s in selection]
         view.run_command(move_cmd, kwargs)
 
-        # extend each cursor so we can delete the bytes, and only if there is only one region will
-        # we add the data to the kill ring
+        # extend each cursor so we can delete the bytes
         new_cursors = [s for s in selection]
-
-        selection.clear()
+        regions = []
         for old,new in zip(orig_cursors, new_cursors):
             if old < new:
-                selection.add(sublime.Region(old.begin(), new.end()))
+                regions.append(sublime.Region(old.begin(), new.end()))
             else:
-                selection.add(sublime.Region(new.begin(), old.end()))
+                regions.append(sublime.Region(new.begin(), old.end()))
+        jove.kill_regions(regions, forward=count > 0, join=jove.state.last_was_kill_cmd())
 
-        # only append to kill ring if there's one selection
-        if len(selection) == 1:
-            kill_ring.add(view.substr(selection[0]), forward=count > 0, join=jove.state.last_was_kill_cmd())
+#
+# Move to the beginning (direction < 0) or end (direction > 0) of the count'th function or class
+# definition. The positions come from an index which is only rebuilt when the buffer changes. The
+# first of a series of these commands sets the mark.
+#
+class JoveMoveDefunCommand(JoveTextCommand):
+    is_ensure_visible_cmd = True
+    should_reset_target_column = True
+
+    def run_cmd(self, jove, direction=-1, what="function"):
+        view = self.view
+        selection = view.sel()
+        count = jove.get_count()
+        index = DefunIndex.get(view, what, jove.get_narrowed())
+
+        cursors = []
+        for cursor in selection:
+            if direction < 0:
+                pos = index.backward(cursor.b, count)
+            else:
+                pos = index.forward(cursor.b, count)
+            cursors.append(cursor.b if pos is None else pos)
+
+        if cursors == [cursor.b for cursor in selection]:
+            jove.set_status("No more %s definitions" % (what,))
+        elif len(cursors) == 1:
+            state = jove.state
+            jove.goto_position(cursors[0], set_mark=state.this_cmd != state.last_cmd)
+        else:
+            selection.clear()
+            selection.add_all([sublime.Region(pos, pos) for pos in cursors])
+
+#
+# Dynamic abbreviation expansion: expand the word before point to the closest word in this buffer
+# which starts with it, then to words from the other open buffers. Repeating the command replaces
+# the expansion with the next candidate. Words are defined by jove_word_separators.
+#
+class JoveDabbrevExpandCommand(JoveTextCommand):
+    def run_cmd(self, jove):
+        view = self.view
+        state = jove.state
+        point = jove.get_point()
+        if not jove.just_one_point():
+            jove.set_status("Cannot expand with multiple cursors")
+            return
+
+        expansion = state.dabbrev
+        if expansion is None or state.last_cmd != self.jove_cmd_name or expansion.end != point:
+            expansion = state.dabbrev = self.start_expansion(jove, point)
+            if expansion is None:
+                jove.set_status("No word before point")
+                return
+
+        word = expansion.next()
+        if word is None:
+            jove.set_status("No further dynamic expansion for '%s' found" % (expansion.prefix,))
+            word = expansion.prefix
+            state.dabbrev = None
+        view.replace(jove.edit, sublime.Region(expansion.start, expansion.end), word)
+        expansion.end = expansion.start + len(word)
+        jove.set_selection(expansion.end, expansion.end)
+
+    def start_expansion(self, jove, point):
+        view = self.view
+        separators = view.settings().get("jove_word_separators", default_jove_word_separators)
+        start = point
+        while jove.is_word_char(start, False, separators):
+            start -= 1
+        if start == point:
+            return None
+        text = jove.get_text()
+        prefix = text.substr(start, point)
+
+        # don't offer the word we are in the middle of
+        end = point
+        while jove.is_word_char(end, True, separators):
+            end += 1
+        exclude = set([text.substr(start, end)])
 
-        for region in selection:
-            view.erase(jove.edit, region)
+        index = WordIndex.get(view, separators)
+        candidates = index.nearest(prefix, view.rowcol(point)[0], exclude)
+
+        # the other buffers, starting with the ones in this window
+        windows = sublime.windows()
+        window = view.window()
+        if window in windows:
+            windows.remove(window)
+            windows.insert(0, window)
+        others = []
+        seen = set([view.buffer_id()])
+        for w in windows:
+            for v in w.views():
+                if v.buffer_id() not in seen and not v.settings().get("is_widget"):
+                    seen.add(v.buffer_id())
+                    others.append(lambda v=v: WordIndex.get(v, separators).most_common(prefix, exclude))
+        return Expansion(start, prefix, candidates, others)
 
 class JoveGotoLineCommand(JoveTextCommand):
     def run_cmd(self, jove):
@@ -825,24 +1839,143 @@ class JoveGotoLineCommand(JoveTextCommand):
         else:
             self.run_window_command("show_overlay", {"overlay": "goto", "text": ":"})
 
+#
+# Delete the spaces and tabs around each cursor, in one pass over the buffer. Only the white space
+# itself (inside the narrowed region, if there is one) is read, so this doesn't depend on the length
+# of the lines.
+#
 class JoveDeleteWhiteSpaceCommand(JoveTextCommand):
     def run_cmd(self, jove):
-        jove.for_each_cursor(self.delete_white_space, jove)
+        self.replace_white_space(jove, "")
 
-    def delete_white_space(self, cursor, jove, **kwargs):
+    def replace_white_space(self, jove, replacement):
+        offsets = [r.b for r in self.view.sel()]
+        char = jove.get_text().char
+        lo, hi = jove.get_limits()
+        jove.apply_edits(horizontal_space_edits(lambda pos: char(pos) if lo <= pos < hi else "\n",
+                                                offsets, replacement))
+
+#
+# Replace the spaces and tabs around each cursor with one space (or as many as the numeric
+# argument).
+#
+class JoveJustOneSpaceCommand(JoveDeleteWhiteSpaceCommand):
+    def run_cmd(self, jove):
+        self.replace_white_space(jove, " " * abs(jove.get_count()))
+
+#
+# White space cleanup over the emacs region when the mark is active (or the selections, if there
+# are several), otherwise the whole buffer. Each command reads the text once and makes all its
+# changes in one undo step.
+#
+#   delete_trailing     delete the spaces and tabs at the end of lines
+#   tabify              use tabs for indentation
+#   untabify            replace tabs with spaces
+#
+class JoveWhiteSpaceCommand(JoveTextCommand):
+    def run_cmd(self, jove, cmd):
+        tab_size = self.view.settings().get("tab_size", 4)
+        if cmd == "delete_trailing":
+            compute = trailing_whitespace_edits
+        elif cmd == "tabify":
+            compute = lambda text: tabify_edits(text, tab_size)
+        elif cmd == "untabify":
+            compute = lambda text: untabify_edits(text, tab_size)
+        else:
+            print("Unknown command", cmd)
+            return
+        regions = jove.get_cleanup_regions()
+        changed = jove.cleanup_regions(regions, compute)
+        if jove.state.active_mark:
+            jove.toggle_active_mark_mode(False)
+        jove.set_status("%d %s" % (changed, "change" if changed == 1 else "changes"))
+
+#
+# Sort the lines in the emacs region as a single edit. With reverse they go backwards, with field
+# (counting from 1, or from the end if negative) they are sorted by that white space separated field
+# rather than the whole line, and with numeric by the number the key starts with. The region is
+# read once. If it is bigger than ASYNC_SIZE the work is done in the thread pool and the result goes
+# in the buffer when it's ready, unless the buffer has changed by then.
+#
+class JoveSortLinesCommand(JoveTextCommand):
+    ASYNC_SIZE = 1 << 20
+
+    # view id -> (change count, region, new lines, status) waiting to go in the buffer, or None
+    # while the work is still being done
+    pending = dict()
+
+    def run_cmd(self, jove, reverse=False, numeric=False, field=None):
+        self.change_lines(jove, lambda lines: sort_lines(lines, reverse, numeric, field),
+                          lambda old, new: "Sorted %d lines" % (len(old),))
+
+    #
+    # Replace the lines in the region with compute(lines), and show describe(old lines, new lines)
+    # in the status.
+    #
+    def change_lines(self, jove, compute, describe):
         view = self.view
-        line = view.line(cursor.a)
-        data = view.substr(line)
-        row,col = view.rowcol(cursor.a)
-        start = col
-        while start - 1 >= 0 and data[start-1: start] in (" \t"):
-            start -= 1
-        end = col
-        limit = len(data)
-        while end + 1 < limit and data[end:end+1] in (" \t"):
-            end += 1
-        view.erase(jove.edit, sublime.Region(line.begin() + start, line.begin() + end))
-        return None
+        span = jove.get_region_lines()
+        if span is None:
+            if len(view.sel()) == 1:
+                jove.set_status("No mark set in this buffer")
+            return
+        jove.toggle_active_mark_mode(False)
+        text = view.substr(span)
+        change_count = view.change_count()
+
+        def work():
+            lines = text.split("\n")
+            new_lines = compute(lines)
+            return (None if new_lines == lines else new_lines), describe(lines, new_lines)
+
+        if span.size() < self.ASYNC_SIZE:
+            new_lines, status = work()
+            if new_lines is not None:
+                jove.replace_lines(span, new_lines)
+            jove.set_status(status)
+            return
+
+        vid = view.id()
+        if vid in self.pending:
+            jove.set_status("Still working on the last one")
+            return
+        self.pending[vid] = None
+        jove.set_status("Working on %d characters..." % (span.size(),))
+        def done(future):
+            try:
+                new_lines, status = future.result()
+            except Exception as e:
+                new_lines, status = None, "Failed: %s" % (e,)
+            self.pending[vid] = (change_count, span, new_lines, status)
+            sublime.set_timeout(lambda: view.run_command("jove_replace_lines"), 0)
+        get_thread_pool().submit(work).add_done_callback(done)
+
+#
+# Delete the lines in the emacs region which repeat an earlier one, as a single edit. With reverse
+# the last of each is kept instead, and with adjacent only repeats of the line before are deleted.
+#
+class JoveDeleteDuplicateLinesCommand(JoveSortLinesCommand):
+    def run_cmd(self, jove, reverse=False, adjacent=False):
+        self.change_lines(jove, lambda lines: delete_duplicate_lines(lines, reverse, adjacent),
+                          lambda old, new: "Deleted %d duplicate lines" % (len(old) - len(new),))
+
+#
+# Put the result of a sort (or other line operation) done in the background into the buffer.
+#
+class JoveReplaceLinesCommand(JoveTextCommand):
+    unregistered = True
+
+    def run_cmd(self, jove):
+        pending = JoveSortLinesCommand.pending.pop(self.view.id(), None)
+        if pending is None:
+            return
+        change_count, span, new_lines, status = pending
+        if self.view.change_count() != change_count:
+            jove.set_status("The buffer has changed: lines not replaced")
+            return
+        if new_lines is not None:
+            jove.replace_lines(span, new_lines)
+        jove.set_status(status)
 
 class JoveUniversalArgumentCommand(JoveTextCommand):
     def run_cmd(self, jove, value):
@@ -863,6 +1996,164 @@ class JoveUniversalArgumentCommand(JoveTextCommand):
         elif value == 'negative':
             state.argument_value = -state.argument_value
 
+#
+# Keyboard macros: start and end recording, play the last macro count times, or play it once on
+# each line in the region. Playing runs the recorded steps directly, each one as if it had been
+# typed, and the whole thing is a single undo.
+#
+class JoveMacroCommand(JoveTextCommand):
+    is_macro_cmd = True
+
+    def run_cmd(self, jove, cmd):
+        view = self.view
+        if cmd == "start":
+            if Macro.recording:
+                jove.set_status("Already defining a keyboard macro")
+                return
+            Macro.start()
+            view.set_status(JOVE_MACRO_STATUS, "Def")
+            jove.set_status("Defining keyboard macro...")
+            return
+        if cmd == "end":
+            view.erase_status(JOVE_MACRO_STATUS)
+            if not Macro.end():
+                jove.set_status("Not defining a keyboard macro")
+            else:
+                jove.set_status("Keyboard macro defined (%d steps)" % (len(Macro.last.steps),))
+            return
+
+        macro = Macro.last
+        if macro is None or Macro.recording:
+            jove.set_status("No keyboard macro defined" if macro is None else "Can't play a macro while defining one")
+            return
+        if cmd == "play":
+            self.play(jove, macro, jove.get_count())
+        elif cmd == "apply_to_region_lines":
+            region = jove.get_region()
+            if not region:
+                return
+            first = view.rowcol(region.begin())[0]
+            last,col = view.rowcol(region.end())
+            if col == 0 and last > first:
+                last -= 1
+            jove.toggle_active_mark_mode(False)
+
+            # work from the bottom up so the rows we haven't done yet don't move
+            for row in range(last, first - 1, -1):
+                point = view.text_point(row, 0)
+                jove.set_selection(point, point)
+                self.play(jove, macro, 1)
+            jove.set_status("Applied macro to %d lines" % (last - first + 1,))
+        else:
+            print("Unknown command", cmd)
+        jove.ensure_visible(jove.get_point())
+
+    #
+    # Play the macro count times. Each step runs as a top-level command so jove commands track
+    # last_cmd and reset the argument just like they do when typed.
+    #
+    def play(self, jove, macro, count):
+        view = self.view
+        state = jove.state
+        steps = macro.compile()
+        entered = state.entered
+        Macro.playing = True
+        try:
+            state.entered = 0
+            for i in range(count):
+                for cmd, args, is_jove in steps:
+                    view.run_command(cmd, args)
+                    if not is_jove:
+                        # the argument was applied when the command was recorded
+                        state.last_cmd = cmd
+                        state.argument_value = 0
+                        state.argument_supplied = False
+        finally:
+            Macro.playing = False
+            state.entered = entered
+
+#
+# Jump to the definition of the symbol at point (or prompt for one, with a numeric argument) using
+# the tag index of the window's folders. The index is built in the background the first time and
+# brought up to date (only files which changed are rescanned) when it's more than
+# REFRESH_INTERVAL seconds old. The position we jump from is pushed on the mark ring and the tag
+# stack, for jove_pop_tag.
+#
+class JoveFindTagCommand(JoveTextCommand):
+    REFRESH_INTERVAL = 60
+
+    def run_cmd(self, jove, name=None):
+        view = self.view
+        window = view.window()
+        folders = window.folders() if window else []
+        if not folders:
+            jove.set_status("No folders to index for tags")
+            return
+        settings = view.settings()
+        cache_dir = os.path.join(sublime.cache_path(), "Jove", "tags")
+        index = TagIndex.get(folders, cache_dir, settings.get("jove_tag_extensions", DEFAULT_EXTENSIONS))
+
+        if name is None:
+            separators = settings.get("jove_sexpr_separators", default_jove_sexpr_separators)
+            name = jove.get_symbol(jove.get_point(), separators)
+            if jove.has_prefix_arg() or not name:
+                window.show_input_panel("Find tag:", name, lambda name: self.find(view, index, name), None, None)
+                return
+
+        if not index.exists():
+            jove.set_status("Building tag index...")
+            def built(index, message):
+                print("jove:", message)
+                sublime.set_timeout(lambda: self.find(view, index, name), 0)
+            index.refresh(built)
+            return
+        if time.time() - index.refreshed > self.REFRESH_INTERVAL:
+            index.refresh(lambda index, message: print("jove:", message))
+        self.find(view, index, name)
+
+    def find(self, view, index, name):
+        locations = index.lookup(name)
+        jove = CmdHelper(view)
+        if not locations:
+            jove.set_status("No tag for %s" % (name,))
+        elif len(locations) == 1:
+            self.jump(view, *locations[0])
+        else:
+            items = ["%s:%d" % location for location in locations]
+            def on_done(i):
+                if i >= 0:
+                    self.jump(view, *locations[i])
+            view.window().show_quick_panel(items, on_done)
+
+    def jump(self, view, path, line):
+        point = CmdHelper(view).get_point()
+        ViewState.get(view).mark_ring.set(point)
+        row,col = view.rowcol(point)
+        tag_stack.append((view.file_name(), view.id(), row, col))
+        del(tag_stack[:-TAG_STACK_SIZE])
+        view.window().open_file("%s:%d" % (path, line), sublime.ENCODED_POSITION)
+
+#
+# Go back to where we were before the last jove_find_tag.
+#
+class JovePopTagCommand(JoveTextCommand):
+    def run_cmd(self, jove):
+        if not tag_stack:
+            jove.set_status("Tag stack is empty")
+            return
+        file_name, view_id, row, col = tag_stack.pop()
+        window = self.view.window()
+        for view in window.views():
+            if view.id() == view_id:
+                window.focus_view(view)
+                point = view.text_point(row, col)
+                view.sel().clear()
+                view.sel().add(sublime.Region(point, point))
+                view.show_at_center(point)
+                return
+        if file_name:
+            window.open_file("%s:%d:%d" % (file_name, row + 1, col + 1), sublime.ENCODED_POSITION)
+
 class JoveShiftRegionCommand(JoveTextCommand):
     """Shifts the emacs region left or right."""
 
@@ -905,10 +2196,79 @@ class JoveShiftRegionCommand(JoveTextCommand):
             jove.restore_region("shift")
             sublime.set_timeout(lambda: jove.set_status("Shifted %d of %d lines in the region" % (shifted, count)), 100)
 
+#
+# Fill the paragraph around point. We read a block of lines around point and look for the paragraph
+# in that, reading a bigger block only if the paragraph reaches the edges. Only comments, strings
+# and plain text are filled: in code this falls back to sublime's wrap_lines.
+#
+class JoveFillParagraphCommand(JoveTextCommand):
+    def run_cmd(self, jove):
+        view = self.view
+        point = jove.get_point()
+        filler = jove.get_filler(point)
+        row = view.rowcol(point)[0]
+        size = view.size()
+
+        amount = 100
+        while True:
+            first = max(0, row - amount)
+            block = sublime.Region(view.text_point(first, 0), view.line(view.text_point(row + amount, 0)).b)
+            lines = view.substr(block).split("\n")
+            found = None
+            for para in filler.paragraphs(lines):
+                start, end = para[0], para[1]
+                if end > row - first:
+                    found = para
+                    break
+            if found and ((start == 0 and first > 0) or (end == len(lines) and block.b < size)):
+                amount *= 4
+                continue
+            break
+
+        if found is None:
+            jove.set_status("No paragraph to fill")
+            return
+
+        start, end, first_prefix, prefix = found
+        offset = block.a + sum(len(line) + 1 for line in lines[:start])
+        if not jove.is_fillable(offset + len(first_prefix)):
+            jove.run_command("wrap_lines", {"width": filler.width})
+            return
+        old = "\n".join(lines[start:end])
+        new = "\n".join(filler.fill_paragraph(lines[start:end], first_prefix, prefix))
+        if new != old:
+            view.replace(jove.edit, sublime.Region(offset, offset + len(old)), new)
+            if offset <= point <= offset + len(old):
+                point = offset + same_position(old, point - offset, new, prefix)
+            jove.set_selection(point, point)
+
+#
+# Fill all the paragraphs in the emacs region with one edit. Paragraphs of code are left alone.
+#
+class JoveFillRegionCommand(JoveTextCommand):
+    def run_cmd(self, jove):
+        view = self.view
+        region = jove.get_region()
+        if region:
+            region = view.line(region)
+            filler = jove.get_filler(region.a)
+            old = view.substr(region)
+            lines = old.split("\n")
+            starts = [0]
+            for line in lines:
+                starts.append(starts[-1] + len(line) + 1)
+            keep = lambda index, first_prefix: jove.is_fillable(region.a + starts[index] + len(first_prefix))
+            new = "\n".join(filler.fill(lines, keep))
+            jove.toggle_active_mark_mode(False)
+            if new != old:
+                view.replace(jove.edit, region, new)
+                jove.set_selection(region.a + len(new), region.a + len(new))
+
 class JoveCenterViewCommand(JoveTextCommand):
     def run_cmd(self, jove):
         view = self.view
         point = jove.get_point()
+        jove.cancel_viewport_update()
         if jove.has_prefix_arg():
             lines = jove.get_count()
             line_height = view.line_height()
@@ -946,14 +2306,40 @@ class JoveSwapPointAndMarkCommand(JoveTextCommand):
 class JoveMoveToCommand(JoveTextCommand):
     is_ensure_visible_cmd = True
     def run_cmd(self, jove, to):
+        lo, hi = jove.get_limits()
         if to == 'bof':
-            jove.goto_position(0, set_mark=True)
+            jove.goto_position(lo, set_mark=True)
         elif to == 'eof':
-            jove.goto_position(self.view.size(), set_mark=True)
+            jove.goto_position(hi, set_mark=True)
         elif to in ('eow', 'bow'):
             visible = self.view.visible_region()
             jove.goto_position(visible.a if to == 'bow' else visible.b)
 
+#
+# Narrow the buffer to the emacs region. The text before and after it is folded away, and motion,
+# i-search, query replace, the definition index and the white space, sort and comment commands only
+# look at the region, so they cost the same however big the rest of the buffer is. The region is
+# kept with add_regions, so it moves with edits anywhere in the buffer. jove_widen undoes it.
+#
+class JoveNarrowToRegionCommand(JoveTextCommand):
+    def run_cmd(self, jove):
+        region = jove.get_region()
+        if not region:
+            jove.set_status("No region to narrow to")
+            return
+        jove.toggle_active_mark_mode(False)
+        jove.narrow(region)
+        jove.ensure_visible(jove.get_point())
+        jove.set_status("Narrowed to %d characters" % (region.size(),))
+
+class JoveWidenCommand(JoveTextCommand):
+    def run_cmd(self, jove):
+        if jove.state.narrowed is None:
+            jove.set_status("Not narrowed")
+            return
+        jove.widen()
+        jove.ensure_visible(jove.get_point())
+
 class JoveOpenLineCommand(JoveTextCommand):
     def run_cmd(self, jove):
         view = self.view
@@ -965,6 +2351,16 @@ class JoveKillRegionCommand(JoveTextCommand):
     is_kill_cmd = True
     def run_cmd(self, jove, is_copy=False):
         view = self.view
+        selection = view.sel()
+        if len(selection) > 1:
+            # kill (or copy) the selection of each cursor as one entry
+            regions = [r for r in selection if not r.empty()]
+            if regions:
+                jove.kill_regions(regions, True, False, erase=not is_copy)
+                if is_copy:
+                    jove.set_status("Copied %d regions" % (len(regions),))
+            jove.toggle_active_mark_mode(False)
+            return
         region = jove.get_region()
         if region:
             bytes = region.size()
@@ -975,6 +2371,82 @@ class JoveKillRegionCommand(JoveTextCommand):
                 jove.set_status("Copied %d bytes" % (bytes,))
             jove.toggle_active_mark_mode(False)
 
+#
+# Rectangle commands. The rectangle has mark and point at opposite corners. We read all the lines it
+# covers at once, work out the new lines (see rectangle.py) and put them back with one replace, so
+# the size of the rectangle doesn't matter much. Killed and copied rectangles go on the kill ring as
+# a list of lines, and yank inserts the current kill ring entry as a rectangle at point.
+#
+class JoveRectangleCommand(JoveTextCommand):
+    is_ensure_visible_cmd = True
+
+    def run_cmd(self, jove, cmd):
+        view = self.view
+        tab_size = view.settings().get("tab_size", 4)
+        if cmd == "yank":
+            self.yank(jove, tab_size)
+            return
+
+        mark = jove.get_mark()
+        if mark is None:
+            jove.set_status("No mark set in this buffer")
+            return
+        a, b = sorted((mark, jove.get_point()))
+        block = sublime.Region(view.line(a).a, view.line(b).b)
+        lines = view.substr(block).split("\n")
+        rect = Rectangle(display_column(lines[0], a - block.a, tab_size),
+                         display_column(lines[-1], b - view.line(b).a, tab_size), tab_size)
+
+        if cmd == "copy":
+            kill_ring.add(rect.extract(lines), True, False)
+            jove.set_status("Copied %d lines" % (len(lines),))
+            new_lines = lines
+        elif cmd in ("kill", "delete"):
+            new_lines, killed = rect.delete(lines)
+            if cmd == "kill":
+                kill_ring.add(killed, True, False)
+        elif cmd == "clear":
+            new_lines = rect.clear(lines)
+        elif cmd == "open":
+            new_lines = rect.open(lines)
+        else:
+            print("Unknown command", cmd)
+            return
+
+        jove.toggle_active_mark_mode(False)
+        if new_lines is not lines:
+            view.replace(jove.edit, block, "\n".join(new_lines))
+            start = block.a + rect.locate(new_lines[0])[1]
+            jove.set_selection(start, start)
+
+    #
+    # Insert the current kill ring entry as a rectangle with its upper left corner at point. The mark
+    # is left at the upper left corner and point at the lower right.
+    #
+    def yank(self, jove, tab_size):
+        view = self.view
+        data = kill_ring.get_current(0)
+        if not data:
+            jove.set_status("Nothing to yank!")
+            return
+        texts = data if isinstance(data, list) else data.split("\n")
+
+        point = jove.get_point()
+        first = view.line(point)
+        row = view.rowcol(point)[0]
+        last = view.line(view.text_point(row + len(texts) - 1, 0))
+        block = sublime.Region(first.a, max(last.b, first.b))
+        lines = view.substr(block).split("\n")
+        column = display_column(lines[0], point - first.a, tab_size)
+        rect = Rectangle(column, column, tab_size)
+        new_lines, end = rect.insert(lines, texts)
+
+        view.replace(jove.edit, block, "\n".join(new_lines))
+        start = block.a + rect.locate(new_lines[0])[1]
+        end += block.a + sum(len(line) + 1 for line in new_lines[:len(texts) - 1])
+        jove.state.mark_ring.set(start, True)
+        jove.set_selection(end, end)
+
 class JovePaneCmdCommand(JoveTextCommand):
     def run_cmd(self, jove, cmd, **kwargs):
         view = self.view
@@ -1151,6 +2623,38 @@ class JovePaneCmdCommand(JoveTextCommand):
                 index = len(views) - 1
             window.focus_view(views[index])
 
+#
+# Switch to a buffer in any window by typing part of its name or path. The best matches are shown
+# in the status bar as you type, most recently used first among equals, and Return switches to the
+# first of them. With nothing typed that's the buffer used before this one.
+#
+class JoveSwitchBufferCommand(JoveTextCommand):
+    MAX_SHOWN = 8
+
+    def run_cmd(self, jove):
+        view = self.view
+        window = view.window()
+        switcher = BufferSwitcher([v for w in sublime.windows() for v in w.views()], view.id())
+
+        def show(text):
+            ranked = switcher.rank(text)
+            names = BufferSwitcher.display_names(ranked[:self.MAX_SHOWN])
+            more = " | ..." if len(ranked) > self.MAX_SHOWN else ""
+            view.set_status(JOVE_SWITCH_STATUS, "{%s%s}" % (" | ".join(names), more) if names else "[No match]")
+
+        def on_done(text):
+            view.erase_status(JOVE_SWITCH_STATUS)
+            ranked = switcher.rank(text)
+            target = switcher.get_view(ranked[0]) if ranked else None
+            if target is None or not target.is_valid():
+                CmdHelper(view).set_status("No buffer matching %s" % (text,))
+                return
+            target.window().focus_view(target)
+
+        show("")
+        window.show_input_panel("Switch to buffer:", "", on_done, show,
+                                lambda: view.erase_status(JOVE_SWITCH_STATUS))
+
 #
 # Exists only to support kill-line with multiple cursors.
 #
@@ -1168,7 +2672,8 @@ class JoveMoveForKillLineCommand(JoveTextCommand):
 
         def advance(cursor):
             start = cursor.b
-            text,index,region = jove.get_line_info(start)
+            text = jove.get_text()
+            region = text.line(start)
 
             if line_mode:
                 # go down N lines
@@ -1187,43 +2692,55 @@ class JoveMoveForKillLineCommand(JoveTextCommand):
                 end = region.end()
 
                 # check if line is blank from here to the end and if so, delete the \n as well
-                import re
-                if re.match(r'[ \t]*$', text[index:]):
+                if text.is_blank(start, end):
                     end += 1
             cursor.a = cursor.b = end
             return cursor
 
         jove.for_each_cursor(advance)
 
+#
+# Yank the current kill ring entry at each cursor. If the entry came from a kill with the same
+# number of cursors each cursor gets its own string, otherwise they all get the whole entry. With
+# pop we replace what the previous yank inserted.
+#
 class JoveYankCommand(JoveTextCommand):
     def run_cmd(self, jove, pop=0):
-        # for now only works with one cursor
         view = self.view
         selection = view.sel()
-        if len(selection) != 1:
-            jove.set_status("Cannot yank with multiple cursors ... yet")
-            return
 
         if pop != 0:
-            # we need to delete the existing data first
+            # we need to replace the existing data
             if jove.state.last_cmd != 'jove_yank':
                 jove.set_status("Previous command was not yank!")
                 return
-            view.erase(jove.edit, jove.get_region())
+            regions = view.get_regions("jove_yank")
+        else:
+            regions = [sublime.Region(r.b, r.b) for r in selection]
 
         data = kill_ring.get_current(pop)
-        if data:
-            point = jove.get_point()
-            view.insert(jove.edit, point, data)
-            jove.state.mark_ring.set(point, True)
-            jove.ensure_visible(jove.get_point())
-        else:
+        if not data:
             jove.set_status("Nothing to pop!")
+            return
+        if isinstance(data, list) and len(data) == len(regions):
+            texts = data
+        else:
+            texts = [as_text(data)] * len(regions)
+
+        regions = jove.replace_regions(regions, texts)
+        view.add_regions("jove_yank", regions, "", "", sublime.HIDDEN)
+        selection.clear()
+        selection.add_all([sublime.Region(r.b, r.b) for r in regions])
+        if len(regions) == 1:
+            jove.state.mark_ring.set(regions[0].a, True)
+        jove.ensure_visible(jove.get_point())
 
 #####################################################
 #            Better incremental search              #
 #####################################################
 class ISearchInfo():
+    SCROLL_CHECK_DELAY = 100
+
     last_search = None
 
     class StackItem():
@@ -1281,6 +2798,7 @@ class ISearchInfo():
         self.jove = CmdHelper(view)
         self.window = view.window()
         self.point = self.jove.get_point()
+        self.visible = None
         self.update()
         self.input_view = None
         self.in_changes = 0
@@ -1292,6 +2810,7 @@ class ISearchInfo():
         window = self.view.window()
         self.input_view = window.show_input_panel("%sI-Search:" % ("Regexp " if self.regex else "", ),
                                                   "", self.on_done, self.on_change, self.on_cancel)
+        sublime.set_timeout(self.watch_scroll, self.SCROLL_CHECK_DELAY)
 
     def is_active(self):
         return ViewState.isearch_info == self
@@ -1319,15 +2838,27 @@ class ISearchInfo():
 
         self.find(val)
 
-    def find(self, val):
-        # determine if this is case sensitive search or not
-        flags = 0 if self.regex else sublime.LITERAL
+    #
+    # Returns the find flags for searching for val: the search is case sensitive only if val
+    # contains upper case characters.
+    #
+    @staticmethod
+    def get_flags(val, regex):
+        flags = 0 if regex else sublime.LITERAL
         if not re.search(r'[A-Z]', val):
             flags |= sublime.IGNORECASE
+        return flags
+
+    def find(self, val):
+        flags = self.get_flags(val, self.regex)
 
         # find all instances if we have a search string
         if len(val) > 0:
-            regions = self.view.find_all(val, flags)
+            narrowed = self.jove.get_narrowed()
+            if narrowed is None:
+                regions = self.view.find_all(val, flags)
+            else:
+                regions = self.find_in(self.view, val, self.regex, narrowed)
 
             # find the closest match to where we currently are
             point = None
@@ -1344,6 +2875,36 @@ class ISearchInfo():
             index = -1
         self.update()
 
+    #
+    # Returns the matches for val in region, for narrowed buffers. Sublime can only search the whole
+    # buffer, so we use python's regexps on the text of the region instead, which makes the cost
+    # depend on the size of the region. Python's regexp syntax is close enough to sublime's for
+    # i-search. If extractions is a list, the replacement (in sublime's format, with $1 or \1 for
+    # groups) is expanded for each match and added to it, as find_all does.
+    #
+    @staticmethod
+    def find_in(view, val, regex, region, replacement=None, extractions=None):
+        pattern = val if regex else re.escape(val)
+        flags = re.MULTILINE if re.search(r'[A-Z]', val) else re.MULTILINE | re.IGNORECASE
+        try:
+            compiled = re.compile(pattern, flags)
+        except re.error:
+            return []
+        if extractions is not None:
+            template = re.sub(r'\$(?:(\d+)|\{(\d+)\}|(&))',
+                              lambda m: "\\g<%s>" % (m.group(1) or m.group(2) or "0",), replacement)
+        text = view.substr(region)
+        regions = []
+        for m in compiled.finditer(text):
+            if m.end() > m.start():
+                regions.append(sublime.Region(region.a + m.start(), region.a + m.end()))
+                if extractions is not None:
+                    try:
+                        extractions.append(m.expand(template))
+                    except (re.error, IndexError):
+                        extractions.append(replacement)
+        return regions
+
     #
     # Implementation and internal API.
     #
@@ -1423,7 +2984,7 @@ class ISearchInfo():
         if si is None:
             return
 
-        self.view.add_regions("find", si.regions, "text", "", sublime.DRAW_NO_FILL)
+        self.highlight(si.regions)
         selected = si.selected or []
         self.view.add_regions("selected", selected, "string", "", 0)
         if selected:
@@ -1443,6 +3004,31 @@ class ISearchInfo():
 
         self.jove.set_status(status)
 
+    #
+    # Highlight the matches. In large file mode only the ones in the visible region are highlighted,
+    # and they are highlighted again whenever it changes (see watch_scroll).
+    #
+    def highlight(self, regions):
+        if self.jove.state.large_file:
+            visible = self.visible = self.view.visible_region()
+            first = self.find_closest(regions, visible.begin(), True)
+            last = self.find_closest(regions, visible.end(), False)
+            regions = regions[first:last + 1] if first >= 0 else []
+        self.view.add_regions("find", regions, "text", "", sublime.DRAW_NO_FILL)
+
+    #
+    # Sublime doesn't tell us when a view scrolls, so while the search is running in large file mode
+    # we check every SCROLL_CHECK_DELAY ms whether the visible region has changed.
+    #
+    def watch_scroll(self):
+        if ViewState.isearch_info is not self or not self.view.is_valid():
+            return
+        if self.jove.state.large_file and self.view.visible_region() != self.visible:
+            si = self.not_in_error()
+            if si is not None:
+                self.highlight(si.regions)
+        sublime.set_timeout(self.watch_scroll, self.SCROLL_CHECK_DELAY)
+
     #
     # Try to make progress with the current search string. Even if we're currently failing (in our
     # current direction) it doesn't mean there aren't matches for what we've typed so far.
@@ -1503,13 +3089,14 @@ class ISearchInfo():
 
         if point < limit:
             # append at least one character, word character or not
-            search += append_one(view.substr(point))
+            text = helper.get_text(refresh=True)
+            search += append_one(text.char(point))
             point += 1
             self.on_change(search)
 
             # now insert word characters
             while point < limit and helper.is_word_char(point, True, separators):
-                ch = view.substr(point)
+                ch = text.char(point)
                 search += append_one(ch)
                 self.on_change(search)
                 point += 1
@@ -1538,24 +3125,31 @@ class ISearchInfo():
             self.pop()
 
 
-    def find_closest(self, regions, pos, forward):
-        #
-        # The regions are sorted so clearly this would benefit from a simple binary search ...
-        #
-        if len(regions) == 0:
-            return -1
-        # find the first region after the specified pos
-        found = False
+    #
+    # Returns the index of the first region which ends at or after pos if forward, or the last
+    # region which begins at or before pos if not. Returns -1 if there is no such region. The regions
+    # are sorted so we do a binary search.
+    #
+    @staticmethod
+    def find_closest(regions, pos, forward):
+        lo = 0
+        hi = len(regions)
         if forward:
-            for index,r in enumerate(regions):
-                if r.end() >= pos:
-                    return index
-            return -1
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if regions[mid].end() >= pos:
+                    hi = mid
+                else:
+                    lo = mid + 1
+            return lo if lo < len(regions) else -1
         else:
-            for index,r in enumerate(regions):
-                if r.begin() > pos:
-                    return index - 1
-            return len(regions) - 1
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if regions[mid].begin() > pos:
+                    hi = mid
+                else:
+                    lo = mid + 1
+            return lo - 1
 
 class JoveIncSearchCommand(JoveTextCommand):
     def run_cmd(self, jove, cmd=None, **kwargs):
@@ -1595,16 +3189,310 @@ class JoveIncSearchEscape(JoveTextCommand):
         info.done()
         info.view.run_command(next_cmd, next_args)
 
+#####################################################
+#            Occur                                  #
+#####################################################
+
+#
+# Show all the lines in this buffer which match a regex in a results buffer. Return in the results
+# buffer visits the match. The results are kept up to date as the buffer changes.
+#
+class JoveOccurCommand(JoveTextCommand):
+    last_pattern = None
+
+    def run_cmd(self, jove):
+        window = self.view.window()
+        window.show_input_panel("%s (regexp):" % ("Multi-occur" if self.is_multi() else "Occur",),
+                                JoveOccurCommand.last_pattern or "", self.occur, None, None)
+
+    def is_multi(self):
+        return False
+
+    def get_views(self):
+        return [self.view]
+
+    def occur(self, pattern):
+        if not pattern:
+            return
+        JoveOccurCommand.last_pattern = pattern
+        try:
+            occur = Occur(self.view.window(), pattern, self.get_views())
+        except re.error as e:
+            sublime.status_message("Bad regexp: %s" % (e,))
+            return
+        occur.start()
+
+#
+# Occur in every open buffer.
+#
+class JoveMultiOccurCommand(JoveOccurCommand):
+    def is_multi(self):
+        return True
+
+    def get_views(self):
+        views = []
+        seen = set()
+        for window in sublime.windows():
+            for view in window.views():
+                if view.buffer_id() in seen or view.settings().get("jove_occur") or view.is_loading():
+                    continue
+                seen.add(view.buffer_id())
+                views.append(view)
+        return views
+
+#
+# Applies a queued section of occur results to the results view.
+#
+class JoveOccurUpdateCommand(JoveTextCommand):
+    unregistered = True
+
+    def run_cmd(self, jove, view_id):
+        occur = Occur.instances.get(self.view.id())
+        if occur:
+            occur.apply(jove.edit, view_id)
+
+#
+# Visit the match on the current line of the occur results.
+#
+class JoveOccurGotoCommand(JoveTextCommand):
+    def run_cmd(self, jove):
+        occur = Occur.instances.get(self.view.id())
+        if occur is None:
+            return
+        found = occur.locate(self.view.rowcol(jove.get_point())[0])
+        if found is None:
+            return
+        view, pos = found
+        if not view.is_valid():
+            jove.set_status("That buffer has been closed")
+            return
+        window = view.window()
+        window.focus_view(view)
+        CmdHelper(view).goto_position(pos, set_mark=True)
+
+#####################################################
+#            Query replace                          #
+#####################################################
+
+#
+# An in-progress query replace. All the matches from point to the end of the buffer (or the active
+# region, or the narrowed region) are found up front with the same matching rules as i-search. As we go forward we keep
+# track of how much the replacements so far have shifted the remaining matches, so stepping is
+# constant time. Replacing all the remaining matches is done from the end backwards so the
+# positions stay valid, and happens in a single command so it is one undo step.
+#
+class QueryReplaceInfo():
+    # highlight at most this many of the upcoming matches
+    MAX_HIGHLIGHTS = 1000
+
+    def __init__(self, view, search, replacement, regex):
+        self.view = view
+        self.jove = jove = CmdHelper(view)
+        self.search = search
+        self.replacement = replacement
+        self.point = jove.get_point()
+
+        limit = None
+        narrowed = jove.get_narrowed()
+        if jove.state.active_mark:
+            region = jove.get_region()
+            if region:
+                region = jove.clip_region(region)
+                self.point, limit = region.begin(), region.end()
+            jove.toggle_active_mark_mode(False)
+        elif narrowed is not None:
+            self.point = max(self.point, narrowed.a)
+            limit = narrowed.b
+
+        self.extractions = [] if regex else None
+        if narrowed is not None:
+            # only search the narrowed region
+            regions = ISearchInfo.find_in(view, search, regex, narrowed, replacement, self.extractions)
+        elif regex:
+            regions = view.find_all(search, ISearchInfo.get_flags(search, regex), replacement, self.extractions)
+        else:
+            regions = view.find_all(search, ISearchInfo.get_flags(search, regex))
+
+        # only the matches from point to the limit
+        start = ISearchInfo.find_closest(regions, self.point, True)
+        if start < 0:
+            start = len(regions)
+        while start < len(regions) and regions[start].begin() < self.point:
+            start += 1
+        end = len(regions)
+        if limit is not None:
+            end = ISearchInfo.find_closest(regions, limit, False) + 1
+            while end > start and regions[end - 1].end() > limit:
+                end -= 1
+        self.regions = regions[start:end]
+        if self.extractions is not None:
+            self.extractions = self.extractions[start:end]
+
+        self.index = 0
+        self.delta = 0
+        self.replaced = 0
+
+    def has_match(self):
+        return self.index < len(self.regions)
+
+    #
+    # Returns the index'th match adjusted for the replacements made so far.
+    #
+    def get_match(self, index):
+        r = self.regions[index]
+        return sublime.Region(r.a + self.delta, r.b + self.delta)
+
+    def get_replacement(self, index):
+        if self.extractions is not None:
+            return self.extractions[index]
+        return self.replacement
+
+    def replace(self, edit):
+        if self.has_match():
+            region = self.get_match(self.index)
+            text = self.get_replacement(self.index)
+            self.view.replace(edit, region, text)
+            self.delta += len(text) - region.size()
+            self.replaced += 1
+            self.index += 1
+
+    def skip(self):
+        self.index += 1
+
+    def replace_all(self, edit):
+        view = self.view
+        for index in range(len(self.regions) - 1, self.index - 1, -1):
+            view.replace(edit, self.get_match(index), self.get_replacement(index))
+            self.replaced += 1
+        # the end of the last replacement, once the ones before it have moved it along
+        end = None
+        for index in range(self.index, len(self.regions)):
+            text = self.get_replacement(index)
+            end = self.get_match(index).begin() + len(text)
+            self.delta += len(text) - self.regions[index].size()
+        self.index = len(self.regions)
+        return end
+
+    #
+    # Highlight the current match and the upcoming ones which are visible and put the cursor at the
+    # end of the current match. Finishes the replace if there are no more matches.
+    #
+    def update(self):
+        if not self.has_match():
+            self.finish()
+            return
+        view = self.view
+        current = self.get_match(self.index)
+        self.jove.set_selection(current.end(), current.end())
+        self.jove.ensure_visible(current.end())
+
+        visible_end = view.visible_region().end()
+        upcoming = []
+        for index in range(self.index + 1, min(len(self.regions), self.index + 1 + self.MAX_HIGHLIGHTS)):
+            r = self.get_match(index)
+            if r.begin() > visible_end:
+                break
+            upcoming.append(r)
+        view.add_regions("find", upcoming, "text", "", sublime.DRAW_NO_FILL)
+        view.add_regions("selected", [current], "string", "", 0)
+        self.jove.set_status("Query replacing %s with %s: (y, n, !, ., q) %d of %d" %
+                             (self.search, self.replacement, self.index + 1, len(self.regions)))
+
+    def finish(self, point=None):
+        ViewState.query_replace_info = None
+        view = self.view
+        view.erase_regions("find")
+        view.erase_regions("selected")
+        if point is not None:
+            self.jove.set_selection(point, point)
+            self.jove.ensure_visible(point)
+        self.jove.set_mark(self.point, update_status=False, and_selection=False)
+        sublime.set_timeout(lambda: self.jove.set_status("Replaced %d occurrences" % (self.replaced,)), 0)
+
+#
+# Query replace (and query replace regexp if regex is True). Without a cmd we prompt for the search
+# and replacement strings and start replacing. The y/n/!/./q keys send the cmd for each step while
+# a replace is in progress.
+#
+class JoveQueryReplaceCommand(JoveTextCommand):
+    query = True
+
+    def run_cmd(self, jove, cmd=None, regex=False):
+        info = ViewState.query_replace_info
+        if cmd is None:
+            if jove.state.argument_supplied:
+                regex = not regex
+            self.prompt(jove, regex)
+        elif info is None:
+            return
+        elif cmd == "yes":
+            info.replace(jove.edit)
+            info.update()
+        elif cmd == "no":
+            info.skip()
+            info.update()
+        elif cmd == "last":
+            info.replace(jove.edit)
+            info.finish()
+        elif cmd == "all":
+            info.finish(info.replace_all(jove.edit))
+        elif cmd == "quit":
+            info.finish()
+
+    def prompt(self, jove, regex):
+        window = self.view.window()
+        kind = "%s%s" % ("Query replace" if self.query else "Replace", " regexp" if regex else "")
+
+        def on_replacement(replacement, search):
+            info = ViewState.query_replace_info = QueryReplaceInfo(self.view, search, replacement, regex)
+            if not info.has_match():
+                info.finish()
+                jove.set_status("No matches for %s" % (search,))
+            elif self.query:
+                info.update()
+            else:
+                self.view.run_command("jove_query_replace", {"cmd": "all"})
+
+        def on_search(search):
+            if search:
+                window.show_input_panel("%s %s with:" % (kind, search), "",
+                                        lambda replacement: on_replacement(replacement, search), None, None)
+
+        window.show_input_panel("%s:" % (kind,), ISearchInfo.last_search or "", on_search, None, None)
+
+#
+# Replace regexp (without querying).
+#
+class JoveReplaceRegexpCommand(JoveQueryReplaceCommand):
+    query = False
+
+    def run_cmd(self, jove):
+        self.prompt(jove, True)
+
+#
+# Indent for tab command. With one cursor, use sublime's reindent on its line and move to the start
+# of the text if the cursor was within the indent. If the cursor was already at the indent and the
+# indent didn't change, indent one more level.
 #
-# Indent for tab command. If the cursor is not within the existing indent, just call reindent. If
-# the cursor is within the indent, move to the start of the indent and call reindent. If the cursor
-# was already at the indent didn't change after calling reindent, indent one more level.
+# With multiple cursors or an active mark, reindent all the lines touched by the cursors or the
+# region in a single edit.
 #
 class JoveIndentCommand(JoveTextCommand):
     def run_cmd(self, jove):
+        view = self.view
+        selection = view.sel()
+        if jove.state.active_mark:
+            region = jove.get_region()
+            if region:
+                changed = jove.reindent_regions([region])
+                jove.set_status("Reindented %d lines" % (changed,))
+            return
+        if len(selection) > 1:
+            jove.reindent_regions([r for r in selection])
+            return
+
         point = jove.get_point()
         indent,cursor = jove.get_line_indent(point)
-        jove.set_status("Indent at %s, within=%s, at=%s" % (indent, cursor <= indent, cursor == indent))
         if cursor > indent:
             jove.run_command("reindent", {})
         else:
@@ -1619,6 +3507,148 @@ class JoveIndentCommand(JoveTextCommand):
                     # cursor was already at the indent
                     jove.run_command("indent", {})
 
+#
+# Reindent all the lines in the emacs region in a single edit.
+#
+class JoveIndentRegionCommand(JoveTextCommand):
+    def run_cmd(self, jove):
+        region = jove.get_region()
+        if region:
+            changed = jove.reindent_regions([region])
+            jove.toggle_active_mark_mode(False)
+            jove.set_status("Reindented %d lines" % (changed,))
+
+#
+# Comment the lines in the emacs region (or the lines of each cursor when there are several). With a
+# numeric argument the comments are removed instead.
+#
+class JoveCommentRegionCommand(JoveTextCommand):
+    def run_cmd(self, jove, uncomment=False):
+        selection = self.view.sel()
+        if len(selection) > 1:
+            regions = [r for r in selection]
+        else:
+            region = jove.get_region()
+            if region is None:
+                jove.set_status("No mark set in this buffer")
+                return
+            regions = [region]
+        action = "uncomment" if uncomment or jove.has_prefix_arg() else "comment"
+        changed = jove.comment_regions(regions, action)
+        if changed is None:
+            jove.set_status("No comment syntax here")
+            return
+        if len(selection) == 1:
+            jove.toggle_active_mark_mode(False)
+        jove.set_status("%s %d lines" % ("Uncommented" if action == "uncomment" else "Commented", changed))
+
+#
+# Do what I mean with comments. With an active mark it comments the region, or uncomments it if it
+# is all comments. Otherwise it does the same to the line of each cursor (or, with a numeric
+# argument, that many lines from the cursor), except that if every cursor is on a blank line an
+# empty comment is started there instead.
+#
+class JoveCommentDwimCommand(JoveTextCommand):
+    def run_cmd(self, jove):
+        view = self.view
+        selection = view.sel()
+        if len(selection) == 1 and jove.state.active_mark:
+            region = jove.get_region()
+            if region:
+                if jove.comment_regions([region], "toggle") is None:
+                    jove.set_status("No comment syntax here")
+                jove.toggle_active_mark_mode(False)
+            return
+
+        regions = [r for r in selection]
+        if len(regions) == 1 and jove.has_prefix_arg():
+            point = jove.get_point()
+            row = view.rowcol(point)[0]
+            regions = [sublime.Region(view.line(point).a, view.text_point(row + jove.get_count(), 0))]
+        elif all(r.empty() and jove.is_blank(view.line(r.a).a, view.line(r.a).b) for r in regions):
+            commenter = jove.get_commenter(regions[0].a)
+            if commenter is None:
+                jove.set_status("No comment syntax here")
+                return
+            ends = [sublime.Region(view.line(r.a).b, view.line(r.a).b) for r in regions]
+            new = jove.replace_regions(ends, [commenter.start + commenter.end] * len(ends))
+            selection.clear()
+            selection.add_all([sublime.Region(r.a + len(commenter.start), r.a + len(commenter.start)) for r in new])
+            return
+        if jove.comment_regions(regions, "toggle") is None:
+            jove.set_status("No comment syntax here")
+
+#
+# Run a build command asynchronously with its output in a panel. Unless the command is supplied we
+# prompt for it, offering the previous one. A build which is still running is killed first.
+#
+class JoveCompileCommand(JoveTextCommand):
+    def run_cmd(self, jove, command=None):
+        if command:
+            self.compile(command)
+        else:
+            default = Compilation.last_command or self.view.settings().get("jove_compile_command", "make -k")
+            self.view.window().show_input_panel("Compile command:", default, self.compile, None, None)
+
+    def compile(self, command):
+        current = Compilation.current
+        if current and current.is_running():
+            current.kill()
+        Compilation.last_command = command
+        Compilation(self.view.window(), command, get_directory(self.view)).start()
+
+#
+# Visit the next (or previous if direction is -1) error from the most recent compilation or grep. A
+# numeric argument skips that many errors.
+#
+class JoveNextErrorCommand(JoveTextCommand):
+    def run_cmd(self, jove, direction=1):
+        compilation = Compilation.latest
+        if compilation is None:
+            jove.set_status("No compilation")
+        elif not compilation.next_error(direction * jove.get_count()):
+            jove.set_status("No more errors")
+
+#
+# Search the files in the window's folders for a regexp, prompting with the symbol at point. The
+# search runs in the background (see grep.py) with the matches listed in a panel as they are
+# found, and jove_next_error visits them. A search which is still running is stopped first.
+#
+class JoveProjectGrepCommand(JoveTextCommand):
+    last_pattern = None
+
+    def run_cmd(self, jove, pattern=None):
+        window = self.view.window()
+        if not window or not window.folders():
+            jove.set_status("No folders to search")
+            return
+        if pattern:
+            self.grep(pattern)
+            return
+        default = JoveProjectGrepCommand.last_pattern or ""
+        selection = self.view.sel()
+        if len(selection) == 1 and not selection[0].empty():
+            default = re.escape(self.view.substr(selection[0]))
+        else:
+            separators = self.view.settings().get("jove_sexpr_separators", default_jove_sexpr_separators)
+            symbol = jove.get_symbol(jove.get_point(), separators)
+            if symbol:
+                default = re.escape(symbol)
+        window.show_input_panel("Grep project (regexp):", default, self.grep, None, None)
+
+    def grep(self, pattern):
+        if not pattern:
+            return
+        JoveProjectGrepCommand.last_pattern = pattern
+        current = Grep.current
+        if current and current.is_running():
+            current.kill()
+        window = self.view.window()
+        try:
+            Grep(window, pattern, window.folders(), self.view.settings()).start()
+        except re.error as e:
+            sublime.status_message("Bad regexp: %s" % (e,))
+
 class JoveQuitCommand(JoveTextCommand):
     def run_cmd(self, jove):
         window = self.view.window()
@@ -1627,6 +3657,10 @@ class JoveQuitCommand(JoveTextCommand):
             ViewState.isearch_info.quit()
             return
 
+        if ViewState.query_replace_info:
+            ViewState.query_replace_info.finish()
+            return
+
         for cmd in ['clear_fields', 'hide_overlay', 'hide_auto_complete', 'hide_panel']:
             window.run_command(cmd)
 
@@ -1,7 +1,9 @@
 import sublime
 
 #
-# Classic emacs kill ring.
+# Classic emacs kill ring. An entry is either a string or, for a kill with multiple cursors, a list
+# with one string per cursor. The clipboard gets the strings of a list joined with newlines, the
+# same as copying with multiple cursors in Sublime.
 #
 class KillRing:
     KILL_RING_SIZE = 64
@@ -14,13 +16,22 @@ class KillRing:
     # Add some text to the kill ring. 'forward' indicates whether the editing command that produced
     # this data was in the forward or reverse direction. It only matters if 'join' is true, because
     # it tells us how to add this data to the most recent kill ring entry rather than creating a new
-    # entry.
+    # entry. A list of strings is only joined to an entry with the same number of strings.
     #
     def add(self, text, forward, join):
-        if len(text) == 0:
+        if not any(text):
             return
         buffers = self.buffers
         index = self.index
+        current = buffers[index]
+        if join and current is not None and (isinstance(text, list) or isinstance(current, list)):
+            if not isinstance(text, list) or not isinstance(current, list) or len(text) != len(current):
+                join = False
+            elif forward:
+                text = [a + b for a, b in zip(current, text)]
+            else:
+                text = [b + a for a, b in zip(current, text)]
+            current = None
         if not join:
             index += 1
             if index >= len(buffers):
@@ -28,13 +39,13 @@ class KillRing:
             self.index = index
             buffers[index] = text
         else:
-            if buffers[index] is None:
+            if current is None:
                 buffers[index] = text
             elif forward:
-                buffers[index] = buffers[index] + text
+                buffers[index] = current + text
             else:
-                buffers[index] = text + buffers[index]
-        sublime.set_clipboard(buffers[index])
+                buffers[index] = text + current
+        sublime.set_clipboard(as_text(buffers[index]))
 
     #
     # Returns the current entry in the kill ring. If pop is non-zero, we move backwards or forwards
@@ -47,7 +58,7 @@ class KillRing:
         if pop == 0:
             clipboard = sublime.get_clipboard()
             val = buffers[index]
-            if val != clipboard and clipboard:
+            if as_text(val) != clipboard and clipboard:
                 # we switched to another app and cut or copied something there, so add that to our
                 # kill ring
                 self.add(clipboard, True, False)
@@ -59,6 +70,14 @@ class KillRing:
                 index = (incr + index) % self.KILL_RING_SIZE
             self.index = index
             val = buffers[index]
-            sublime.set_clipboard(val)
+            sublime.set_clipboard(as_text(val))
 
         return val
+
+#
+# Returns a kill ring entry as a single string.
+#
+def as_text(val):
+    if isinstance(val, list):
+        return "\n".join(val)
+    return val
@@ -0,0 +1,53 @@
+import re
+
+#
+# Operations on a list of lines which return the new list, so the caller can read a block of text
+# once and replace it with a single edit. They are plain functions so they can run off the UI
+# thread.
+#
+NUMBER_RE = re.compile(r'\s*([-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)')
+
+#
+# Returns the sort key of line: the whole line, or its field'th white space separated field
+# (counting from 1, or from the end if negative), as a number if numeric. A line without that field
+# has an empty key, and a key which isn't a number counts as 0 (like sort -n).
+#
+def line_key(line, numeric=False, field=None):
+    key = line
+    if field:
+        fields = line.split()
+        index = field - 1 if field > 0 else field
+        key = fields[index] if -len(fields) <= index < len(fields) else ""
+    if numeric:
+        m = NUMBER_RE.match(key)
+        return float(m.group(1)) if m else 0.0
+    return key
+
+#
+# Returns lines sorted by line_key, which is worked out once for each line. The sort is stable, even
+# in reverse.
+#
+def sort_lines(lines, reverse=False, numeric=False, field=None):
+    if not numeric and not field:
+        return sorted(lines, reverse=reverse)
+    return sorted(lines, key=lambda line: line_key(line, numeric, field), reverse=reverse)
+
+#
+# Returns lines without the ones which repeat an earlier line (or a later one, with reverse, which
+# keeps the last of each). With adjacent only a line which repeats the one next to it is deleted.
+#
+def delete_duplicate_lines(lines, reverse=False, adjacent=False):
+    if reverse:
+        return delete_duplicate_lines(lines[::-1], False, adjacent)[::-1]
+    result = []
+    if adjacent:
+        for line in lines:
+            if not result or result[-1] != line:
+                result.append(line)
+        return result
+    seen = set()
+    for line in lines:
+        if line not in seen:
+            seen.add(line)
+            result.append(line)
+    return result
@@ -0,0 +1,62 @@
+#
+# Keyboard macros. While a macro is being recorded every top-level text command is added to it,
+# after any rewriting for numeric arguments and the active mark has been done, so replaying a step
+# does exactly what the original command did without going through the event listeners again.
+#
+# Before a macro is played it is compiled: runs of typed characters become a single insert. The
+# result is cached, so playing a macro many times only compiles it once.
+#
+class Macro:
+    # the macro being recorded and the most recently defined one
+    recording = None
+    last = None
+
+    # True while a macro is being played
+    playing = False
+
+    def __init__(self):
+        self.steps = []
+        self.compiled = None
+
+    def add(self, cmd, args):
+        self.steps.append((cmd, dict(args or {})))
+        self.compiled = None
+
+    #
+    # Returns the steps to play as (cmd, args, is_jove) tuples.
+    #
+    def compile(self):
+        if self.compiled is None:
+            steps = []
+            for cmd, args in self.steps:
+                if (cmd == "insert" and steps and steps[-1][0] == "insert" and
+                        list(args) == ["characters"] and list(steps[-1][1]) == ["characters"]):
+                    steps[-1][1]["characters"] += args["characters"]
+                else:
+                    steps.append((cmd, dict(args), cmd.startswith("jove_")))
+            self.compiled = steps
+        return self.compiled
+
+    @classmethod
+    def start(cls):
+        cls.recording = Macro()
+
+    #
+    # Stop recording and make the new macro the last one. Returns False if we weren't recording.
+    #
+    @classmethod
+    def end(cls):
+        macro = cls.recording
+        if macro is None:
+            return False
+        cls.recording = None
+        cls.last = macro
+        return True
+
+    #
+    # Record a command if we are defining a macro.
+    #
+    @classmethod
+    def record(cls, cmd, args):
+        if cls.recording is not None and not cls.playing:
+            cls.recording.add(cmd, args)
@@ -0,0 +1,88 @@
+import sys
+import sublime
+
+try:
+    import tracemalloc
+except ImportError:
+    # not in python 3.3
+    tracemalloc = None
+
+#
+# Returns the approximate number of bytes used by obj and everything it refers to through
+# containers and instance attributes. Views and windows belong to Sublime, so they count only as
+# references. Objects in seen are not counted again, so a caller measuring several structures can
+# share one set to avoid counting shared objects twice.
+#
+def deep_size(obj, seen=None):
+    if seen is None:
+        seen = set()
+    size = 0
+    todo = [obj]
+    while todo:
+        obj = todo.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        if isinstance(obj, (str, bytes, int, float, bool, type(None), sublime.View, sublime.Window)):
+            continue
+        if isinstance(obj, dict):
+            todo.extend(obj.keys())
+            todo.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            todo.extend(obj)
+        elif hasattr(obj, "__dict__") and not isinstance(obj, type):
+            todo.append(obj.__dict__)
+        elif hasattr(obj, "__slots__"):
+            todo.extend(getattr(obj, name) for name in obj.__slots__ if hasattr(obj, name))
+    return size
+
+def format_size(size):
+    for unit in ("bytes", "KB", "MB"):
+        if size < 1024 or unit == "MB":
+            return ("%d %s" if unit == "bytes" else "%.1f %s") % (size, unit)
+        size /= 1024.0
+
+#
+# A memory report: one row per structure with its entry count and size, followed by free form
+# sections (e.g., the largest entries).
+#
+class MemoryReport:
+    def __init__(self):
+        self.rows = []
+        self.sections = []
+        self.seen = set()
+
+    def add(self, name, obj, count=None):
+        size = deep_size(obj, self.seen)
+        if count is None:
+            count = len(obj) if hasattr(obj, "__len__") else 1
+        self.rows.append((name, count, size))
+        return size
+
+    def add_section(self, title, lines):
+        self.sections.append((title, lines))
+
+    def format(self):
+        width = max([len(row[0]) for row in self.rows] + [10])
+        lines = ["%-*s %10s %12s" % (width, "Structure", "Entries", "Size")]
+        for name, count, size in self.rows:
+            lines.append("%-*s %10d %12s" % (width, name, count, format_size(size)))
+        lines.append("%-*s %10s %12s" % (width, "Total", "", format_size(sum(r[2] for r in self.rows))))
+        for title, section in self.sections:
+            lines.append("")
+            lines.append(title)
+            lines.extend("  " + line for line in section)
+        return "\n".join(lines) + "\n"
+
+#
+# Returns lines describing the top allocations by source line in files under directory, or None
+# if tracemalloc is not tracing.
+#
+def traced_allocations(directory, limit=10):
+    if tracemalloc is None or not tracemalloc.is_tracing():
+        return None
+    snapshot = tracemalloc.take_snapshot()
+    snapshot = snapshot.filter_traces([tracemalloc.Filter(True, directory + "*")])
+    return ["%s: %s in %d blocks" % (stat.traceback, format_size(stat.size), stat.count)
+            for stat in snapshot.statistics("lineno")[:limit]]
@@ -0,0 +1,316 @@
+import re, threading
+import sublime
+
+from .workers import get_thread_pool
+
+#
+# Returns (line_number, line_start, line_text) for each line of text which matches regex. Line
+# numbers start at 1 and each line is reported once no matter how many matches it has.
+#
+def search_lines(text, regex):
+    result = []
+    line_number = 1
+    counted = 0
+    last_line = 0
+    for m in regex.finditer(text):
+        start = m.start()
+        line_number += text.count("\n", counted, start)
+        counted = start
+        if line_number == last_line:
+            continue
+        last_line = line_number
+        line_start = text.rfind("\n", 0, start) + 1
+        line_end = text.find("\n", start)
+        if line_end < 0:
+            line_end = len(text)
+        result.append((line_number, line_start, text[line_start:line_end]))
+    return result
+
+#
+# Occur over a set of views. We take a snapshot of each view's text on the UI thread, search the
+# snapshots on the worker thread pool, and add each view's matches to the results view as soon as
+# they are ready. The results view has a header followed by a section per view with matches.
+#
+# When one of the views changes, only its section is replaced, and only the lines which were
+# modified are searched again. The matching lines are kept as (hidden) regions in each view, which
+# sublime moves as the buffer is edited, along with the lines the cursors were on when it was
+# modified. The matches between modified lines keep their text, and their line numbers are shifted
+# by the change in the number of lines before them. We keep track of the size (in characters and
+# rows) of each section so we can find sections without reading back the results.
+#
+class Occur:
+    RESULTS_NAME = "*Occur*"
+    REFRESH_DELAY = 300
+    # above this many modified lines we search the whole view again
+    MAX_DIRTY = 100
+
+    # results view id -> Occur
+    instances = dict()
+
+    def __init__(self, window, pattern, views):
+        flags = re.MULTILINE
+        if not re.search(r'[A-Z]', pattern):
+            flags |= re.IGNORECASE
+        self.regex = re.compile(pattern, flags)
+        self.pattern = pattern
+        self.window = window
+        self.views = dict((v.id(), v) for v in views)
+        self.order = [v.id() for v in views]
+
+        # per view: the section text waiting to be applied, the section size and rows, and the
+        # source position of each matching line
+        self.texts = dict()
+        self.sizes = dict()
+        self.rows = dict()
+        self.positions = dict()
+        self.generations = dict()
+        self.header = ""
+
+        # per view: (line number, text) of each matching line as of the last search, matching the
+        # regions under key, where the selections started before the last command, and the views
+        # which need searching again from scratch
+        self.matches = dict()
+        self.before = dict()
+        self.full = set()
+
+        results = self.results = window.new_file()
+        results.set_name(self.RESULTS_NAME)
+        results.set_scratch(True)
+        results.set_read_only(True)
+        results.settings().set("jove_occur", True)
+        results.settings().set("word_wrap", False)
+        self.key = "jove_occur_%d" % (results.id(),)
+        self.dirty_key = self.key + "_dirty"
+        Occur.instances[results.id()] = self
+
+    def start(self):
+        self.header = self.format_header()
+        self.results.run_command("append", {"characters": self.header, "force": True})
+        self.search_views(self.order)
+
+    #
+    # Search the whole of each of the views with id in vids, on the worker thread pool.
+    #
+    def search_views(self, vids):
+        views = [self.views[vid] for vid in vids]
+        snapshots = [(v.id(), v.change_count(), v.substr(sublime.Region(0, v.size()))) for v in views]
+
+        def search_all():
+            pool = get_thread_pool()
+            regex = self.regex
+            texts = [text for vid, change_count, text in snapshots]
+            results = pool.map(lambda text: search_lines(text, regex), texts)
+            for (vid, change_count, text), matches in zip(snapshots, results):
+                sublime.set_timeout(lambda vid=vid, change_count=change_count, matches=matches:
+                                    self.searched(vid, change_count, matches), 0)
+        threading.Thread(target=search_all).start()
+
+    #
+    # Use the matches from searching the whole of view vid, unless it has changed since.
+    #
+    def searched(self, vid, change_count, matches):
+        view = self.views[vid]
+        if not view.is_valid():
+            return
+        if view.change_count() != change_count:
+            self.full.add(vid)
+            self.refresh(view)
+            return
+        view.erase_regions(self.dirty_key)
+        self.set_matches(vid, matches)
+
+    #
+    # Remember the matches, [(line number, line start, text)], for view vid and schedule them to
+    # be put in the results view.
+    #
+    def set_matches(self, vid, matches):
+        view = self.views[vid]
+        regions = [sublime.Region(start, start + len(text)) for number, start, text in matches]
+        view.add_regions(self.key, regions, "", "", sublime.HIDDEN)
+        self.matches[vid] = [(number, text) for number, start, text in matches]
+        self.queue_section(vid, matches)
+
+    #
+    # Format the section for view id vid and schedule it to be put in the results view. Can be
+    # called from any thread.
+    #
+    def queue_section(self, vid, matches):
+        view = self.views[vid]
+        if matches:
+            name = view.file_name() or view.name() or "untitled"
+            lines = ["%s: %d matching lines\n" % (name, len(matches))]
+            lines.extend("%7d: %s\n" % (number, text) for number, start, text in matches)
+            lines.append("\n")
+            text = "".join(lines)
+        else:
+            text = ""
+
+        def apply():
+            self.texts[vid] = (text, len(matches) + 2 if matches else 0, [m[1] for m in matches])
+            if self.results.is_valid():
+                self.results.run_command("jove_occur_update", {"view_id": vid})
+        sublime.set_timeout(apply, 0)
+
+    #
+    # Put the queued text for vid in the results view, replacing its old section. Called from a
+    # text command on the results view.
+    #
+    def apply(self, edit, vid):
+        if vid not in self.texts:
+            return
+        text, rows, positions = self.texts.pop(vid)
+        results = self.results
+        start = self.section_start(vid)
+        results.set_read_only(False)
+        results.replace(edit, sublime.Region(start, start + self.sizes.get(vid, 0)), text)
+        self.sizes[vid] = len(text)
+        self.rows[vid] = rows
+        self.positions[vid] = positions
+        header = self.format_header()
+        results.replace(edit, sublime.Region(0, len(self.header)), header)
+        self.header = header
+        results.set_read_only(True)
+
+    def format_header(self):
+        lines = sum(len(p) for p in self.positions.values())
+        views = len([p for p in self.positions.values() if p])
+        return "%d matching lines for \"%s\" in %d buffers (%d searched)\n\n" % (lines, self.pattern, views,
+                                                                                 len(self.order))
+
+    def section_start(self, vid):
+        start = len(self.header)
+        for v in self.order:
+            if v == vid:
+                break
+            start += self.sizes.get(v, 0)
+        return start
+
+    #
+    # Returns the (view, position) of the match on the specified row of the results, or None.
+    #
+    def locate(self, row):
+        row -= 2
+        for vid in self.order:
+            rows = self.rows.get(vid, 0)
+            if row < rows:
+                positions = self.positions[vid]
+                index = max(0, min(row - 1, len(positions) - 1))
+                return self.views[vid], positions[index]
+            row -= rows
+        return None
+
+    #
+    # Schedule a new search of view, which has changed.
+    #
+    def refresh(self, view):
+        vid = view.id()
+        generation = self.generations[vid] = self.generations.get(vid, 0) + 1
+
+        def search():
+            if self.generations.get(vid) != generation or not view.is_valid():
+                return
+            if vid in self.full or vid not in self.matches:
+                self.full.discard(vid)
+                self.search_views([vid])
+            else:
+                self.update(view)
+        sublime.set_timeout(search, self.REFRESH_DELAY)
+
+    #
+    # Search the modified lines of view again, keeping the matches between them.
+    #
+    def update(self, view):
+        vid = view.id()
+        # the lines may have been joined to their neighbours since they were modified
+        dirty = []
+        for region in sorted(view.get_regions(self.dirty_key), key=lambda r: r.begin()):
+            region = view.line(region)
+            if dirty and region.begin() <= dirty[-1].end():
+                dirty[-1] = dirty[-1].cover(region)
+            else:
+                dirty.append(region)
+        view.erase_regions(self.dirty_key)
+        if not dirty:
+            return
+        lines = view.get_regions(self.key)
+        old = self.matches[vid]
+        regex = self.regex
+        matches = []
+        index = 0
+
+        def keep(end):
+            # the old matches before end, with their line numbers shifted by the lines added or
+            # removed before them
+            nonlocal index
+            shift = None
+            while index < len(lines) and lines[index].end() < end:
+                number, text = old[index]
+                if shift is None:
+                    shift = view.rowcol(lines[index].begin())[0] + 1 - number
+                matches.append((number + shift, lines[index].begin(), text))
+                index += 1
+
+        for region in dirty:
+            keep(region.begin())
+            while index < len(lines) and lines[index].begin() <= region.end():
+                index += 1
+            first = view.rowcol(region.begin())[0]
+            matches.extend((first + number, region.begin() + start, text)
+                           for number, start, text in search_lines(view.substr(region), regex))
+        keep(view.size() + 1)
+        self.set_matches(vid, matches)
+
+    #
+    # Remember where the selections start before a command, so on_modified knows which lines it
+    # replaced.
+    #
+    @classmethod
+    def on_text_command(cls, view):
+        for occur in cls.instances.values():
+            if view.id() in occur.views:
+                occur.before[view.id()] = [r.begin() for r in view.sel()]
+
+    #
+    # Remember the lines from where each selection started to where its cursor is now, and
+    # schedule a refresh.
+    #
+    @classmethod
+    def on_modified(cls, view):
+        for occur in cls.instances.values():
+            if view.id() in occur.views:
+                occur.add_dirty(view)
+                occur.refresh(view)
+
+    def add_dirty(self, view):
+        vid = view.id()
+        if vid in self.full:
+            return
+        dirty = view.get_regions(self.dirty_key)
+        selection = view.sel()
+        before = self.before.get(vid, [])
+        if len(before) != len(selection):
+            before = [r.begin() for r in selection]
+        for cursor, start in zip(selection, before):
+            line = view.line(sublime.Region(min(start, cursor.begin()), cursor.end()))
+            # merge it with the regions it touches
+            others = []
+            for d in dirty:
+                if d.begin() <= line.end() and line.begin() <= d.end():
+                    line = line.cover(d)
+                else:
+                    others.append(d)
+            dirty = others + [line]
+        if len(dirty) > self.MAX_DIRTY:
+            self.full.add(vid)
+            view.erase_regions(self.dirty_key)
+        else:
+            view.add_regions(self.dirty_key, dirty, "", "", sublime.HIDDEN)
+
+    @classmethod
+    def on_view_closed(cls, view):
+        occur = cls.instances.pop(view.id(), None)
+        if occur is not None:
+            for source in occur.views.values():
+                if source.is_valid():
+                    source.erase_regions(occur.key)
+                    source.erase_regions(occur.dirty_key)
@@ -0,0 +1,131 @@
+#
+# Rectangle operations on lines of text. A rectangle is the columns from left up to (not including)
+# right on a range of lines. Columns are display columns, so tabs count as the distance to the next
+# tab stop. A tab which straddles either edge of the rectangle is turned into spaces first, just
+# like emacs does.
+#
+# Each operation takes the list of lines and returns the new list, so the caller can read the whole
+# block once and replace it with a single edit.
+#
+class Rectangle:
+    def __init__(self, left, right, tab_size):
+        self.left = min(left, right)
+        self.right = max(left, right)
+        self.tab_size = tab_size
+
+    #
+    # Returns (line, start, end, width) where start and end are the indexes of the rectangle's left
+    # and right edges in the (possibly detabbed) line, and width is the display width of the line.
+    # The edges are clamped to the end of a short line.
+    #
+    def locate(self, line):
+        left = self.left
+        right = self.right
+        if "\t" not in line:
+            n = len(line)
+            return line, min(left, n), min(right, n), n
+
+        tab_size = self.tab_size
+        chars = []
+        col = 0
+        start = end = None
+        for ch in line:
+            if ch == "\t":
+                width = tab_size - col % tab_size
+                if col < left < col + width or col < right < col + width:
+                    pieces = [(" ", 1)] * width
+                else:
+                    pieces = [(ch, width)]
+            else:
+                pieces = [(ch, 1)]
+            for piece, width in pieces:
+                if start is None and col >= left:
+                    start = len(chars)
+                if end is None and col >= right:
+                    end = len(chars)
+                chars.append(piece)
+                col += width
+        n = len(chars)
+        return "".join(chars), n if start is None else start, n if end is None else end, col
+
+    #
+    # Removes the rectangle from lines. Returns (new_lines, killed_lines) where the killed lines are
+    # padded with spaces to the width of the rectangle.
+    #
+    def delete(self, lines):
+        size = self.right - self.left
+        result = []
+        killed = []
+        for line in lines:
+            line, start, end, width = self.locate(line)
+            text = line[start:end]
+            pad = size - (min(width, self.right) - min(width, self.left))
+            killed.append(text + " " * pad if pad > 0 else text)
+            result.append(line[:start] + line[end:])
+        return result, killed
+
+    #
+    # Returns the contents of the rectangle, as delete does, without changing anything.
+    #
+    def extract(self, lines):
+        return self.delete(lines)[1]
+
+    #
+    # Replaces the rectangle with spaces. Short lines are not extended.
+    #
+    def clear(self, lines):
+        result = []
+        for line in lines:
+            line, start, end, width = self.locate(line)
+            rest = line[end:]
+            if rest:
+                rest = " " * (self.right - self.left) + rest
+            result.append(line[:start] + rest)
+        return result
+
+    #
+    # Inserts spaces to fill the rectangle, pushing the rest of each line to the right. Lines which
+    # don't reach the left edge are left alone.
+    #
+    def open(self, lines):
+        spaces = " " * (self.right - self.left)
+        result = []
+        for line in lines:
+            line, start, end, width = self.locate(line)
+            if width >= self.left:
+                line = line[:start] + spaces + line[start:]
+            result.append(line)
+        return result
+
+    #
+    # Inserts the rectangle text (one string per line) at the left edge of lines, padding lines
+    # which are too short with spaces. If there are more strings than lines, new lines are added.
+    # Returns the new lines and the index just after the inserted text on the last line.
+    #
+    def insert(self, lines, texts):
+        lines = lines + [""] * (len(texts) - len(lines))
+        result = []
+        end = 0
+        for line, text in zip(lines, texts):
+            line, start, _, width = self.locate(line)
+            if width < self.left:
+                line += " " * (self.left - width)
+                start = len(line)
+            result.append(line[:start] + text + line[start:])
+            end = start + len(text)
+        result.extend(lines[len(texts):])
+        return result, end
+
+#
+# Returns the display column of index in line.
+#
+def display_column(line, index, tab_size):
+    if "\t" not in line:
+        return index
+    col = 0
+    for ch in line[:index]:
+        if ch == "\t":
+            col += tab_size - col % tab_size
+        else:
+            col += 1
+    return col
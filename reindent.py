@@ -0,0 +1,125 @@
+import re
+
+#
+# Computes indentation for a run of lines in one pass. The rules come from the syntax's indentation
+# preferences (increaseIndentPattern and friends), which are the same ones sublime's own reindent
+# command uses. If a syntax has no rules, or they use regex features python does not support, we
+# fall back to counting brackets.
+#
+class Reindenter:
+    OPENERS = "([{"
+    CLOSERS = ")]}"
+
+    def __init__(self, tab_size=4, use_spaces=True, increase=None, decrease=None, indent_next=None,
+                 unindented=None, keep_dedents=False):
+        self.tab_size = tab_size
+        # in languages where indentation is syntax (python) we cannot know where a block ends, so a
+        # line that is already dedented relative to what we compute is left where it is
+        self.keep_dedents = keep_dedents
+        self.use_spaces = use_spaces
+        self.increase = self.compile(increase)
+        self.decrease = self.compile(decrease)
+        self.indent_next = self.compile(indent_next)
+        self.unindented = self.compile(unindented)
+        self.use_brackets = self.increase is None and self.decrease is None
+
+    @staticmethod
+    def compile(pattern):
+        if not pattern:
+            return None
+        try:
+            return re.compile(pattern)
+        except re.error:
+            return None
+
+    #
+    # Returns the width in columns of the leading white space of line and the index of the first
+    # non-white space character.
+    #
+    def measure(self, line):
+        width = 0
+        index = 0
+        for ch in line:
+            if ch == " ":
+                width += 1
+            elif ch == "\t":
+                width += self.tab_size - (width % self.tab_size)
+            else:
+                break
+            index += 1
+        return width, index
+
+    def indent_string(self, width):
+        if self.use_spaces:
+            return " " * width
+        return "\t" * (width // self.tab_size) + " " * (width % self.tab_size)
+
+    def opens(self, line):
+        if self.use_brackets:
+            depth = 0
+            for ch in line:
+                if ch in self.OPENERS:
+                    depth += 1
+                elif ch in self.CLOSERS and depth > 0:
+                    depth -= 1
+            return depth > 0
+        return self.increase is not None and self.increase.search(line) is not None
+
+    def closes(self, line):
+        if self.use_brackets:
+            return line[:1] in self.CLOSERS
+        return self.decrease is not None and self.decrease.search(line) is not None
+
+    #
+    # Compute the new text of each of the specified lines. Context is the closest non-blank line
+    # before the first line (or None). Only lines whose index is in targets are reindented, unless
+    # targets is None in which case all of them are. Other lines are left alone but still serve as
+    # context for the lines after them.
+    #
+    # Returns a list of (index, old_indent_length, new_indent) for the lines which need to change.
+    #
+    def reindent(self, lines, context=None, targets=None):
+        changes = []
+        tab = self.tab_size
+        prev = context
+        prev_width = self.measure(context)[0] if context is not None else 0
+        oneshot = None
+
+        for index, line in enumerate(lines):
+            old_width, old_length = self.measure(line)
+            text = line[old_length:]
+            if targets is not None and index not in targets:
+                if text:
+                    prev, prev_width, oneshot = line, old_width, None
+                continue
+            if not text:
+                # blank lines lose their white space and do not count as context
+                if old_length > 0:
+                    changes.append((index, old_length, ""))
+                continue
+            if self.unindented is not None and self.unindented.search(text):
+                continue
+
+            width = prev_width
+            opened = False
+            if prev is not None:
+                if self.opens(prev):
+                    opened = True
+                    width += tab
+                elif self.indent_next is not None and self.indent_next.search(prev):
+                    oneshot = prev_width
+                    width += tab
+                elif oneshot is not None:
+                    width = oneshot
+                    oneshot = None
+            if self.closes(text):
+                width -= tab
+            if self.keep_dedents and not opened:
+                width = min(width, old_width)
+            width = max(width, 0)
+
+            indent = self.indent_string(width)
+            if indent != line[:old_length]:
+                changes.append((index, old_length, indent))
+            prev, prev_width = indent + text, width
+        return changes
@@ -0,0 +1,148 @@
+import os
+
+#
+# A buffer to switch to, with what fuzzy matching needs worked out once: the lower case text we
+# match against (the path, or the name of an unsaved buffer), where its base name starts, and the
+# positions which start a path segment or a word within one.
+#
+class Candidate:
+    SEPARATORS = "/\\_-. "
+
+    def __init__(self, view_id, name, path):
+        self.view_id = view_id
+        self.name = name
+        self.path = path
+        text = (path or name).lower()
+        self.text = text
+        self.base = len(text) - len(os.path.basename(text))
+        self.starts = set(i for i in range(len(text)) if i == 0 or text[i - 1] in self.SEPARATORS)
+
+    #
+    # Returns how well query (lower case) matches, or None if it doesn't. The characters of query
+    # have to appear in order. Matches in the base name, at the start of a segment and runs of
+    # consecutive characters score higher.
+    #
+    def score(self, query):
+        if not query:
+            return 0
+        score = self.match(query, self.base)
+        if score is not None:
+            return score + 2 * len(query)
+        return self.match(query, 0)
+
+    def match(self, query, pos):
+        text = self.text
+        starts = self.starts
+        score = 0
+        last = -2
+        for ch in query:
+            pos = text.find(ch, pos)
+            if pos < 0:
+                return None
+            if pos in starts:
+                score += 2
+            if pos == last + 1:
+                score += 1
+            last = pos
+            pos += 1
+        return score
+
+#
+# Buffers in most recently used order, for switching between them. The order is kept up to date as
+# views are activated, and the candidates are only made again when a buffer's name or path changes.
+#
+# A switch ranks the candidates as the query is typed. Each ranking only has to score the candidates
+# which matched the query before it when the new query extends that one, and backing up goes back to
+# the rankings already made, so the work for a keystroke is bounded by what survived the last one.
+#
+class BufferSwitcher:
+    # view ids, most recent first
+    recent = []
+
+    # view id -> Candidate
+    candidates = dict()
+
+    @classmethod
+    def on_activated(cls, view):
+        vid = view.id()
+        recent = cls.recent
+        if recent and recent[0] == vid:
+            return
+        if vid in recent:
+            recent.remove(vid)
+        recent.insert(0, vid)
+
+    @classmethod
+    def on_view_closed(cls, view):
+        vid = view.id()
+        if vid in cls.recent:
+            cls.recent.remove(vid)
+        cls.candidates.pop(vid, None)
+
+    #
+    # Returns the candidate for view, making a new one if it's new or has been renamed.
+    #
+    @classmethod
+    def get_candidate(cls, view):
+        vid = view.id()
+        path = view.file_name() or ""
+        name = os.path.basename(path) if path else (view.name() or "untitled")
+        candidate = cls.candidates.get(vid)
+        if candidate is None or candidate.path != path or candidate.name != name:
+            candidate = cls.candidates[vid] = Candidate(vid, name, path)
+        return candidate
+
+    #
+    # Views are the buffers to choose from. The current view goes last, so the default is the
+    # buffer used before it.
+    #
+    def __init__(self, views, current=None):
+        order = dict((vid, index) for index, vid in enumerate(self.recent))
+        views = sorted(views, key=lambda v: (v.id() == current, order.get(v.id(), len(order))))
+        self.views = dict((v.id(), v) for v in views)
+        candidates = [self.get_candidate(v) for v in views]
+        # (query, the candidates matching it in most recently used order, ranked), each query
+        # extending the one before
+        self.stack = [("", candidates, candidates)]
+
+    #
+    # Returns the candidates matching query, best first. Equal scores keep the most recently used
+    # order.
+    #
+    def rank(self, query):
+        query = query.lower()
+        stack = self.stack
+        while len(stack) > 1 and not query.startswith(stack[-1][0]):
+            stack.pop()
+        if query == stack[-1][0]:
+            return stack[-1][2]
+        scored = []
+        for index, candidate in enumerate(stack[-1][1]):
+            score = candidate.score(query)
+            if score is not None:
+                scored.append((-score, index, candidate))
+        survivors = [candidate for score, index, candidate in scored]
+        scored.sort()
+        ranked = [candidate for score, index, candidate in scored]
+        stack.append((query, survivors, ranked))
+        return ranked
+
+    def get_view(self, candidate):
+        return self.views.get(candidate.view_id)
+
+    #
+    # Returns the names of the candidates for display, adding the parent directory to the names
+    # which aren't unique among them.
+    #
+    @staticmethod
+    def display_names(candidates):
+        counts = dict()
+        for candidate in candidates:
+            counts[candidate.name] = counts.get(candidate.name, 0) + 1
+        names = []
+        for candidate in candidates:
+            name = candidate.name
+            if counts[name] > 1 and candidate.path:
+                name = "%s<%s>" % (name, os.path.basename(os.path.dirname(candidate.path)))
+            names.append(name)
+        return names
@@ -0,0 +1,234 @@
+import json, mmap, os, re, threading, time, hashlib
+
+from .workers import get_thread_pool
+
+#
+# Definitions we know how to find, for most of the usual languages: keyword introduced definitions
+# (def, class, function, func, fn, struct, ...), go methods, and C-style functions and macros which
+# start at the beginning of a line.
+#
+TAG_RE = re.compile(r'^[ \t]*(?:(?:export|public|private|protected|static|async|abstract|final|pub|default)[ \t]+)*'
+                    r'(?:def|class|function|func|fn|struct|enum|trait|interface|type|module|sub|record|object)'
+                    r'[ \t]+(?:\([^)]*\)[ \t]*)?([A-Za-z_$][\w$]*)'
+                    r'|^#[ \t]*define[ \t]+(\w+)'
+                    r'|^[A-Za-z_][\w:<>,*& \t]*?[ \t*&]\**([A-Za-z_]\w*)[ \t]*\([^;\n]*$', re.MULTILINE)
+
+DEFAULT_EXTENSIONS = [
+    ".py", ".js", ".jsx", ".ts", ".tsx", ".go", ".rs", ".rb", ".pl", ".pm", ".java", ".kt", ".scala",
+    ".c", ".h", ".cc", ".cpp", ".cxx", ".hpp", ".hh", ".m", ".mm", ".cs", ".swift", ".php", ".lua",
+]
+SKIP_DIRS = set([".git", ".hg", ".svn", "node_modules", "__pycache__", ".tox", ".venv", "venv"])
+
+#
+# Returns [(name, line)] for the definitions in the file at path.
+#
+def scan_file(path):
+    try:
+        with open(path, encoding="utf-8", errors="replace") as f:
+            text = f.read()
+    except (OSError, IOError):
+        return []
+    result = []
+    line = 1
+    counted = 0
+    for m in TAG_RE.finditer(text):
+        name = m.group(1) or m.group(2) or m.group(3)
+        if name in ("if", "for", "while", "switch", "return", "sizeof"):
+            continue
+        line += text.count("\n", counted, m.start())
+        counted = m.start()
+        result.append((name, line))
+    return result
+
+def scan_files(paths):
+    return [scan_file(path) for path in paths]
+
+#
+# A project symbol index, stored in the cache directory as two files:
+#
+#   NAME.files  json list of [path, mtime] for every file we scanned
+#   NAME.tags   one "symbol<TAB>path<TAB>line" line per definition, sorted by symbol
+#
+# Lookups map the tags file into memory and bisect it for the symbol, so they don't depend on the
+# size of the project. Refreshing walks the folders, rescans only the files whose mtime changed
+# (in the thread pool, in batches) and writes a new tags file which replaces the old one.
+#
+class TagIndex:
+    BATCH_SIZE = 100
+
+    # tuple of folders -> TagIndex
+    indexes = dict()
+
+    def __init__(self, folders, cache_dir, extensions):
+        self.folders = folders
+        self.extensions = set(extensions)
+        key = hashlib.md5("\n".join(folders).encode("utf-8")).hexdigest()
+        self.base = os.path.join(cache_dir, key)
+        self.lock = threading.Lock()
+        self.refreshing = False
+        self.refreshed = 0
+        self.callbacks = []
+
+    @classmethod
+    def get(cls, folders, cache_dir, extensions):
+        key = tuple(folders)
+        index = cls.indexes.get(key)
+        if index is None:
+            index = cls.indexes[key] = TagIndex(list(folders), cache_dir, extensions)
+        return index
+
+    def exists(self):
+        return os.path.exists(self.base + ".tags")
+
+    #
+    # Returns [(path, line)] for the definitions of name, or an empty list.
+    #
+    def lookup(self, name):
+        try:
+            with open(self.base + ".tags", "rb") as f:
+                if os.fstat(f.fileno()).st_size == 0:
+                    return []
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                try:
+                    lines = find_lines(data, name.encode("utf-8") + b"\t")
+                finally:
+                    data.close()
+        except (OSError, IOError, ValueError):
+            return []
+        result = []
+        for line in lines:
+            symbol, path, row = line.decode("utf-8").split("\t")
+            result.append((path, int(row)))
+        return result
+
+    #
+    # Bring the index up to date in a background thread and then call callback(index, message).
+    # Callbacks for refreshes requested while one is running are called when it finishes.
+    #
+    def refresh(self, callback=None):
+        with self.lock:
+            if callback:
+                self.callbacks.append(callback)
+            if self.refreshing:
+                return
+            self.refreshing = True
+        threading.Thread(target=self.update).start()
+
+    def update(self):
+        start = time.time()
+        try:
+            message = self.rebuild()
+        except (OSError, IOError) as e:
+            message = "Could not build the tag index: %s" % (e,)
+        message += " in %.1fs" % (time.time() - start,)
+        with self.lock:
+            self.refreshing = False
+            self.refreshed = time.time()
+            callbacks = self.callbacks
+            self.callbacks = []
+        for callback in callbacks:
+            callback(self, message)
+
+    def rebuild(self):
+        # what we had last time
+        old_files = dict()
+        old_tags = dict()
+        try:
+            with open(self.base + ".files", encoding="utf-8") as f:
+                files = json.load(f)
+            with open(self.base + ".tags", encoding="utf-8") as f:
+                for line in f:
+                    symbol, path, row = line.rstrip("\n").split("\t")
+                    old_tags.setdefault(path, []).append((symbol, int(row)))
+            old_files = dict((path, mtime) for path, mtime in files)
+        except (OSError, IOError, ValueError):
+            old_tags = dict()
+
+        # what we have now, and which files need scanning
+        files = []
+        changed = []
+        for path, mtime in self.walk():
+            files.append([path, mtime])
+            if old_files.get(path) != mtime:
+                changed.append(path)
+
+        # scan the changed files in batches in the thread pool (not processes: forking the plugin
+        # host, which has threads of its own, isn't safe). The scanning holds the GIL, so this is
+        # about one core's worth, but it keeps the UI thread free.
+        batches = [changed[i:i + self.BATCH_SIZE] for i in range(0, len(changed), self.BATCH_SIZE)]
+        results = list(get_thread_pool().map(scan_files, batches))
+        scanned = dict()
+        for batch, result in zip(batches, results):
+            scanned.update(zip(batch, result))
+
+        lines = []
+        for path, mtime in files:
+            tags = scanned[path] if path in scanned else old_tags.get(path, [])
+            lines.extend("%s\t%s\t%d\n" % (symbol, path, row) for symbol, row in tags)
+        lines.sort(key=lambda line: line.encode("utf-8"))
+
+        # replace the files in one go (lookups only read the tags file)
+        os.makedirs(os.path.dirname(self.base), exist_ok=True)
+        write_file(self.base + ".tags.tmp", "".join(lines))
+        write_file(self.base + ".files.tmp", json.dumps(files))
+        os.replace(self.base + ".tags.tmp", self.base + ".tags")
+        os.replace(self.base + ".files.tmp", self.base + ".files")
+        return "Indexed %d tags in %d files (%d rescanned)" % (len(lines), len(files), len(changed))
+
+    #
+    # Yields (path, mtime) for each source file in our folders.
+    #
+    def walk(self):
+        extensions = self.extensions
+        for folder in self.folders:
+            for root, dirs, names in os.walk(folder):
+                dirs[:] = [d for d in dirs if d not in SKIP_DIRS and not d.startswith(".")]
+                for name in names:
+                    if os.path.splitext(name)[1] in extensions:
+                        path = os.path.join(root, name)
+                        try:
+                            yield path, os.stat(path).st_mtime
+                        except OSError:
+                            pass
+
+def write_file(path, text):
+    with open(path, "w", encoding="utf-8", newline="\n") as f:
+        f.write(text)
+
+#
+# Returns the lines in data (sorted, newline terminated bytes) which start with prefix. We bisect
+# on byte offsets, moving each probe to the start of the following line.
+#
+def find_lines(data, prefix):
+    size = len(data)
+
+    def line_at(pos):
+        # the start of the first line starting at or after pos
+        if pos == 0:
+            return 0
+        found = data.find(b"\n", pos - 1)
+        return size if found < 0 else found + 1
+
+    lo = 0
+    hi = size
+    while lo < hi:
+        mid = line_at((lo + hi) // 2)
+        if mid >= hi:
+            # the line starting at lo is the only one left
+            mid = lo
+        end = data.find(b"\n", mid)
+        if end < 0:
+            end = size
+        if data[mid:end] < prefix:
+            lo = end + 1
+        else:
+            hi = mid
+    result = []
+    pos = lo
+    while pos < size and data[pos:pos + len(prefix)] == prefix:
+        end = data.find(b"\n", pos)
+        if end < 0:
+            end = size
+        result.append(data[pos:end])
+        pos = end + 1
+    return result
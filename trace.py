@@ -0,0 +1,71 @@
+import json, time
+import sublime
+
+#
+# An opt-in recording of an editing session, for attaching to bug reports and replaying with
+# bench/replay.py. The same top-level commands a keyboard macro would record are written to a file
+# as JSON, one line each. The first line is a header:
+#
+#   {"trace": VERSION, "sublime": version, "platform": platform, "started": time}
+#
+# and then each command is:
+#
+#   [ms since the start, view, command, args, cursors, buffer size, point, ms taken]
+#
+# where view numbers the views in the order they first appear, cursors, buffer size and point (the
+# first cursor) are from before the command ran, and ms taken is null for sublime's own commands.
+# The buffer text itself is not recorded, but typed characters are (in the args of insert).
+#
+class Trace:
+    VERSION = 1
+    FLUSH_EVERY = 100
+
+    # the trace being recorded, if any
+    current = None
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "w", encoding="utf-8")
+        self.started = time.time()
+        # view id -> number in the trace
+        self.views = dict()
+        # the number of commands recorded
+        self.count = 0
+        self.write({"trace": self.VERSION, "sublime": sublime.version(), "platform": sublime.platform(),
+                    "started": time.strftime("%Y-%m-%d %H:%M:%S")})
+
+    @classmethod
+    def start(cls, path):
+        cls.stop()
+        cls.current = Trace(path)
+
+    #
+    # Stop tracing. Returns the trace which was being recorded, or None.
+    #
+    @classmethod
+    def stop(cls):
+        trace = cls.current
+        if trace is not None:
+            cls.current = None
+            trace.file.close()
+        return trace
+
+    #
+    # Returns what we record about view before a command: (time, cursors, buffer size, point).
+    #
+    @staticmethod
+    def snapshot(view):
+        selection = view.sel()
+        return (time.time(), len(selection), view.size(), selection[0].b if len(selection) else -1)
+
+    def record(self, view, cmd, args, snapshot, elapsed=None):
+        index = self.views.setdefault(view.id(), len(self.views))
+        started, cursors, size, point = snapshot
+        self.write([int((started - self.started) * 1000), index, cmd, args or {}, cursors, size, point,
+                    None if elapsed is None else round(elapsed * 1000, 3)])
+        self.count += 1
+        if self.count % self.FLUSH_EVERY == 0:
+            self.file.flush()
+
+    def write(self, entry):
+        self.file.write(json.dumps(entry, separators=(",", ":")) + "\n")
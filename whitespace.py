@@ -0,0 +1,71 @@
+import re
+
+#
+# White space cleanup. Each function looks at some text (which starts at the beginning of a line)
+# and returns the edits to make as a sorted list of non-overlapping (start, end, replacement)
+# tuples, with offsets into the text. The caller reads the text once and makes all the edits in
+# one pass.
+#
+TRAILING_RE = re.compile(r'[ \t]+$', re.MULTILINE)
+INDENT_RE = re.compile(r'^[ \t]+', re.MULTILINE)
+TABS_RE = re.compile(r' *\t[ \t]*')
+
+def trailing_whitespace_edits(text):
+    return [(m.start(), m.end(), "") for m in TRAILING_RE.finditer(text)]
+
+#
+# Replace the white space around each of the offsets with replacement (e.g., "" to delete it or " "
+# for just one space). Offsets in the same run of white space make one edit. Unlike the others this
+# takes a function returning the character at an offset ("\x00" outside the text), so only the runs
+# of white space themselves need to be read.
+#
+def horizontal_space_edits(char, offsets, replacement=""):
+    edits = []
+    for offset in sorted(set(offsets)):
+        start = offset
+        while char(start - 1) in " \t":
+            start -= 1
+        end = offset
+        while char(end) in " \t":
+            end += 1
+        if edits and start < edits[-1][1]:
+            continue
+        if "".join(char(pos) for pos in range(start, end)) != replacement:
+            edits.append((start, end, replacement))
+    return edits
+
+#
+# Use tabs for the indentation of each line, as far as possible. Only indentation is changed, so
+# spaces inside strings and alignment after the code are left alone.
+#
+def tabify_edits(text, tab_size):
+    edits = []
+    for m in INDENT_RE.finditer(text):
+        indent = m.group(0)
+        width = len(indent.expandtabs(tab_size))
+        new = "\t" * (width // tab_size) + " " * (width % tab_size)
+        if new != indent:
+            edits.append((m.start(), m.end(), new))
+    return edits
+
+#
+# Replace every tab with the spaces which take up the same columns.
+#
+def untabify_edits(text, tab_size):
+    edits = []
+    pos = 0
+    for line in text.split("\n"):
+        if "\t" in line:
+            col = 0
+            last = 0
+            for m in TABS_RE.finditer(line):
+                # there are no tabs between the runs, so each character is one column
+                col += m.start() - last
+                end = col
+                for ch in m.group(0):
+                    end += tab_size - end % tab_size if ch == "\t" else 1
+                edits.append((pos + m.start(), pos + m.end(), " " * (end - col)))
+                col = end
+                last = m.end()
+        pos += len(line) + 1
+    return edits
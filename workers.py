@@ -0,0 +1,19 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+#
+# Shared pool of worker threads for searching and indexing off the UI thread. The work is mostly
+# python, which holds the GIL, so the pool keeps the UI responsive rather than using more cores.
+#
+_thread_pool = None
+
+def cpu_count():
+    # (os.cpu_count is new in python 3.4)
+    count = os.cpu_count() if hasattr(os, "cpu_count") else None
+    return count or 2
+
+def get_thread_pool():
+    global _thread_pool
+    if _thread_pool is None:
+        _thread_pool = ThreadPoolExecutor(max_workers=cpu_count())
+    return _thread_pool